@@ -1,19 +1,34 @@
-import cv2
-import json
+import base64
+import binascii
+import collections
+import hmac
 import jsonpickle
 import os
-import requests
+import random
 import socket
-import numpy as np
+import threading
+import time
+import uuid
 
-from flask import Flask, request, Response
-from flask_socketio import SocketIO
-import requests
-import onnxruntime as ort
+from flask import Flask, g, has_request_context, request, Response
+from flask_socketio import SocketIO, emit
 from pathlib import Path
 
-from color_detection.detect import detect_color, detect_color_2
-from money_classification.model_inference import run_inference
+import config
+import tasks
+from cache import DiskBackend, MemoryBackend, ResultCache, fingerprint
+from image_utils import (BufferPool, decode_image, image_format, prepare_ocr_image,
+    unpack_images)
+from message_queue import BrokerManager
+from metrics import SIZE_BUCKETS, Registry
+from money_classification.batching import BatchScheduler
+from money_classification.model_inference import IMG_SIZE
+from money_classification.prefilter import MoneyPrefilter, find_bill
+from ocr.backends import GoogleBackend, LocalBackend, OCRError, OCRUnavailable
+from ocr.vision_client import ClientStats, VisionClient
+from profiling import ProfileStore, RequestProfile
+from streaming import FrameStream
+from workers import WorkerPool
 
 # Initialize flask app
 app = Flask(__name__)
@@ -21,13 +36,610 @@ app = Flask(__name__)
 # Configure socket IO
 # enables secure client connection
 app.config["SECRET_KEY"] = os.urandom(12)
-socketio = SocketIO(app)
+# Events reach clients connected to other server processes through the
+# message queue, if any
+if config.SOCKETIO_MESSAGE_QUEUE.startswith("local://"):
+    socketio = SocketIO(app, client_manager=BrokerManager(config.SOCKETIO_MESSAGE_QUEUE))
+else:
+    socketio = SocketIO(app, message_queue=config.SOCKETIO_MESSAGE_QUEUE or None)
+
+# Prometheus metrics, served on /metrics
+registry = Registry()
+request_seconds = registry.histogram("vizia_request_seconds",
+    "Time spent handling HTTP requests", ["route"])
+request_bytes = registry.histogram("vizia_request_bytes",
+    "Size of HTTP request bodies", ["route"], SIZE_BUCKETS)
+responses_total = registry.counter("vizia_responses_total",
+    "HTTP responses sent", ["route", "status"])
+requests_in_flight = registry.gauge("vizia_requests_in_flight",
+    "HTTP requests being handled", ["route"])
+stage_seconds = registry.histogram("vizia_stage_seconds",
+    "Time spent in each processing stage of a route", ["route", "stage"])
+money_batch_size = registry.histogram("vizia_money_batch_size",
+    "Images per money classification forward pass", buckets=(1, 2, 4, 8, 16, 32, 64))
+stream_frames_total = registry.counter("vizia_stream_frames_total",
+    "Frames received on Socket.IO streams, and frames dropped", ["operation", "outcome"])
+ocr_image_bytes = registry.histogram("vizia_ocr_image_bytes",
+    "Size of OCR images as received and as sent to the Vision API", ["stage"], SIZE_BUCKETS)
+ocr_bytes_saved = registry.counter("vizia_ocr_bytes_saved_total",
+    "Bytes removed from OCR images by preparing them before the Vision API")
+ocr_images_total = registry.counter("vizia_ocr_images_total",
+    "Images read by each OCR backend", ["backend"])
+ocr_fallbacks_total = registry.counter("vizia_ocr_fallbacks_total",
+    "OCR requests answered by the fallback backend, by the backend that failed", ["backend"])
+
+# Profiles of sampled requests, served on /admin/profiles
+profile_store = ProfileStore(config.PROFILING_MAX_PROFILES)
+
+
+def current_profile():
+    """
+    RequestProfile of the current request, or None if it is not profiled.
+    """
+    return g.get("profile") if has_request_context() else None
+
+
+# CPU-bound work runs on a pool of threads or processes, off the Socket.IO
+# event loop. Each process loads the color palette and ONNX model once, when
+# first needed or at startup, see preload.
+if config.WORKER_POOL == "process":
+    pool = WorkerPool("process", config.WORKER_POOL_SIZE or None,
+        socketio.async_mode, profiler=current_profile)
+
+    def classify_money_batch(batch):
+        return pool.submit(tasks.classify_money_task, batch).result()
+else:
+    pool = WorkerPool(config.WORKER_POOL, config.WORKER_POOL_SIZE or None,
+        socketio.async_mode, profiler=current_profile)
+    classify_money_batch = tasks.classify_money_task
+
+
+def run_money_batch(batch):
+    money_batch_size.observe(len(batch))
+    with stage_seconds.time(route="money_batcher", stage="onnx"):
+        return classify_money_batch(batch)
+
+# Concurrent /classify_money requests share batched forward passes
+money_batcher = BatchScheduler(run_money_batch, config.MONEY_MAX_BATCH_SIZE,
+    config.MONEY_MAX_WAIT_MS)
+
+# Skips the model for images without a bill, if enabled
+money_prefilter = MoneyPrefilter(config.MONEY_PREFILTER_MIN_EDGES,
+    config.MONEY_PREFILTER_MIN_AREA) if config.MONEY_PREFILTER else None
+
+
+def classify_money_image(img, route=None):
+    """
+    Class name of an RGB image, from the pre-filter if it finds no bill,
+    otherwise from the model through the money batcher. The route is needed
+    outside of a request, see timed.
+    """
+    if money_prefilter is not None:
+        with timed("prefilter", route):
+            img = money_prefilter.crop(img, pool.run(find_bill, img,
+                money_prefilter.min_edges, money_prefilter.min_area))
+        if img is None:
+            return "no_bill"
+
+    # Run inference on image, the batcher preprocesses it with its batch
+    with timed("inference", route):
+        return pool.wait(money_batcher.submit(img))
+
+# Read in Vision API key from env variable. OCR is unavailable without it.
+api_key = os.environ.get("GC_VISION_API_KEY")
+
+# Vision API client sharing pooled keep-alive connections between requests,
+# created by get_vision_client
+vision_client = None
+vision_client_lock = threading.Lock()
+
+
+def get_vision_client():
+    """
+    The Vision API client, created on first use. None if no API key is set.
+    """
+    global vision_client
+    if vision_client is None and api_key:
+        with vision_client_lock:
+            if vision_client is None:
+                vision_client = VisionClient(api_key, config.VISION_ENDPOINT,
+                    pool_size=config.VISION_POOL_SIZE,
+                    connect_timeout=config.VISION_CONNECT_TIMEOUT,
+                    read_timeout=config.VISION_READ_TIMEOUT,
+                    max_retries=config.VISION_MAX_RETRIES,
+                    backoff=config.VISION_BACKOFF)
+    return vision_client
+
+
+def preload():
+    """
+    Loads the color palette, the ONNX sessions and the Vision API client now
+    rather than on the first request that needs them. Process workers load
+    them when they start.
+    """
+    if config.WORKER_POOL == "process":
+        # Workers are started with the first task
+        pool.initializer = tasks.init_worker
+    else:
+        tasks.init_worker()
+    get_vision_client()
+
+if config.PRELOAD:
+    preload()
+
+# OCR backends, by name. The local models run on the worker pool.
+ocr_backends = {
+    "google": GoogleBackend(get_vision_client, config.VISION_MAX_BATCH_SIZE),
+    "local": LocalBackend(lambda images: pool.run(tasks.local_ocr_task, images),
+        tasks.local_ocr_configured(), config.OCR_LOCAL_LANGUAGE),
+}
+for name in filter(None, [config.OCR_BACKEND, config.OCR_FALLBACK]):
+    if name not in ocr_backends:
+        raise ValueError("Unknown OCR backend '{}', expected one of {}".format(
+            name, sorted(ocr_backends)))
+
+# Recent results, so re-sent frames skip processing
+if config.CACHE_BACKEND == "memory":
+    cache_backend = MemoryBackend(config.CACHE_MAX_ENTRIES, config.CACHE_MAX_BYTES)
+elif config.CACHE_BACKEND == "disk":
+    cache_backend = DiskBackend(config.CACHE_PATH, config.CACHE_MAX_ENTRIES,
+        config.CACHE_MAX_BYTES)
+else:
+    cache_backend = None
+result_cache = ResultCache(cache_backend, config.CACHE_TTL,
+    perceptual=config.CACHE_PERCEPTUAL, hash_size=config.CACHE_HASH_SIZE)
+
+# Settings that change the results of each kind of route. They are part of
+# the cache keys, so that a disk cache shared with servers configured
+# differently never serves their results.
+settings_fingerprints = {
+    "color": fingerprint([config.COLOR_PALETTE, config.COLOR_METRIC, config.COLOR_LUT_BITS,
+        config.COLOR_DECODE_MIN_PIXELS, config.COLOR_SAMPLE_PIXELS, config.COLOR_SAMPLE_METHOD,
+        config.COLOR_SAMPLE_RESIZE, config.COLOR_EXACT_COUNTS, config.COLOR_KMEANS_REUSE,
+        config.COLOR_KMEANS_RESTART_RATIO]),
+    "money": fingerprint([os.path.abspath(config.MONEY_MODEL_PATH), config.MONEY_MODEL_VARIANT,
+        config.MONEY_PREFILTER, config.MONEY_PREFILTER_MIN_EDGES,
+        config.MONEY_PREFILTER_MIN_AREA]),
+    "ocr": fingerprint([config.OCR_PREPARE, config.OCR_TEXT_MAX_SIZE,
+        config.OCR_DOCUMENT_MAX_SIZE, config.OCR_GRAYSCALE, config.OCR_JPEG_QUALITY,
+        config.OCR_LOCAL_DET_MODEL_PATH, config.OCR_LOCAL_REC_MODEL_PATH,
+        config.OCR_LOCAL_CHARSET_PATH, config.OCR_LOCAL_LANGUAGE]),
+}
+
+# Buffers request images are read into, see read_body. Buffers for batch
+# bodies larger than a single image are not kept.
+body_buffers = BufferPool(max_buffer_bytes=config.MAX_IMAGE_BYTES)
+
+# Frame streams of connected Socket.IO clients, by session id
+streams = {}
+
+# k-means state of the last frame of each client, when COLOR_KMEANS_REUSE is on
+kmeans_states = collections.OrderedDict()
+kmeans_states_lock = threading.Lock()
+
+
+def route_name():
+    """
+    Label of the current request's route in metrics, eg. "/detect_color".
+    """
+    return request.url_rule.rule if request.url_rule is not None else "unknown"
+
+
+def timed(stage, route=None):
+    """
+    Times a processing stage of the current request into vizia_stage_seconds.
+    Outside of a request, eg. for streamed frames, the route must be given.
+    """
+    if route is None:
+        route = route_name()
+    return stage_seconds.time(route=route, stage=stage)
+
+
+def json_response(response):
+    """
+    JSON encodes the response of a route.
+    """
+    with timed("encode"):
+        body = jsonpickle.encode(response)
+    return Response(
+        response = body,
+        status = 200,
+        mimetype = "application/json"
+    )
+
+
+def emit_result(path, message):
+    """
+    Emits the result of a route on a socketIO path.
+    """
+    with timed("emit"):
+        socketio.emit(path, message)
+
+
+def join_colors(color_names):
+    """
+    Convert list of colors into one string
+    Eg: ["Red", "Blue", "Green"] -> "Red, Blue, and Green"
+    """
+    color_text = ""
+    if len(color_names) == 1:
+        color_text = color_names[0]
+    else:
+        for idx, color in enumerate(color_names):
+            if idx == (len(color_names) - 1):
+                color_text += "and {}".format(color)
+            else:
+                color_text += "{}, ".format(color)
+    return color_text
+
+
+def detect_colors(img, k, client=None):
+    """
+    k-means color detection. With COLOR_KMEANS_REUSE, clustering continues
+    from the previous frame of the same client instead of starting over.
+
+    Args:
+        img : np array containing raw image data in RGB format
+        k : how many colors to return
+        client : identifies consecutive frames of the same camera, eg. the
+            socket_emit_path. None treats the image on its own.
+
+    Returns:
+        [color_names, rgb_array] as returned by detect_color
+    """
+    if not config.COLOR_KMEANS_REUSE or client is None:
+        return pool.run(tasks.detect_color_task, img, k)
+
+    with kmeans_states_lock:
+        previous = kmeans_states.get(client)
+    color_names, rgb_array, state = pool.run(tasks.track_color_task, img, k, previous)
+
+    with kmeans_states_lock:
+        kmeans_states[client] = state
+        kmeans_states.move_to_end(client)
+        while len(kmeans_states) > config.COLOR_KMEANS_MAX_CLIENTS:
+            kmeans_states.popitem(last=False)
+    return color_names, rgb_array
+
+
+def read_body(max_bytes):
+    """
+    Reads the request body into a buffer from the body buffer pool, which
+    goes back to the pool once the request is done. The size announced by
+    the Content-Length header is checked before anything is read.
+
+    Args:
+        max_bytes : largest body accepted
+
+    Returns:
+        memoryview of the body, only valid during the request, or None if it
+        is larger than max_bytes
+    """
+    length = request.content_length
+    if length is None:
+        # Chunked body, read one byte past the limit to detect larger ones
+        data = request.stream.read(max_bytes + 1)
+        return memoryview(data) if len(data) <= max_bytes else None
+    if length > max_bytes:
+        return None
+
+    buffer = body_buffers.acquire(length)
+    g.body_buffer = buffer
+    view = memoryview(buffer)[:length]
+    # Werkzeug streams before 2.3 have no readinto, their chunks are copied
+    readinto = getattr(request.stream, "readinto", None)
+    size = 0
+    while size < length:
+        if readinto is not None:
+            n = readinto(view[size:])
+        else:
+            chunk = request.stream.read(length - size)
+            n = len(chunk)
+            view[size:size + n] = chunk
+        if not n:
+            break
+        size += n
+    return view[:size]
+
+
+def body_too_large(max_bytes):
+    """
+    True if the request announces a body larger than max_bytes.
+    """
+    return request.content_length is not None and request.content_length > max_bytes
+
+
+def upload_image(data):
+    """
+    Image file sent to an OCR route, either as a JPEG or PNG file or base64
+    encoded. None if data is neither, or is empty.
+    """
+    if not isinstance(data, str) and image_format(data) is not None:
+        return data
+    try:
+        return base64.b64decode(data, validate=True) or None
+    except (binascii.Error, ValueError):
+        return None
+
+
+def ocr_images(images, detection_type, route=None):
+    """
+    Image files sent to an OCR route (see `upload_image`), shrunk in
+    parallel by image_utils.prepare_ocr_image if OCR_PREPARE is set. Images
+    that do not get smaller, or that cannot be decoded here, are kept as
+    received. The route is needed outside of a request, see timed.
+
+    Returns:
+        List with each image, None for images that are neither an image
+        file nor base64 encoded
+    """
+    files = [upload_image(data) for data in images]
+    if not config.OCR_PREPARE:
+        return files
+
+    max_size = config.OCR_DOCUMENT_MAX_SIZE if detection_type == "DOCUMENT_TEXT_DETECTION" \
+        else config.OCR_TEXT_MAX_SIZE
+    with timed("ocr_prepare", route):
+        prepared = pool.map(prepare_ocr_image, [data for data in files if data is not None],
+            max_size=max_size or None, grayscale=config.OCR_GRAYSCALE,
+            quality=config.OCR_JPEG_QUALITY)
+
+    results = []
+    prepared = iter(prepared)
+    for data in files:
+        if data is None:
+            results.append(None)
+            continue
+        smaller = next(prepared)
+        ocr_image_bytes.observe(len(data), stage="received")
+        if smaller is not None and len(smaller) < len(data):
+            ocr_bytes_saved.inc(len(data) - len(smaller))
+            data = smaller
+        ocr_image_bytes.observe(len(data), stage="sent")
+        results.append(data)
+    return results
+
+
+def ocr_available(backend):
+    """
+    True if the named OCR backend, or the fallback backend, can answer.
+    """
+    fallback = ocr_backends.get(config.OCR_FALLBACK)
+    return ocr_backends[backend].available() or \
+        (fallback is not None and fallback.available())
+
+
+def run_ocr(images, detection_type, backend, route=None):
+    """
+    Reads images with the named OCR backend. If that one times out, is
+    unreachable, fails on its side or is not configured, the OCR_FALLBACK
+    backend reads the images it did not, and the Vision API only gets
+    OCR_FALLBACK_TIMEOUT seconds in total when there is one. The route is
+    needed outside of a request, see timed.
+
+    Returns:
+        [results, name]: one {"text", "language"} dict per image, and the
+            name of the backend that read the last of them
+
+    Raises:
+        OCRError : if no backend could read the images
+    """
+    fallback = ocr_backends.get(config.OCR_FALLBACK) if config.OCR_FALLBACK != backend else None
+    if fallback is not None and not fallback.available():
+        fallback = None
+
+    primary = ocr_backends[backend]
+    try:
+        with timed(primary.stage, route):
+            results = primary.recognize(images, detection_type,
+                timeout=config.OCR_FALLBACK_TIMEOUT if fallback is not None else None)
+        ocr_images_total.inc(len(images), backend=backend)
+        return results, backend
+    except OCRUnavailable as error:
+        if fallback is None:
+            raise
+        done = error.results
+
+    ocr_images_total.inc(len(done), backend=backend)
+    ocr_fallbacks_total.inc(backend=backend)
+    with timed(fallback.stage, route):
+        rest = fallback.recognize(images[len(done):], detection_type)
+    ocr_images_total.inc(len(rest), backend=fallback.name)
+    return done + rest, fallback.name
+
+
+def ocr_error_response(error):
+    """
+    Response of an OCR route when the images could not be read.
+    """
+    if error.body is not None:
+        # If we got an error from the Vision API, just return it
+        return Response(
+            response = error.body,
+            status = error.status,
+            mimetype = "application/json"
+        )
+    return Response(status = error.status)
+
+
+def lookup_cache(endpoint, params, body, decode):
+    """
+    Looks up the result of an image route in the result cache.
+
+    Args:
+        endpoint : name of the route
+        params : request parameters that change the result
+        body : request image
+        decode : function returning the decoded request image, or None
+
+    Returns:
+        [key, response, img]: Cache key to store the result under, the cached
+            response or None, and the decoded image if it was needed. img is
+            None if the image could not be decoded, or if the result was
+            cached and the image did not need decoding.
+    """
+    img = None
+    if result_cache.perceptual:
+        # Perceptual keys are computed from the decoded image
+        with timed("decode"):
+            img = decode()
+        if img is None:
+            return None, None, None
+
+    with timed("cache"):
+        key = result_cache.key(endpoint, params, body, img)
+        response = result_cache.get(key)
+    if response is None and img is None:
+        with timed("decode"):
+            img = decode()
+    return key, response, img
+
+
+def request_images():
+    """
+    Images sent to a batch route, in order. Either as multipart/form-data
+    files, or as a length-prefixed body where each image is preceded by its
+    size as a 4 byte big-endian unsigned integer (see image_utils.pack_images).
+
+    Returns:
+        List of encoded images, or None if the body is malformed
+    """
+    if request.files:
+        return [f.read() for _, f in request.files.items(multi=True)]
+    body = read_body(config.MAX_BATCH_BYTES)
+    if body is None:
+        return None
+    try:
+        return unpack_images(body)
+    except ValueError:
+        return None
+
+
+def batch_response(results, message):
+    """
+    Emits each result if a socket_emit_path was given, then wraps them in a
+    JSON response.
 
-# Load in ONNX model as an inference session
-ort_sess = ort.InferenceSession('money_classification/lucky-sweep-6_best_model.onnx')
+    Args:
+        results : list of per image responses
+        message : function converting a response into the socketIO message
+            the single image route emits
+    """
+    socket_emit_path = request.args.get("socket_emit_path")
+    if socket_emit_path is not None:
+        for result in results:
+            emit_result(socket_emit_path, message(result))
+
+    return json_response({"results": results})
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    route = route_name()
+    requests_in_flight.inc(route=route)
+    request_bytes.observe(request.content_length or 0, route=route)
+
+
+@app.before_request
+def start_profile():
+    """
+    Profiles the request if profiling is enabled, and either the request asks
+    for it or it is picked by the sampling rate.
+    """
+    if not config.PROFILING_ENABLED or request.path.startswith("/admin/"):
+        return
+    requested = request.args.get("profile") == "1" or request.headers.get("X-Profile") == "1"
+    if requested or random.random() < config.PROFILING_SAMPLE_RATE:
+        request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+        profile = RequestProfile(request_id, route_name())
+        if profile.start():
+            g.profile = profile
+
+
+@app.after_request
+def add_profile_header(response):
+    if "profile" in g:
+        response.headers["X-Profile-ID"] = g.profile.request_id
+    return response
+
+
+@app.teardown_request
+def store_profile(exception=None):
+    if "profile" in g:
+        g.profile.stop()
+        profile_store.add(g.profile)
+
+
+@app.teardown_request
+def release_body_buffer(exception=None):
+    if "body_buffer" in g:
+        body_buffers.release(g.pop("body_buffer"))
+
+
+@app.after_request
+def record_response_metrics(response):
+    responses_total.inc(route=route_name(),
+        status=str(response.status_code))
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exception=None):
+    if "request_start" in g:
+        route = route_name()
+        requests_in_flight.dec(route=route)
+        request_seconds.observe(time.perf_counter() - g.request_start, route=route)
+
+
+@registry.collector
+def collect_component_stats():
+    """
+    Counters kept by the result cache, money batcher, money pre-filter and
+    Vision client.
+    """
+    cache = result_cache.stats()
+    batcher = money_batcher.stats()
+    prefilter = money_prefilter.stats() if money_prefilter is not None else \
+        {"images": 0, "skipped": 0, "cropped": 0}
+    vision = (vision_client.stats if vision_client is not None else ClientStats()).snapshot()
+    return [
+        ("vizia_cache_hits_total", "counter", "Result cache hits", cache["hits"]),
+        ("vizia_cache_misses_total", "counter", "Result cache misses", cache["misses"]),
+        ("vizia_cache_entries", "gauge", "Results in the cache", cache["entries"]),
+        ("vizia_money_batcher_requests_total", "counter",
+            "Images classified by the money batcher", batcher["requests"]),
+        ("vizia_money_batcher_batches_total", "counter",
+            "Forward passes run by the money batcher", batcher["batches"]),
+        ("vizia_money_batcher_queue_seconds_mean", "gauge",
+            "Mean time images wait for their batch", batcher["mean_queue_ms"] / 1000),
+        ("vizia_money_batcher_preprocess_seconds_mean", "gauge",
+            "Mean time spent preprocessing a batch", batcher["mean_preprocess_ms"] / 1000),
+        ("vizia_money_prefilter_images_total", "counter",
+            "Images checked by the money pre-filter", prefilter["images"]),
+        ("vizia_money_prefilter_skipped_total", "counter",
+            "Images the money pre-filter found no bill in, skipping the model",
+            prefilter["skipped"]),
+        ("vizia_money_prefilter_cropped_total", "counter",
+            "Images classified cropped to the bill the pre-filter found",
+            prefilter["cropped"]),
+        ("vizia_vision_requests_total", "counter",
+            "HTTP requests sent to the Vision API, retries included", vision["requests"]),
+        ("vizia_vision_retries_total", "counter",
+            "Vision API requests that were retried", vision["retries"]),
+        ("vizia_vision_errors_total", "counter",
+            "Vision API requests that failed", vision["errors"]),
+        ("vizia_vision_connections_opened_total", "counter",
+            "Connections opened to the Vision API", vision["connections_opened"]),
+        ("vizia_vision_connect_seconds_total", "counter",
+            "Time spent opening connections to the Vision API", vision["connect_seconds"]),
+        ("vizia_vision_upstream_seconds_total", "counter",
+            "Time spent waiting on the Vision API", vision["upstream_seconds"]),
+        ("vizia_streams_active", "gauge", "Open Socket.IO frame streams", len(streams)),
+        ("vizia_worker_pool_size", "gauge", "Workers running CPU-bound work",
+            0 if pool.kind == "none" else pool.size),
+    ]
 
-# Read in Vision API key from env variable
-api_key = os.environ['GC_VISION_API_KEY']
 
 # Homepage URL routing
 # Can be used as a liveness check
@@ -36,6 +648,90 @@ def index():
     return Response(status = 200)
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    """
+    Server metrics in the Prometheus text format: request durations, sizes
+    and in-flight counts per route, the time spent in each processing stage,
+    and cache, batching and Vision API counters.
+    """
+    return Response(
+        response = registry.render(),
+        status = 200,
+        mimetype = "text/plain; version=0.0.4"
+    )
+
+
+def check_admin():
+    """
+    Returns an error Response if the admin routes can't be used by this
+    request, else None.
+    """
+    if not config.PROFILING_ENABLED:
+        return Response(status = 404)
+    token = request.headers.get("X-Admin-Token", "")
+    if not config.PROFILING_ADMIN_TOKEN or not hmac.compare_digest(token.encode(),
+            config.PROFILING_ADMIN_TOKEN.encode()):
+        return Response(status = 403)
+    return None
+
+
+@app.route("/admin/profiles", methods=["GET"])
+def profiles_route():
+    """
+    Lists the stored request profiles, most recent first
+    ---
+
+    Response:
+        profiles: List of {"request_id", "route", "started", "seconds"}
+    """
+    error = check_admin()
+    if error is not None:
+        return error
+    return json_response({"profiles": profile_store.list()})
+
+
+@app.route("/admin/profiles/<request_id>", methods=["GET"])
+def profile_route(request_id):
+    """
+    Returns the profile of a request
+    ---
+
+    Parameters:
+        format : "text" (default) for a table of the most expensive functions,
+            or "pstats" for the binary profile, eg. to open with snakeviz
+        sort : pstats sort key of the table. Defaults to "cumulative".
+        limit : Number of functions in the table. Defaults to 50.
+    """
+    error = check_admin()
+    if error is not None:
+        return error
+
+    profile = profile_store.get(request_id)
+    if profile is None:
+        return Response(status = 404)
+
+    if request.args.get("format") == "pstats":
+        return Response(
+            response = profile.dump(),
+            status = 200,
+            mimetype = "application/octet-stream",
+            headers = {"Content-Disposition":
+                "attachment; filename={}.pstats".format(request_id)}
+        )
+
+    try:
+        limit = int(request.args.get("limit", 50))
+        report = profile.report(request.args.get("sort", "cumulative"), limit)
+    except (KeyError, ValueError):
+        return Response(status = 400)
+    return Response(
+        response = report,
+        status = 200,
+        mimetype = "text/plain"
+    )
+
+
 @app.route("/socket_emit", methods=["POST"])
 def socket_emit_route():
     """
@@ -87,47 +783,47 @@ def detect_color_route():
         rgb: A list containing the [R, G, B] values for each color detected
     """
     if request.method == "POST":
-        # Convert string of image data to uint8
-        np_arr = np.frombuffer(request.data, np.uint8)
-
-        # Decode image
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        # Perform color detection
         k = request.args.get("k")
         try:
             k = 3 if k is None else k
             k = int(k)
+            if k < 1:
+                raise ValueError("k must be at least 1")
         except ValueError:
             return Response(status = 400)
-        color_names, rgb_array = detect_color(img, k)
 
-        # Convert list of colors into one string
-        # Eg: ["Red", "Blue", "Green"] -> "Red, Blue, and Green"
-        color_text = ""
-        if len(color_names) == 1:
-            color_text = color_names[0]
-        else:
-            for idx, color in enumerate(color_names):
-                if idx == (len(color_names) - 1):
-                    color_text += "and {}".format(color)
-                else:
-                    color_text += "{}, ".format(color)
+        # Decode image, at reduced resolution if it is larger than needed,
+        # unless the result is already cached
+        body = read_body(config.MAX_IMAGE_BYTES)
+        if body is None:
+            return Response(status = 413)
 
-        # Prepare response
-        response = {"colors" : color_text, "rgb" : rgb_array}
+        key, response, img = lookup_cache("detect_color",
+            {"k": k, "settings": settings_fingerprints["color"]}, body,
+            lambda: pool.run(decode_image, body,
+                min_pixels=config.COLOR_DECODE_MIN_PIXELS or None))
+
+        if response is None:
+            if img is None:
+                return Response(status = 400)
+
+            # Perform color detection. Frames emitted on the same socket path
+            # come from the same camera.
+            path = request.args.get("socket_emit_path")
+            client = None if path is None else "path:" + path
+            with timed("kmeans"):
+                color_names, rgb_array = detect_colors(img, k, client)
+
+            # Prepare response
+            response = {"colors" : join_colors(color_names), "rgb" : rgb_array}
+            result_cache.set(key, response)
 
         # Emit on socket if specified
         socket_emit_path = request.args.get("socket_emit_path")
         if socket_emit_path is not None:
-            socketio.emit(socket_emit_path, {"text": color_text})
+            emit_result(socket_emit_path, {"text": response["colors"]})
 
-        return Response(
-            response = jsonpickle.encode(response),
-            status = 200,
-            mimetype = "application/json"
-        )
+        return json_response(response)
     else:
         return Response(status = 404)
 
@@ -151,47 +847,107 @@ def detect_color_2_route():
             most dominant to least dominant. Eg: "Red, Green, and Blue" .
     """
     if request.method == "POST":
-        # Convert string of image data to uint8
-        np_arr = np.frombuffer(request.data, np.uint8)
+        k = request.args.get("k")
+        try:
+            k = 3 if k is None else k
+            k = int(k)
+            if k < 1:
+                raise ValueError("k must be at least 1")
+        except ValueError:
+            return Response(status = 400)
+
+        # Decode image, at reduced resolution if it is larger than needed,
+        # unless the result is already cached
+        body = read_body(config.MAX_IMAGE_BYTES)
+        if body is None:
+            return Response(status = 413)
+
+        key, response, img = lookup_cache("detect_color_2",
+            {"k": k, "settings": settings_fingerprints["color"]}, body,
+            lambda: pool.run(decode_image, body,
+                min_pixels=config.COLOR_DECODE_MIN_PIXELS or None))
+
+        if response is None:
+            if img is None:
+                return Response(status = 400)
+
+            # Perform color detection
+            with timed("distance"):
+                color_names = pool.run(tasks.detect_color_2_task, img, k)
+
+            # Prepare response
+            response = {"colors" : join_colors(color_names)}
+            result_cache.set(key, response)
+
+        # Emit on socket if specified
+        socket_emit_path = request.args.get("socket_emit_path")
+        if socket_emit_path is not None:
+            emit_result(socket_emit_path, {"text": response["colors"]})
 
-        # Decode image
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return json_response(response)
+    else:
+        return Response(status = 404)
+
+
+@app.route("/detect_color_3", methods=["POST"])
+def detect_color_3_route():
+    """
+    Performs color detection using a color histogram
+    ---
+
+    Data:
+        jpg encoded image data
+
+    Parameters:
+        k : The number of colors to return. Defaults to 3 if this parameter is
+            not provided.
+        socket_emit_path : If present, emit results on this socketIO path
 
-        # Perform color detection
+    Response:
+        colors: A single string with color results in order from
+            most dominant to least dominant. Eg: "Red, Green, and Blue" .
+        rgb: A list containing the mean [R, G, B] values of the pixels of
+            each color detected
+    """
+    if request.method == "POST":
         k = request.args.get("k")
         try:
             k = 3 if k is None else k
             k = int(k)
+            if k < 1:
+                raise ValueError("k must be at least 1")
         except ValueError:
             return Response(status = 400)
-        color_names = detect_color_2(img, k)
 
-        # Convert list of colors into one string
-        # Eg: ["Red", "Blue", "Green"] -> "Red, Blue, and Green"
-        color_text = ""
-        if len(color_names) == 1:
-            color_text = color_names[0]
-        else:
-            for idx, color in enumerate(color_names):
-                if idx == (len(color_names) - 1):
-                    color_text += "and {}".format(color)
-                else:
-                    color_text += "{}, ".format(color)
+        # Decode image, at reduced resolution if it is larger than needed,
+        # unless the result is already cached
+        body = read_body(config.MAX_IMAGE_BYTES)
+        if body is None:
+            return Response(status = 413)
+
+        key, response, img = lookup_cache("detect_color_3",
+            {"k": k, "settings": settings_fingerprints["color"]}, body,
+            lambda: pool.run(decode_image, body,
+                min_pixels=config.COLOR_DECODE_MIN_PIXELS or None))
+
+        if response is None:
+            if img is None:
+                return Response(status = 400)
 
-        # Prepare response
-        response = {"colors" : color_text}
+            # Perform color detection
+            with timed("histogram"):
+                color_names, rgb_array = pool.run(tasks.detect_color_3_task, img, k)
+
+            # Prepare response
+            response = {"colors" : join_colors(color_names), "rgb" : rgb_array}
+            result_cache.set(key, response)
 
         # Emit on socket if specified
         socket_emit_path = request.args.get("socket_emit_path")
         if socket_emit_path is not None:
-            socketio.emit(socket_emit_path, {"text": color_text})
+            emit_result(socket_emit_path, {"text": response["colors"]})
 
-        return Response(
-            response = jsonpickle.encode(response),
-            status = 200,
-            mimetype = "application/json"
-        )
+        return json_response(response)
     else:
         return Response(status = 404)
 
@@ -200,71 +956,77 @@ def detect_color_2_route():
 def ocr_route():
     """
     Performs Optical Character Recognition (OCR) using the Google Cloud
-    Vision API (https://cloud.google.com/vision/docs/reference/rest/v1/images/annotate)
+    Vision API (https://cloud.google.com/vision/docs/reference/rest/v1/images/annotate),
+    or local ONNX models (see ocr/local_engine.py)
     ---
 
     Data:
-        Base64 encoded string of image data
+        JPEG or PNG image data, or a base64 encoded string of it. Raw images
+        are smaller to upload and are base64 encoded once, on the server.
 
     Parameters:
         type :
             "DOCUMENT_TEXT_DETECTION" for document text,
             "TEXT_DETECTION" for everything else (in-the-wild and handwritten).
             Defaults to "TEXT_DETECTION" if not provided.
+        backend : "google" or "local". Defaults to OCR_BACKEND. If it
+            fails, OCR_FALLBACK answers instead when set.
         socket_emit_path : If present, emit results on this socketIO path
 
     Response:
         text: A single string containing all the OCR results
         language: ISO 639-1 language code. Eg: "en" for English, "fr" for French
+        error: Instead of text and language, with a 502 status, if the
+            Vision API could not read the image
     """
     if request.method == "POST":
         detection_type = request.args.get("type")
         detection_type = "TEXT_DETECTION" if detection_type is None else detection_type
-
-        # Prepare request dict
-        data = {
-            "requests":[{
-                "image":{
-                    "content": request.data.decode('utf-8')
-                },
-                "features":[{
-                    "type": detection_type
-                }]
-            }]
-        }
-
-        # Make request to google vision api
-        endpoint = "https://vision.googleapis.com/v1/images:annotate?key={key}".format(key=api_key)
-        google_response = requests.post(endpoint, json=data)
-
-        if google_response.status_code != 200:
-            # If we got an error, just return it
-            return google_response
-
-        # Convert google api response to json
-        r = json.loads(google_response.text)
-
-        # Extract text and language if found in google api response
-        txt = "No text detected"
-        language = "en"
-        if "fullTextAnnotation" in r["responses"][0]:
-            txt = r["responses"][0]["fullTextAnnotation"]["text"] \
-                .replace("\n", " ")
-            language = r["responses"][0]["textAnnotations"][0]["locale"]
-
-        # Prepare response dict
-        response = {"text" : txt, "language": language}
+        backend = request.args.get("backend", config.OCR_BACKEND)
+        if backend not in ocr_backends:
+            return Response(status = 400)
+        if not ocr_available(backend):
+            return Response(status = 503)
+
+        body = read_body(config.MAX_IMAGE_BYTES)
+        if body is None:
+            return Response(status = 413)
+
+        # Skip OCR if this image was recently processed
+        key = result_cache.key("ocr", {"type": detection_type, "backend": backend,
+            "settings": settings_fingerprints["ocr"]}, body)
+        response = result_cache.get(key)
+
+        if response is None:
+            image = ocr_images([body], detection_type)[0]
+            if image is None:
+                return Response(status = 400)
+
+            try:
+                results, answered_by = run_ocr([image], detection_type, backend)
+            except OCRError as e:
+                return ocr_error_response(e)
+            response = results[0]
+            if "error" in response:
+                # The Vision API could not read this image. Errors are not
+                # cached.
+                return Response(
+                    response = jsonpickle.encode(response),
+                    status = 502,
+                    mimetype = "application/json"
+                )
+
+            # Fallback results are not cached, so the selected backend is
+            # tried again next time
+            if answered_by == backend:
+                result_cache.set(key, response)
 
         # Emit on socket if specified
         socket_emit_path = request.args.get("socket_emit_path")
         if socket_emit_path is not None:
-            socketio.emit(socket_emit_path, response)
+            emit_result(socket_emit_path, response)
 
-        return Response(
-            response = jsonpickle.encode(response),
-            status = 200,
-            mimetype = "application/json"
-        )
+        return json_response(response)
     else:
         return Response(status = 404)
 
@@ -286,41 +1048,466 @@ def classify_money():
         predicted_class: One of [1, 5, 10, 20, 50, 100]
     """
     if request.method == "POST":
-        # Convert string of image data to uint8
-        np_arr = np.frombuffer(request.data, np.uint8)
+        body = read_body(config.MAX_IMAGE_BYTES)
+        if body is None:
+            return Response(status = 413)
 
-        # Decode image
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # Decode image, at reduced resolution if it is larger than the model
+        # input, unless the result is already cached
+        key, response, img = lookup_cache("classify_money",
+            {"settings": settings_fingerprints["money"]}, body,
+            lambda: pool.run(decode_image, body, min_size=IMG_SIZE))
 
-        # Run inference on image
-        prediction = run_inference(ort_sess, img)
+        if response is None:
+            if img is None:
+                return Response(status = 400)
 
-        # Prepare response
-        prediction = "No bill detected" if prediction == "no_bill" else prediction
-        response = {"predicted_class" : prediction}
+            prediction = classify_money_image(img)
+
+            # Prepare response
+            prediction = "No bill detected" if prediction == "no_bill" else prediction
+            response = {"predicted_class" : prediction}
+            result_cache.set(key, response)
 
         # Emit on socket if specified
         socket_emit_path = request.args.get("socket_emit_path")
         if socket_emit_path is not None:
-            socketio.emit(socket_emit_path, {"text": str(response["predicted_class"])})
+            emit_result(socket_emit_path, {"text": str(response["predicted_class"])})
 
-        return Response(
-            response = jsonpickle.encode(response),
-            status = 200,
-            mimetype = "application/json"
-        )
+        return json_response(response)
+    else:
+        return Response(status = 404)
+
+
+@app.route("/detect_color_batch", methods=["POST"])
+def detect_color_batch_route():
+    """
+    Batch version of /detect_color, for several images in one request
+    ---
+
+    Data:
+        jpg encoded images, as multipart/form-data files or a length-prefixed
+        body (see image_utils.pack_images)
+
+    Parameters:
+        k : The number of colors to return per image. Defaults to 3.
+        socket_emit_path : If present, emit each result on this socketIO path
+
+    Response:
+        results: List with one /detect_color response per image, in order
+    """
+    if request.method == "POST":
+        k = request.args.get("k")
+        try:
+            k = 3 if k is None else k
+            k = int(k)
+            if k < 1:
+                raise ValueError("k must be at least 1")
+        except ValueError:
+            return Response(status = 400)
+
+        if body_too_large(config.MAX_BATCH_BYTES):
+            return Response(status = 413)
+        images = request_images()
+        if not images:
+            return Response(status = 400)
+        if len(images) > config.BATCH_MAX_IMAGES:
+            return Response(status = 413)
+
+        # Decode images and detect colors in parallel
+        with timed("decode"):
+            imgs = pool.map(decode_image, images,
+                min_pixels=config.COLOR_DECODE_MIN_PIXELS or None)
+        if any(img is None for img in imgs):
+            return Response(status = 400)
+        with timed("kmeans"):
+            detections = pool.map(tasks.detect_color_task, imgs, k=k)
+
+        results = [{"colors" : join_colors(color_names), "rgb" : rgb_array}
+            for color_names, rgb_array in detections]
+        return batch_response(results, lambda r: {"text": r["colors"]})
+    else:
+        return Response(status = 404)
+
+
+@app.route("/detect_color_2_batch", methods=["POST"])
+def detect_color_2_batch_route():
+    """
+    Batch version of /detect_color_2, for several images in one request
+    ---
+
+    Data:
+        jpg encoded images, as multipart/form-data files or a length-prefixed
+        body (see image_utils.pack_images)
+
+    Parameters:
+        k : The number of colors to return per image. Defaults to 3.
+        socket_emit_path : If present, emit each result on this socketIO path
+
+    Response:
+        results: List with one /detect_color_2 response per image, in order
+    """
+    if request.method == "POST":
+        k = request.args.get("k")
+        try:
+            k = 3 if k is None else k
+            k = int(k)
+            if k < 1:
+                raise ValueError("k must be at least 1")
+        except ValueError:
+            return Response(status = 400)
+
+        if body_too_large(config.MAX_BATCH_BYTES):
+            return Response(status = 413)
+        images = request_images()
+        if not images:
+            return Response(status = 400)
+        if len(images) > config.BATCH_MAX_IMAGES:
+            return Response(status = 413)
+
+        # Decode images and detect colors in parallel
+        with timed("decode"):
+            imgs = pool.map(decode_image, images,
+                min_pixels=config.COLOR_DECODE_MIN_PIXELS or None)
+        if any(img is None for img in imgs):
+            return Response(status = 400)
+        with timed("distance"):
+            detections = pool.map(tasks.detect_color_2_task, imgs, k=k)
+
+        results = [{"colors" : join_colors(color_names)} for color_names in detections]
+        return batch_response(results, lambda r: {"text": r["colors"]})
+    else:
+        return Response(status = 404)
+
+
+@app.route("/detect_color_3_batch", methods=["POST"])
+def detect_color_3_batch_route():
+    """
+    Batch version of /detect_color_3, for several images in one request
+    ---
+
+    Data:
+        jpg encoded images, as multipart/form-data files or a length-prefixed
+        body (see image_utils.pack_images)
+
+    Parameters:
+        k : The number of colors to return per image. Defaults to 3.
+        socket_emit_path : If present, emit each result on this socketIO path
+
+    Response:
+        results: List with one /detect_color_3 response per image, in order
+    """
+    if request.method == "POST":
+        k = request.args.get("k")
+        try:
+            k = 3 if k is None else k
+            k = int(k)
+            if k < 1:
+                raise ValueError("k must be at least 1")
+        except ValueError:
+            return Response(status = 400)
+
+        if body_too_large(config.MAX_BATCH_BYTES):
+            return Response(status = 413)
+        images = request_images()
+        if not images:
+            return Response(status = 400)
+        if len(images) > config.BATCH_MAX_IMAGES:
+            return Response(status = 413)
+
+        # Decode images and detect colors in parallel
+        with timed("decode"):
+            imgs = pool.map(decode_image, images,
+                min_pixels=config.COLOR_DECODE_MIN_PIXELS or None)
+        if any(img is None for img in imgs):
+            return Response(status = 400)
+        with timed("histogram"):
+            detections = pool.map(tasks.detect_color_3_task, imgs, k=k)
+
+        results = [{"colors" : join_colors(color_names), "rgb" : rgb_array}
+            for color_names, rgb_array in detections]
+        return batch_response(results, lambda r: {"text": r["colors"]})
+    else:
+        return Response(status = 404)
+
+
+@app.route("/ocr_batch", methods=["POST"])
+def ocr_batch_route():
+    """
+    Batch version of /ocr. Images are sent to the Vision API together, up to
+    VISION_MAX_BATCH_SIZE images per call, or read one after the other by
+    the local models.
+    ---
+
+    Data:
+        JPEG or PNG images, or base64 encoded, as multipart/form-data files or a
+        length-prefixed body (see image_utils.pack_images)
+
+    Parameters:
+        type : "DOCUMENT_TEXT_DETECTION" or "TEXT_DETECTION" (default)
+        backend : "google" or "local", see /ocr
+        socket_emit_path : If present, emit each result on this socketIO path
+
+    Response:
+        results: List with one /ocr response per image, in order, or
+            {"error": message} for images the Vision API could not read
+    """
+    if request.method == "POST":
+        detection_type = request.args.get("type")
+        detection_type = "TEXT_DETECTION" if detection_type is None else detection_type
+        backend = request.args.get("backend", config.OCR_BACKEND)
+        if backend not in ocr_backends:
+            return Response(status = 400)
+        if not ocr_available(backend):
+            return Response(status = 503)
+
+        if body_too_large(config.MAX_BATCH_BYTES):
+            return Response(status = 413)
+        images = request_images()
+        if not images:
+            return Response(status = 400)
+        if len(images) > config.BATCH_MAX_IMAGES:
+            return Response(status = 413)
+
+        images = ocr_images(images, detection_type)
+        if any(image is None for image in images):
+            return Response(status = 400)
+
+        try:
+            results, _ = run_ocr(images, detection_type, backend)
+        except OCRError as e:
+            return ocr_error_response(e)
+
+        return batch_response(results, lambda r: r)
+    else:
+        return Response(status = 404)
+
+
+@app.route("/classify_money_batch", methods=["POST"])
+def classify_money_batch_route():
+    """
+    Batch version of /classify_money. All images go through the model as a
+    single batch.
+    ---
+
+    Data:
+        jpg encoded images, as multipart/form-data files or a length-prefixed
+        body (see image_utils.pack_images)
+
+    Parameters:
+        socket_emit_path : If present, emit each result on this socketIO path
+
+    Response:
+        results: List with one /classify_money response per image, in order
+    """
+    if request.method == "POST":
+        if body_too_large(config.MAX_BATCH_BYTES):
+            return Response(status = 413)
+        images = request_images()
+        if not images:
+            return Response(status = 400)
+        if len(images) > config.BATCH_MAX_IMAGES:
+            return Response(status = 413)
+
+        # Decode images in parallel, then run inference on all of them at once
+        with timed("decode"):
+            imgs = pool.map(decode_image, images, min_size=IMG_SIZE)
+        if any(img is None for img in imgs):
+            return Response(status = 400)
+
+        # Images without a bill skip the model
+        if money_prefilter is not None:
+            with timed("prefilter"):
+                regions = pool.map(find_bill, imgs, min_edges=money_prefilter.min_edges,
+                    min_area=money_prefilter.min_area)
+            imgs = [money_prefilter.crop(img, region) for img, region in zip(imgs, regions)]
+        predictions = ["no_bill"] * len(imgs)
+        bills = [i for i, img in enumerate(imgs) if img is not None]
+        if bills:
+            with timed("inference"):
+                bill_predictions = pool.run(tasks.classify_money_images_task,
+                    [imgs[i] for i in bills])
+            for i, prediction in zip(bills, bill_predictions):
+                predictions[i] = prediction
+
+        results = [{"predicted_class" : "No bill detected" if p == "no_bill" else p}
+            for p in predictions]
+        return batch_response(results, lambda r: {"text": str(r["predicted_class"])})
     else:
         return Response(status = 404)
 
 
+def process_frame(operation, params, data, client=None):
+    """
+    Runs one streamed frame through an operation.
+
+    Args:
+        operation : "color", "color_2", "color_3", "money" or "ocr"
+        params : operation parameters, "k" for colors, "type" and "backend"
+            for OCR
+        data : jpg encoded image data, or for OCR also base64 encoded
+        client : identifies the stream the frame belongs to
+
+    Returns:
+        The response of the matching REST route, or a dict with an "error"
+    """
+    route = "stream_" + operation
+    if operation == "ocr":
+        if not ocr_available(params["backend"]):
+            return {"error": "OCR is not configured"}
+        image = ocr_images([data], params["type"], route)[0]
+        if image is None:
+            return {"error": "Could not decode frame"}
+        try:
+            results, _ = run_ocr([image], params["type"], params["backend"], route)
+        except OCRError as e:
+            return {"error": str(e)}
+        return results[0]
+
+    with timed("decode", route):
+        if operation == "money":
+            img = pool.run(decode_image, data, min_size=IMG_SIZE)
+        else:
+            img = pool.run(decode_image, data,
+                min_pixels=config.COLOR_DECODE_MIN_PIXELS or None)
+    if img is None:
+        return {"error": "Could not decode frame"}
+
+    if operation == "color":
+        with timed("kmeans", route):
+            color_names, rgb_array = detect_colors(img, params["k"], client)
+        return {"colors" : join_colors(color_names), "rgb" : rgb_array}
+    if operation == "color_2":
+        with timed("distance", route):
+            color_names = pool.run(tasks.detect_color_2_task, img, params["k"])
+        return {"colors" : join_colors(color_names)}
+    if operation == "color_3":
+        with timed("histogram", route):
+            color_names, rgb_array = pool.run(tasks.detect_color_3_task, img, params["k"])
+        return {"colors" : join_colors(color_names), "rgb" : rgb_array}
+
+    prediction = classify_money_image(img, route)
+    prediction = "No bill detected" if prediction == "no_bill" else prediction
+    return {"predicted_class" : prediction}
+
+
+def run_stream(sid, stream):
+    """
+    Processes the frames of one client until its stream is closed, emitting
+    each result back to that client only.
+    """
+    while True:
+        item = stream.get()
+        if item is None:
+            break
+        seq, data = item
+        try:
+            result = process_frame(stream.operation, stream.params, data,
+                "stream:" + sid)
+        except Exception as e:
+            result = {"error": str(e)}
+
+        message = {"operation": stream.operation, "frame": seq}
+        message.update(stream.stats())
+        message.update(result)
+        with timed("emit", "stream_" + stream.operation):
+            socketio.emit("stream_result", message, to=sid)
+
+
+def stop_stream(sid):
+    stream = streams.pop(sid, None)
+    if stream is not None:
+        stream.close()
+    with kmeans_states_lock:
+        kmeans_states.pop("stream:" + sid, None)
+    return stream
+
+
 @socketio.on("connect")
 def connect():
     print("socket connected")
 
 
+@socketio.on("disconnect")
+def disconnect():
+    stop_stream(request.sid)
+
+
+@socketio.on("start_stream")
+def start_stream_event(options=None):
+    """
+    Starts streaming frames from this client. Frames are then sent as binary
+    "frame" events and each result comes back as a "stream_result" event.
+    When frames arrive faster than they are processed, stale frames are
+    dropped so results keep up with the camera.
+    ---
+
+    Data:
+        operation : "color" (/detect_color), "color_2" (/detect_color_2),
+            "color_3" (/detect_color_3), "money" (/classify_money) or "ocr"
+            (/ocr). Defaults to "color".
+        k : The number of colors to return. Defaults to 3.
+        type : OCR detection type. Defaults to "TEXT_DETECTION".
+        backend : OCR backend, "google" or "local". Defaults to OCR_BACKEND.
+
+    Response ("stream_started" event):
+        operation : The operation frames go through
+    """
+    options = options or {}
+    try:
+        params = {
+            "k": int(options.get("k", 3)),
+            "type": options.get("type", "TEXT_DETECTION"),
+            "backend": options.get("backend", config.OCR_BACKEND),
+        }
+        if params["k"] < 1:
+            raise ValueError("k must be at least 1")
+        if params["backend"] not in ocr_backends:
+            raise ValueError("Unknown OCR backend '{}'".format(params["backend"]))
+        stream = FrameStream(options.get("operation", "color"), params,
+            socketio.server.eio.create_event, config.STREAM_MAX_PENDING)
+    except (TypeError, ValueError) as e:
+        emit("stream_error", {"error": str(e)})
+        return
+
+    # A new stream replaces the previous one of this client
+    stop_stream(request.sid)
+    streams[request.sid] = stream
+    socketio.start_background_task(run_stream, request.sid, stream)
+    emit("stream_started", {"operation": stream.operation})
+
+
+@socketio.on("frame")
+def frame_event(data):
+    """
+    Queues a frame of the client's stream, dropping the oldest pending frame
+    if processing is behind.
+    """
+    stream = streams.get(request.sid)
+    if stream is None:
+        emit("stream_error", {"error": "No stream started"})
+        return
+    stream_frames_total.inc(operation=stream.operation, outcome="received")
+    if stream.put(data):
+        stream_frames_total.inc(operation=stream.operation, outcome="dropped")
+
+
+@socketio.on("stop_stream")
+def stop_stream_event():
+    stream = stop_stream(request.sid)
+    if stream is not None:
+        emit("stream_stopped", stream.stats())
+
+
 #### Localhost testing ####
 if __name__ == "__main__":
+    # Serving preloads unless told otherwise, so that no request pays for it
+    if "PRELOAD" not in os.environ:
+        config.PRELOAD = True
+        preload()
+    if config.PRELOAD:
+        pool.start()
+
     # Find an available port number
     url = "127.0.0.1" # localhost
     port = 0
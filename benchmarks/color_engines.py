@@ -0,0 +1,69 @@
+"""
+Compares the three color detection engines on the test images: k-means
+(detect_color), per pixel matching (detect_color_2) and the color histogram
+(detect_color_3), under each color metric. Each engine runs with the
+settings the server uses by default, on the image decoded the way the
+server decodes it.
+
+Run from the repository root:
+
+    python -m benchmarks.color_engines [-k 3] [--metric rgb cie76 ciede2000] [--repeat 3]
+        [--full-resolution]
+"""
+import argparse
+import glob
+import time
+
+import config
+from color_detection.detect import detect_color, detect_color_2, detect_color_3
+from color_detection.palette import get_palette
+from image_utils import decode_image
+
+
+IMAGES = "test_images/color_detection/*"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--palette", default="medium")
+    parser.add_argument("--metric", nargs="+", default=["rgb", "cie76", "ciede2000"])
+    parser.add_argument("--repeat", type=int, default=3,
+        help="runs per engine and image, the fastest is reported")
+    parser.add_argument("--full-resolution", action="store_true",
+        help="decode images at full resolution instead of reduced")
+    args = parser.parse_args()
+
+    sampling = dict(max_pixels=config.COLOR_SAMPLE_PIXELS or None,
+        method=config.COLOR_SAMPLE_METHOD)
+    engines = [
+        ("kmeans", lambda img, palette: detect_color(img, args.k, palette, **sampling)[0]),
+        ("matching", lambda img, palette: list(detect_color_2(img, args.k, palette))),
+        ("histogram", lambda img, palette: detect_color_3(img, args.k, palette)[0]),
+    ]
+
+    print("{:<24} {:>10} {:<10} {:<10} {:>9}  {}".format(
+        "image", "pixels", "metric", "engine", "seconds", "colors"))
+    for filename in sorted(glob.glob(IMAGES)):
+        with open(filename, "rb") as f:
+            data = f.read()
+        min_pixels = None if args.full_resolution else config.COLOR_DECODE_MIN_PIXELS
+        img = decode_image(data, min_pixels=min_pixels or None)
+        name = filename.split("/")[-1]
+
+        for metric in args.metric:
+            palette = get_palette(args.palette, config.COLOR_LUT_BITS, metric,
+                config.COLOR_LUT_CACHE_DIR or None)
+            for engine, detect in engines:
+                best = float("inf")
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    names = detect(img, palette)
+                    best = min(best, time.perf_counter() - start)
+                print("{:<24} {:>10} {:<10} {:<10} {:>9.4f}  {}".format(
+                    name, img.shape[0] * img.shape[1], metric, engine, best, ", ".join(names)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Compares decoding every test image at full resolution against the reduced
+resolution decode used by the image endpoints.
+
+Reports the median decode time and the peak memory allocated for the
+decoded image (traced with tracemalloc, which sees the numpy arrays OpenCV
+returns but not libjpeg's internal buffers). Run from the repository root:
+
+    python -m benchmarks.decode [--repeat 10]
+"""
+import argparse
+import glob
+import time
+import tracemalloc
+
+import numpy as np
+
+import config
+from image_utils import decode_image
+from money_classification.model_inference import IMG_SIZE
+
+
+IMAGES = "test_images/*/*"
+
+
+def measure(data, repeat, **kwargs):
+    """
+    Returns (median seconds, peak traced MB, decoded shape) for decode_image.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode_image(data, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    img = decode_image(data, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return np.median(times), peak / 1024 / 1024, img.shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    targets = [
+        ("full", {}),
+        ("color", {"min_pixels": config.COLOR_DECODE_MIN_PIXELS}),
+        ("money", {"min_size": IMG_SIZE}),
+    ]
+
+    print("{:<48} {:<6} {:>16} {:>9} {:>9}".format(
+        "image", "target", "shape", "ms", "peak MB"))
+    for filename in sorted(glob.glob(IMAGES)):
+        with open(filename, "rb") as f:
+            data = f.read()
+        for label, kwargs in targets:
+            seconds, peak, shape = measure(data, args.repeat, **kwargs)
+            print("{:<48} {:<6} {:>16} {:>9.1f} {:>9.1f}".format(
+                filename, label, "x".join(str(d) for d in shape),
+                seconds * 1000, peak))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compares peak memory and latency of detect_color_2 against the original
+implementation, which matched every pixel against every color at once.
+
+Each measurement runs in its own process so that peak RSS is not shared
+between runs. Run from the repository root:
+
+    python -m benchmarks.detect_color_2 [--palette medium] [--max-bytes N]
+
+The original implementation needs several gigabytes even for a 1 MP image,
+use --scale to shrink the test images until it fits and the results of both
+implementations can be compared.
+"""
+import argparse
+import glob
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from color_detection.detect import detect_color_2
+from color_detection.palette import DEFAULT_MAX_BYTES, get_palette
+
+
+IMAGES = "test_images/color_detection/*"
+
+
+def legacy_detect_color_2(img, k, palette):
+    """
+    Original detect_color_2, which builds (N, num_colors, 3) arrays.
+    """
+    color_array = palette.rgb
+    pixels = img.reshape((-1, 3))
+    pixels_copy = np.repeat(pixels[:, np.newaxis, :], color_array.shape[0], axis=1)
+    dist = np.linalg.norm(pixels_copy - color_array, axis=2)
+    color_idx = np.argmin(dist, axis=1)
+    unique, counts = np.unique(color_idx, return_counts=True)
+    max_idx = np.argpartition(counts, -k)[-k:]
+    max_idx = np.sort(max_idx)
+    return palette.names[unique[max_idx]]
+
+
+def measure(filename, impl, palette_name, max_bytes, k, scale):
+    """
+    Runs a single detection in this process and returns its results.
+    """
+    palette = get_palette(palette_name)
+    img = cv2.cvtColor(cv2.imread(filename), cv2.COLOR_BGR2RGB)
+    if scale != 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if impl == "legacy":
+        colors = legacy_detect_color_2(img, k, palette)
+    else:
+        colors = detect_color_2(img, k, palette, max_bytes=max_bytes)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "pixels": img.shape[0] * img.shape[1],
+        "colors": list(colors),
+        "seconds": elapsed,
+        "peak_rss_mb": peak_rss / 1024,
+        "added_rss_mb": (peak_rss - baseline_rss) / 1024,
+    }
+
+
+def run_isolated(filename, impl, palette_name, max_bytes, k, scale):
+    """
+    Runs `measure` in a fresh interpreter. Returns None if the process died,
+    eg. killed for running out of memory.
+    """
+    cmd = [sys.executable, "-m", "benchmarks.detect_color_2", "--child",
+        filename, impl, "--palette", palette_name, "--max-bytes", str(max_bytes),
+        "-k", str(k), "--scale", str(scale)]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return None
+    return json.loads(proc.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--palette", default="medium")
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0,
+        help="resize factor applied to each image before detection")
+    parser.add_argument("--child", nargs=2, metavar=("FILENAME", "IMPL"),
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        filename, impl = args.child
+        print(json.dumps(measure(filename, impl, args.palette, args.max_bytes, args.k,
+            args.scale)))
+        return
+
+    print("{:<40} {:>8} {:>10} {:>10} {:>12}  {}".format(
+        "image", "impl", "pixels", "seconds", "peak MB", "colors"))
+    for filename in sorted(glob.glob(IMAGES)):
+        for impl in ["legacy", "chunked"]:
+            result = run_isolated(filename, impl, args.palette, args.max_bytes,
+                args.k, args.scale)
+            if result is None:
+                print("{:<40} {:>8} {:>10} {:>10} {:>12}".format(
+                    filename, impl, "-", "-", "killed"))
+                continue
+            print("{:<40} {:>8} {:>10} {:>10.3f} {:>12.1f}  {}".format(
+                filename, impl, result["pixels"], result["seconds"],
+                result["peak_rss_mb"], ", ".join(result["colors"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""
+Offline benchmark of the server endpoints. Replays the test_images corpus
+against each endpoint at the given concurrency levels and reports latency
+percentiles, throughput and peak RSS. OCR requests go to a local stand-in
+for the Vision API (ocr/fake_vision.py), so no API key or network is needed.
+
+Requests are sent either in-process through the Flask test client, which
+measures the server code alone, or over a real socket to `python app.py`,
+which adds HTTP parsing and the network stack. Each configuration runs in
+its own process so that peak RSS is not shared between runs. The result
+cache is turned off so that every request is processed.
+
+Run from the repository root:
+
+    python -m benchmarks.endpoints [--transport inprocess socket]
+        [--endpoints detect_color classify_money ...] [--concurrency 1 4]
+        [--requests 50] [--variants fp32 int8] [--output results.json]
+        [--compare baseline.json]
+
+Startup time is measured too: `import app` in a fresh interpreter, timed
+with `python -X importtime`, along with the slowest modules it imports.
+
+Results written with --output can be passed to --compare on a later commit
+to print the change in latency, throughput and startup time.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+# Route, request parameters and corpus of each endpoint
+ENDPOINTS = {
+    "detect_color": ("/detect_color", {"k": 3}, "color"),
+    "detect_color_2": ("/detect_color_2", {"k": 3}, "color"),
+    "detect_color_3": ("/detect_color_3", {"k": 3}, "color"),
+    "classify_money": ("/classify_money", {}, "money"),
+    "ocr": ("/ocr", {"type": "TEXT_DETECTION"}, "ocr"),
+}
+
+CORPUS = {
+    "color": "test_images/color_detection/*",
+    "money": "test_images/money_classification/*",
+    "ocr": "test_images/ocr/*",
+}
+
+
+def load_corpus(name):
+    """
+    Request bodies of a corpus: the image files.
+    """
+    bodies = []
+    for filename in sorted(glob.glob(CORPUS[name])):
+        with open(filename, "rb") as f:
+            data = f.read()
+        bodies.append(data)
+    return bodies
+
+
+def memory_mb(pid):
+    """
+    Current and peak resident set size of a process in MB, from /proc.
+    """
+    values = {}
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                key, value = line.split(":")
+                values[key] = int(value.split()[0]) / 1024
+    return values.get("VmRSS", 0.0), values.get("VmHWM", 0.0)
+
+
+def start_thread(target):
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread
+
+
+def in_process_client():
+    """
+    Imports the server in this process. Returns a function creating a
+    send(path, params, body) -> status code function for a client thread,
+    a function starting client threads, the pid whose memory is measured and
+    the server process (None).
+
+    Clients run as tasks of the server's async mode, eg. eventlet green
+    threads, as requests would when served by socketio.run.
+    """
+    import app as server
+
+    def new_client():
+        client = server.app.test_client()
+
+        def send(path, params, body):
+            return client.post(path, query_string=params, data=body).status_code
+        return send
+
+    class Task:
+        def __init__(self, target):
+            self.done = False
+            server.socketio.start_background_task(self.run, target)
+
+        def run(self, target):
+            try:
+                target()
+            finally:
+                self.done = True
+
+        def join(self):
+            # Sleeping through the async mode lets the other tasks run
+            while not self.done:
+                server.socketio.sleep(0.005)
+
+    return new_client, Task, os.getpid(), None
+
+
+def socket_client():
+    """
+    Starts `python app.py` and sends requests to it over HTTP.
+    """
+    import requests
+    from benchmarks.responsiveness import start_server
+
+    proc, url = start_server()
+
+    def new_client():
+        session = requests.Session()
+
+        def send(path, params, body):
+            return session.post(url + path, params=params, data=body, timeout=120).status_code
+        return send
+
+    return new_client, start_thread, proc.pid, proc
+
+
+def parse_importtime(stderr):
+    """
+    Parses the output of `python -X importtime`. Returns a list of
+    (module, nesting level, cumulative ms) in the order imports finished.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), level, int(cumulative) / 1000))
+    return imports
+
+
+def measure_startup(runs=3, top=10):
+    """
+    Imports the server in `runs` fresh interpreters and keeps the fastest.
+
+    Returns:
+        Dict with the cumulative import time of app in ms, the wall time of
+        the whole process in ms and the `top` slowest modules app imports
+        directly, as [module, ms] pairs
+    """
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+            env=dict(os.environ, PRELOAD="0"))
+        wall = 1000 * (time.perf_counter() - start)
+        imports = parse_importtime(proc.stderr)
+        if proc.returncode != 0 or not imports or imports[-1][:2] != ("app", 0):
+            raise RuntimeError("Importing app failed:\n{}".format(proc.stderr[-2000:]))
+
+        # Modules app imports directly finished after the previous top level
+        # import and before app itself
+        direct = []
+        for name, level, ms in reversed(imports[:-1]):
+            if level == 0:
+                break
+            if level == 1:
+                direct.append([name, ms])
+        direct.sort(key=lambda module: -module[1])
+
+        startup = {"import_ms": imports[-1][2], "process_ms": wall,
+            "modules": direct[:top]}
+        if best is None or startup["import_ms"] < best["import_ms"]:
+            best = startup
+    return best
+
+
+def print_startup(startup, baseline=None):
+    line = "startup: import app {:.0f} ms, process {:.0f} ms".format(
+        startup["import_ms"], startup["process_ms"])
+    if baseline:
+        line += " ({:+.0%} / {:+.0%} vs baseline)".format(
+            startup["import_ms"] / baseline["import_ms"] - 1,
+            startup["process_ms"] / baseline["process_ms"] - 1)
+    print(line)
+    print("  " + ", ".join("{} {:.0f} ms".format(name, ms)
+        for name, ms in startup["modules"]))
+
+
+def run_load(new_client, spawn, path, params, bodies, concurrency, num_requests):
+    """
+    Sends num_requests requests from `concurrency` client threads started
+    with `spawn`, cycling through bodies. Returns (latencies in ms, number of
+    errors, wall time in seconds).
+    """
+    latencies = []
+    errors = [0]
+    counter = [0]
+    lock = threading.Lock()
+
+    def worker():
+        send = new_client()
+        while True:
+            with lock:
+                i = counter[0]
+                counter[0] += 1
+            if i >= num_requests:
+                return
+            start = time.perf_counter()
+            status = send(path, params, bodies[i % len(bodies)])
+            elapsed = 1000 * (time.perf_counter() - start)
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += int(status != 200)
+
+    start = time.perf_counter()
+    threads = [spawn(worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), errors[0], time.perf_counter() - start
+
+
+def run_configuration(transport, variant, endpoints, concurrency_levels, num_requests):
+    """
+    Benchmarks endpoints in this process, with the server started for the
+    given transport and ONNX model variant. Returns a list of result dicts.
+    """
+    from ocr.fake_vision import FakeVisionServer
+
+    vision = FakeVisionServer().start()
+    os.environ["VISION_ENDPOINT"] = vision.endpoint
+    os.environ["MONEY_MODEL_VARIANT"] = variant
+    os.environ["CACHE_BACKEND"] = "none"
+    os.environ.setdefault("GC_VISION_API_KEY", "benchmark")
+    # Served the way python app.py serves, with everything loaded up front
+    os.environ.setdefault("PRELOAD", "1")
+
+    if transport == "inprocess":
+        new_client, spawn, pid, proc = in_process_client()
+    else:
+        new_client, spawn, pid, proc = socket_client()
+
+    results = []
+    try:
+        for endpoint in endpoints:
+            path, params, corpus = ENDPOINTS[endpoint]
+            bodies = load_corpus(corpus)
+
+            # Warm up with every image once
+            send = new_client()
+            for body in bodies:
+                send(path, params, body)
+
+            for concurrency in concurrency_levels:
+                latencies, errors, wall = run_load(new_client, spawn, path, params,
+                    bodies, concurrency, num_requests)
+                rss, peak_rss = memory_mb(pid)
+                results.append({
+                    "transport": transport,
+                    "variant": variant,
+                    "endpoint": endpoint,
+                    "concurrency": concurrency,
+                    "requests": len(latencies),
+                    "errors": errors,
+                    "p50_ms": float(np.percentile(latencies, 50)),
+                    "p95_ms": float(np.percentile(latencies, 95)),
+                    "p99_ms": float(np.percentile(latencies, 99)),
+                    "mean_ms": float(latencies.mean()),
+                    "throughput_rps": len(latencies) / wall,
+                    "rss_mb": rss,
+                    "peak_rss_mb": peak_rss,
+                })
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    return results
+
+
+def run_isolated(transport, variant, endpoints, concurrency_levels, num_requests):
+    """
+    Runs `run_configuration` in a fresh interpreter.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        cmd = [sys.executable, "-m", "benchmarks.endpoints",
+            "--child", output.name, "--transport", transport, "--variants", variant,
+            "--requests", str(num_requests),
+            "--endpoints"] + endpoints + ["--concurrency"] + [str(c) for c in concurrency_levels]
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            text=True)
+        if proc.returncode != 0:
+            raise RuntimeError("Benchmark of {} ({}) failed:\n{}".format(
+                transport, variant, proc.stderr))
+        with open(output.name) as f:
+            return json.load(f)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+            text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return (result["transport"], result["variant"], result["endpoint"], result["concurrency"])
+
+
+def print_results(results, baseline=None):
+    """
+    Prints a table of results, with the change against a baseline run.
+    """
+    previous = {result_key(r): r for r in (baseline or [])}
+    print("{:<10} {:<6} {:<16} {:>4} {:>6} {:>9} {:>9} {:>9} {:>9} {:>9}{}".format(
+        "transport", "model", "endpoint", "conc", "errors", "p50 ms", "p95 ms", "p99 ms",
+        "req/s", "peak MB", "   p50/p95/req/s vs baseline" if baseline else ""))
+    for r in results:
+        line = "{:<10} {:<6} {:<16} {:>4} {:>6} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.2f} {:>9.1f}".format(
+            r["transport"], r["variant"], r["endpoint"], r["concurrency"], r["errors"],
+            r["p50_ms"], r["p95_ms"], r["p99_ms"], r["throughput_rps"], r["peak_rss_mb"])
+        old = previous.get(result_key(r))
+        if old is not None:
+            line += "   {:+.0%} / {:+.0%} / {:+.0%}".format(
+                r["p50_ms"] / old["p50_ms"] - 1, r["p95_ms"] / old["p95_ms"] - 1,
+                r["throughput_rps"] / old["throughput_rps"] - 1)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transport", nargs="+", default=["inprocess", "socket"],
+        choices=["inprocess", "socket"])
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS),
+        choices=list(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--requests", type=int, default=50,
+        help="requests per endpoint and concurrency level")
+    parser.add_argument("--variants", nargs="+", default=["fp32"],
+        help="ONNX model variants, each benchmarked on /classify_money")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--startup-runs", type=int, default=3,
+        help="fresh interpreters importing the server, 0 skips the startup measurement")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        results = run_configuration(args.transport[0], args.variants[0], args.endpoints,
+            args.concurrency, args.requests)
+        with open(args.child, "w") as f:
+            json.dump(results, f)
+        return
+
+    startup = measure_startup(args.startup_runs) if args.startup_runs > 0 else None
+
+    # Endpoints other than /classify_money don't depend on the model variant,
+    # they only run with the first one
+    results = []
+    for transport in args.transport:
+        for i, variant in enumerate(args.variants):
+            endpoints = [e for e in args.endpoints if i == 0 or ENDPOINTS[e][2] == "money"]
+            if endpoints:
+                results += run_isolated(transport, variant, endpoints, args.concurrency,
+                    args.requests)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline.get("results"))
+    if startup is not None:
+        print()
+        print_startup(startup, baseline.get("startup"))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "arguments": {k: v for k, v in vars(args).items()
+                    if k not in ("child", "output", "compare")},
+                "startup": startup,
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the accuracy and latency of the money classification model variants
+(fp32, int8, fp16) over a folder of labeled images.
+
+Images are labeled by their parent folder name, eg. 20/bill.jpg, or failing
+that by their file name, eg. 100.jpeg. Labels must be one of the model's
+classes ("no_bill", "1", "5", "10", "20", "50", "100"). Run from the
+repository root after building the variants with money_classification.quantize:
+
+    python -m benchmarks.money_variants [--images test_images/money_classification]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from money_classification.model_inference import CLASS_MAP, run_inference
+from money_classification.quantize import VARIANTS, list_images, load_image, variant_path
+from money_classification.session import create_session, warm_up
+
+
+def image_label(filename):
+    """
+    Class label of an image from its folder or file name, or None.
+    """
+    folder = os.path.basename(os.path.dirname(filename))
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    for candidate in (folder, stem):
+        if candidate in CLASS_MAP:
+            return candidate
+    return None
+
+
+def evaluate(session, images, repeat):
+    """
+    Returns the predictions and the median latency of each image.
+    """
+    predictions = []
+    latencies = []
+    for img in images:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            prediction = run_inference(session, img)
+            times.append(time.perf_counter() - start)
+        predictions.append(prediction)
+        latencies.append(np.median(times))
+    return predictions, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="money_classification/lucky-sweep-6_best_model.onnx")
+    parser.add_argument("--images", default="test_images/money_classification")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    filenames = list_images(args.images)
+    labels = [image_label(f) for f in filenames]
+    images = [load_image(f) for f in filenames]
+
+    results = {}
+    for variant in VARIANTS:
+        path = variant_path(args.model, variant)
+        if not os.path.exists(path):
+            print("Skipping {}, {} not found".format(variant, path))
+            continue
+        session = create_session(path)
+        warm_up(session)
+        results[variant] = evaluate(session, images, args.repeat)
+
+    print("{:<8} {:>10} {:>10} {:>12} {:>12}".format(
+        "variant", "accuracy", "agreement", "p50 ms", "mean ms"))
+    reference = results.get("fp32", (None, None))[0]
+    for variant, (predictions, latencies) in results.items():
+        labeled = [(p, l) for p, l in zip(predictions, labels) if l is not None]
+        accuracy = np.mean([p == l for p, l in labeled]) if labeled else float("nan")
+        agreement = np.mean([p == r for p, r in zip(predictions, reference)]) \
+            if reference is not None else float("nan")
+        print("{:<8} {:>10.3f} {:>10.3f} {:>12.1f} {:>12.1f}".format(variant,
+            accuracy, agreement, 1000 * np.median(latencies), 1000 * np.mean(latencies)))
+
+    print()
+    print("{:<48} {:>8} ".format("image", "label") + " ".join(
+        "{:>8}".format(v) for v in results))
+    for i, filename in enumerate(filenames):
+        print("{:<48} {:>8} ".format(filename, str(labels[i])) + " ".join(
+            "{:>8}".format(predictions[i]) for predictions, _ in results.values()))
+
+
+if __name__ == "__main__":
+    main()
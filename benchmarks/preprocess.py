@@ -0,0 +1,83 @@
+"""
+Compares the original step by step preprocess_img, which allocated a new
+full size array at every step, against the fused version writing into a
+reused buffer.
+
+Reports the mean time per call and the memory allocated during one call,
+traced with tracemalloc. Run from the repository root:
+
+    python -m benchmarks.preprocess [--repeat 200]
+"""
+import argparse
+import glob
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from image_utils import decode_image
+from money_classification.model_inference import IMG_SIZE, MEAN, STD, preprocess_img
+
+
+IMAGES = "test_images/money_classification/*"
+
+
+def legacy_preprocess_img(img):
+    """
+    Original preprocess_img.
+    """
+    img = cv2.resize(img, IMG_SIZE, interpolation=cv2.INTER_AREA)
+    img = img.astype(np.float32) / 255.0
+    img = np.transpose(img, (2, 0, 1))
+    img = (img - MEAN[:, np.newaxis, np.newaxis]) / STD[:, np.newaxis, np.newaxis]
+    img = img[np.newaxis, :]
+    return img
+
+
+def measure(fn, img, repeat):
+    """
+    Returns (mean ms per call, traced bytes allocated during one call).
+    """
+    fn(img)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(img)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    fn(img)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return 1000 * elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    out = np.empty((1, 3, IMG_SIZE[1], IMG_SIZE[0]), dtype=np.float32)
+    impls = [
+        ("legacy", legacy_preprocess_img),
+        ("fused", preprocess_img),
+        ("fused+buffer", lambda img: preprocess_img(img, out=out)),
+    ]
+
+    print("{:<44} {:<14} {:>10} {:>14} {:>12}".format(
+        "image", "impl", "ms/call", "allocated KB", "max abs diff"))
+    for filename in sorted(glob.glob(IMAGES)):
+        with open(filename, "rb") as f:
+            img = decode_image(f.read(), min_size=IMG_SIZE)
+        reference = legacy_preprocess_img(img)
+        for label, fn in impls:
+            ms, peak = measure(fn, img, args.repeat)
+            diff = np.abs(fn(img) - reference).max()
+            print("{:<44} {:<14} {:>10.3f} {:>14.1f} {:>12.2e}".format(
+                filename, label, ms, peak / 1024, diff))
+
+
+if __name__ == "__main__":
+    main()
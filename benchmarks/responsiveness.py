@@ -0,0 +1,131 @@
+"""
+Load test checking that the server stays responsive while color detection
+is saturated: measures the latency of the / liveness check while idle, then
+while several clients send /detect_color requests back to back.
+
+Starts `python app.py` with the current environment (with the result cache
+turned off) unless --url points at a running server. Compare worker pools
+with eg.:
+
+    WORKER_POOL=none python -m benchmarks.responsiveness
+    WORKER_POOL=thread python -m benchmarks.responsiveness
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+
+def start_server(args=("app.py",)):
+    """
+    Starts app.py, or the script and arguments given, and returns
+    (process, base url) once it is listening.
+    """
+    env = dict(os.environ, PYTHONUNBUFFERED="1", CACHE_BACKEND="none")
+    proc = subprocess.Popen([sys.executable] + list(args), env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in proc.stdout:
+        match = re.search(r"Server running on https?://([\d.]+):(\d+)", line)
+        if match:
+            url = "http://{}:{}".format(*match.groups())
+            break
+    else:
+        raise RuntimeError("Server exited before it started listening")
+
+    # Keep draining output so the server never blocks on a full pipe
+    threading.Thread(target=proc.stdout.read, daemon=True).start()
+    for _ in range(100):
+        try:
+            requests.get(url, timeout=1)
+            return proc, url
+        except (requests.ConnectionError, requests.Timeout):
+            # Pre-forked workers may still be loading
+            time.sleep(0.1)
+    proc.terminate()
+    proc.wait()
+    raise RuntimeError("Server did not answer on {}".format(url))
+
+
+def probe(url, duration, interval):
+    """
+    Latencies in ms of GET / requests sent every `interval` seconds.
+    """
+    latencies = []
+    session = requests.Session()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        start = time.perf_counter()
+        session.get(url + "/", timeout=60)
+        latencies.append(1000 * (time.perf_counter() - start))
+        time.sleep(interval)
+    return np.array(latencies)
+
+
+def saturate(url, data, stop, completed):
+    session = requests.Session()
+    while not stop.is_set():
+        response = session.post(url + "/detect_color", data=data, params={"k": 3},
+            timeout=120)
+        if response.status_code == 200:
+            completed.append(time.monotonic())
+
+
+def summary(label, latencies):
+    print("{:<12} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}".format(label, len(latencies),
+        np.percentile(latencies, 50), np.percentile(latencies, 95), latencies.max()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="running server to test instead of starting one")
+    parser.add_argument("--image", default="test_images/color_detection/fake_flowers.jpeg")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    proc = None
+    url = args.url
+    if url is None:
+        proc, url = start_server()
+
+    try:
+        with open(args.image, "rb") as f:
+            data = f.read()
+
+        idle = probe(url, args.duration / 2, args.interval)
+
+        stop = threading.Event()
+        completed = []
+        clients = [threading.Thread(target=saturate, args=(url, data, stop, completed),
+            daemon=True) for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        time.sleep(1.0)
+        start = time.monotonic()
+        loaded = probe(url, args.duration, args.interval)
+        throughput = sum(t >= start for t in completed) / (time.monotonic() - start)
+        stop.set()
+        for client in clients:
+            client.join()
+
+        print("{:<12} {:>8} {:>10} {:>10} {:>10}".format(
+            "GET /", "samples", "p50 ms", "p95 ms", "max ms"))
+        summary("idle", idle)
+        summary("saturated", loaded)
+        print("/detect_color throughput while saturated: {:.2f} req/s".format(throughput))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Per core scaling of the pre-forked server (serve.py): runs it with an
+increasing number of workers and reports the throughput of each endpoint,
+the speedup over one worker, and the memory used by all server processes.
+
+Memory is reported as the sum of the proportional set size (PSS) of the
+processes, which counts pages shared between workers once, next to the sum
+of their resident set sizes (RSS), which counts them once per worker.
+
+Run from the repository root:
+
+    python -m benchmarks.scaling [--workers 1 2 4] [--clients-per-worker 2]
+        [--endpoints detect_color classify_money] [--requests 200]
+"""
+import argparse
+import os
+import subprocess
+
+import numpy as np
+
+from benchmarks.endpoints import ENDPOINTS, load_corpus, run_load, start_thread
+from benchmarks.responsiveness import start_server
+
+
+def server_pids(pid):
+    """
+    pid and the pids of its children.
+    """
+    children = subprocess.run(["pgrep", "-P", str(pid)], capture_output=True,
+        text=True).stdout.split()
+    return [pid] + [int(child) for child in children]
+
+
+def memory_mb(pids):
+    """
+    Sums of the PSS and RSS of processes in MB, from /proc.
+    """
+    pss = rss = 0.0
+    for pid in pids:
+        try:
+            with open("/proc/{}/smaps_rollup".format(pid)) as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        pss += int(line.split()[1]) / 1024
+                    elif line.startswith("Rss:"):
+                        rss += int(line.split()[1]) / 1024
+        except FileNotFoundError:
+            pass
+    return pss, rss
+
+
+def run_workers(workers, endpoints, clients_per_worker, num_requests):
+    """
+    Benchmarks endpoints against serve.py with the given number of workers.
+    Returns a list of result dicts.
+    """
+    import requests
+
+    proc, url = start_server(["serve.py", "--host", "127.0.0.1", "--port", "0",
+        "--workers", str(workers)])
+
+    def new_client():
+        session = requests.Session()
+
+        def send(path, params, body):
+            return session.post(url + path, params=params, data=body, timeout=120).status_code
+        return send
+
+    results = []
+    try:
+        for endpoint in endpoints:
+            path, params, corpus = ENDPOINTS[endpoint]
+            bodies = load_corpus(corpus)
+
+            # Warm up every worker
+            run_load(new_client, start_thread, path, params, bodies,
+                workers * clients_per_worker, workers * len(bodies))
+
+            latencies, errors, wall = run_load(new_client, start_thread, path, params,
+                bodies, workers * clients_per_worker, num_requests)
+            pss, rss = memory_mb(server_pids(proc.pid))
+            results.append({
+                "workers": workers,
+                "endpoint": endpoint,
+                "errors": errors,
+                "throughput_rps": len(latencies) / wall,
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "pss_mb": pss,
+                "rss_mb": rss,
+            })
+    finally:
+        proc.terminate()
+        proc.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+",
+        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--clients-per-worker", type=int, default=2)
+    parser.add_argument("--endpoints", nargs="+", default=["detect_color", "classify_money"],
+        choices=[e for e in ENDPOINTS if ENDPOINTS[e][2] != "ocr"])
+    parser.add_argument("--requests", type=int, default=200,
+        help="requests per endpoint and number of workers")
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        results += run_workers(workers, args.endpoints, args.clients_per_worker,
+            args.requests)
+
+    single = {r["endpoint"]: r["throughput_rps"] for r in results if r["workers"] == 1}
+    print("{} CPUs".format(os.cpu_count()))
+    print("{:<16} {:>7} {:>6} {:>9} {:>9} {:>8} {:>9} {:>9}".format(
+        "endpoint", "workers", "errors", "req/s", "p50 ms", "speedup", "PSS MB", "RSS MB"))
+    for r in sorted(results, key=lambda r: (r["endpoint"], r["workers"])):
+        speedup = r["throughput_rps"] / single[r["endpoint"]] \
+            if r["endpoint"] in single else float("nan")
+        print("{:<16} {:>7} {:>6} {:>9.2f} {:>9.1f} {:>8.2f} {:>9.1f} {:>9.1f}".format(
+            r["endpoint"], r["workers"], r["errors"], r["throughput_rps"], r["p50_ms"],
+            speedup, r["pss_mb"], r["rss_mb"]))
+
+
+if __name__ == "__main__":
+    main()
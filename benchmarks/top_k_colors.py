@@ -0,0 +1,96 @@
+"""
+Checks how much pixel sampling ahead of k-means changes the dominant colors
+found by top_k_colors, and how much time it saves. Every configuration is
+compared against clustering all pixels of the full resolution image.
+
+"reuse" rows time k-means continuing from the previous frame's clustering
+(COLOR_KMEANS_REUSE), on a copy of the image with sensor-like noise added.
+
+Run from the repository root:
+
+    python -m benchmarks.top_k_colors [-k 3] [--budgets 16384 65536]
+"""
+import argparse
+import glob
+import time
+
+import cv2
+import numpy as np
+
+from color_detection.detect import top_k_colors
+from color_detection.palette import get_palette
+
+
+IMAGES = "test_images/color_detection/*"
+
+
+def color_distance(reference, colors):
+    """
+    Mean RGB distance between each reference color and the closest of `colors`.
+    """
+    reference = np.array(reference)
+    colors = np.array(colors)
+    dist = np.linalg.norm(reference[:, np.newaxis, :] - colors, axis=2)
+    return dist.min(axis=1).mean()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", type=int, default=3)
+    parser.add_argument("--palette", default="medium")
+    parser.add_argument("--budgets", type=int, nargs="+", default=[16384, 65536])
+    args = parser.parse_args()
+
+    palette = get_palette(args.palette)
+    configs = []
+    for budget in args.budgets:
+        configs.append(("random", dict(max_pixels=budget, method="random")))
+        configs.append(("stratified", dict(max_pixels=budget, method="stratified")))
+        configs.append(("resize", dict(max_pixels=budget, resize=True)))
+        configs.append(("random+exact", dict(max_pixels=budget, method="random",
+            exact_counts=True)))
+
+    print("{:<32} {:<14} {:>8} {:>9} {:>9} {:>9}  {}".format(
+        "image", "sampling", "budget", "seconds", "dist", "same top", "colors"))
+    for filename in sorted(glob.glob(IMAGES)):
+        img = cv2.cvtColor(cv2.imread(filename), cv2.COLOR_BGR2RGB)
+        name = filename.split("/")[-1]
+
+        start = time.perf_counter()
+        reference = top_k_colors(img, args.k)
+        elapsed = time.perf_counter() - start
+        reference_names = palette.names[palette.lookup(reference)].tolist()
+        print("{:<32} {:<14} {:>8} {:>9.3f} {:>9} {:>9}  {}".format(
+            name, "full", "-", elapsed, "-", "-", ", ".join(reference_names)))
+
+        for label, kwargs in configs:
+            start = time.perf_counter()
+            colors = top_k_colors(img, args.k, **kwargs)
+            elapsed = time.perf_counter() - start
+            names = palette.names[palette.lookup(colors)].tolist()
+            print("{:<32} {:<14} {:>8} {:>9.3f} {:>9.1f} {:>9}  {}".format(
+                name, label, kwargs["max_pixels"], elapsed,
+                color_distance(reference, colors), str(names[0] == reference_names[0]),
+                ", ".join(names)))
+
+        # Next frame of the same scene, clustered from the previous frame
+        rng = np.random.default_rng(0)
+        noise = rng.integers(-4, 5, size=img.shape)
+        next_frame = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        for budget in args.budgets:
+            kwargs = dict(max_pixels=budget, method="stratified")
+            _, state = top_k_colors(img, args.k, return_state=True, **kwargs)
+
+            start = time.perf_counter()
+            colors = top_k_colors(next_frame, args.k, previous=state, **kwargs)
+            elapsed = time.perf_counter() - start
+            names = palette.names[palette.lookup(colors)].tolist()
+            print("{:<32} {:<14} {:>8} {:>9.3f} {:>9.1f} {:>9}  {}".format(
+                name, "reuse", budget, elapsed,
+                color_distance(reference, colors), str(names[0] == reference_names[0]),
+                ", ".join(names)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import cv2
+import numpy as np
+
+
+class MemoryBackend:
+    """
+    In-process LRU store bounded by number of entries and total bytes.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = (time.time() + ttl, value)
+            self._bytes += len(value)
+
+            # Evict least recently used entries until within bounds
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskBackend:
+    """
+    SQLite store on local disk, shared by every worker process pointing at the
+    same file. Bounded by number of entries and total bytes, evicting the
+    least recently used entries first. The file is opened on first use.
+    """
+
+    def __init__(self, path, max_entries=1024, max_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _connection(self):
+        """
+        SQLite connections can't be shared between threads, nor used across
+        fork(), use one per thread and process. Connections inherited from
+        the parent process are left untouched.
+        """
+        connections = self._local.__dict__.setdefault("connections", {})
+        db = connections.get(os.getpid())
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            with db:
+                db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, "
+                    "value BLOB, size INTEGER, expires REAL, accessed REAL)")
+                db.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+            connections[os.getpid()] = db
+        return db
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as db:
+            row = db.execute("SELECT value FROM cache WHERE key = ? AND expires >= ?",
+                (key, now)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+        return bytes(row[0])
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._connection() as db:
+            db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), now + ttl, now))
+            db.execute("DELETE FROM cache WHERE expires < ?", (now,))
+
+            # Evict least recently used entries until within bounds
+            count, total = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                rows = db.execute("SELECT key, size FROM cache ORDER BY accessed").fetchall()
+                evict = []
+                for old_key, size in rows:
+                    if count <= self.max_entries and total <= self.max_bytes:
+                        break
+                    evict.append((old_key,))
+                    count -= 1
+                    total -= size
+                db.executemany("DELETE FROM cache WHERE key = ?", evict)
+
+    def __len__(self):
+        with self._connection() as db:
+            return db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+def dhash(img, size=16):
+    """
+    Perceptual difference hash of an RGB image: compares the brightness of
+    neighbouring pixels in a size x size thumbnail. Re-captures of the same
+    scene with slightly different pixel values get the same hash.
+
+    Returns:
+        hex string of size * size bits
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    thumb = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = thumb[:, 1:] > thumb[:, :-1]
+    return np.packbits(bits).tobytes().hex()
+
+
+def fingerprint(settings):
+    """
+    Short hash of JSON-serializable settings, eg. to tell apart results
+    computed under different configurations in cache keys.
+    """
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Caches endpoint responses keyed by a hash of the request.
+
+    Keys combine the endpoint name, the request parameters that affect the
+    result, and either a SHA-256 of the request body or, in perceptual mode,
+    a perceptual hash of the decoded image.
+    """
+
+    def __init__(self, backend=None, ttl=300.0, perceptual=False, hash_size=16):
+        """
+        Args:
+            backend : MemoryBackend, DiskBackend or None to disable caching
+            ttl : seconds a result stays valid
+            perceptual : key images by perceptual hash instead of their bytes
+            hash_size : perceptual hash thumbnail size, hashes have
+                hash_size * hash_size bits
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.perceptual = perceptual and backend is not None
+        self.hash_size = hash_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def key(self, endpoint, params, body=None, img=None):
+        """
+        Cache key of a request. The perceptual hash of `img` is used if given,
+        else the hash of `body`.
+        """
+        if img is not None:
+            content = "dhash:" + dhash(img, self.hash_size)
+        else:
+            content = "sha256:" + hashlib.sha256(body).hexdigest()
+        return "{}:{}:{}".format(endpoint, json.dumps(params, sort_keys=True), content)
+
+    def get(self, key):
+        """
+        Returns the cached response dict, or None.
+        """
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if value is None else json.loads(value)
+
+    def set(self, key, response):
+        if self.backend is not None:
+            self.backend.set(key, json.dumps(response).encode("utf-8"), self.ttl)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.backend) if self.backend is not None else 0,
+            }
@@ -0,0 +1,113 @@
+import numpy as np
+
+
+# sRGB (D65) -> CIE XYZ
+RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+
+# D65 reference white
+WHITE = np.array([0.95047, 1.0, 1.08883])
+
+# Number of float64 arrays the size of the distance matrix delta_e_2000 keeps
+# alive at once, used to size chunks
+DELTA_E_2000_TEMPORARIES = 24
+
+
+def rgb_to_lab(rgb):
+    """
+    Converts [R, G, B] values (0 to 255, sRGB) to CIELAB (D65).
+
+    Args:
+        rgb : array of shape (..., 3)
+
+    Returns:
+        float64 array of the same shape with [L, a, b] values
+    """
+    rgb = np.asarray(rgb, dtype=np.float64) / 255.0
+
+    # Undo sRGB gamma
+    linear = np.where(rgb > 0.04045, ((rgb + 0.055) / 1.055) ** 2.4, rgb / 12.92)
+
+    xyz = (linear @ RGB_TO_XYZ.T) / WHITE
+    delta = 6.0 / 29.0
+    f = np.where(xyz > delta ** 3, np.cbrt(xyz), xyz / (3 * delta ** 2) + 4.0 / 29.0)
+
+    lab = np.empty_like(f)
+    lab[..., 0] = 116.0 * f[..., 1] - 16.0
+    lab[..., 1] = 500.0 * (f[..., 0] - f[..., 1])
+    lab[..., 2] = 200.0 * (f[..., 1] - f[..., 2])
+    return lab
+
+
+def delta_e_76(lab1, lab2):
+    """
+    CIE76 color difference: euclidean distance in CIELAB. Inputs broadcast
+    against each other.
+    """
+    return np.linalg.norm(np.asarray(lab1) - np.asarray(lab2), axis=-1)
+
+
+def delta_e_2000(lab1, lab2):
+    """
+    CIEDE2000 color difference (kL = kC = kH = 1). Inputs broadcast against
+    each other, eg. (N, 1, 3) and (1, M, 3) give an (N, M) distance matrix.
+
+    Follows Sharma, Wu and Dalal, "The CIEDE2000 Color-Difference Formula:
+    Implementation Notes, Supplementary Test Data, and Mathematical
+    Observations" (2005).
+    """
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    # Stretch a* so that neutral colors are treated more evenly
+    C_mean = (np.hypot(a1, b1) + np.hypot(a2, b2)) / 2.0
+    C_mean7 = C_mean ** 7
+    G = 0.5 * (1.0 - np.sqrt(C_mean7 / (C_mean7 + 25.0 ** 7)))
+    a1p = (1.0 + G) * a1
+    a2p = (1.0 + G) * a2
+
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360.0
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360.0
+
+    # Differences in lightness, chroma and hue
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180.0, dhp - 360.0, dhp)
+    dhp = np.where(dhp < -180.0, dhp + 360.0, dhp)
+    chroma_product = C1p * C2p
+    dhp = np.where(chroma_product == 0, 0.0, dhp)
+    dHp = 2.0 * np.sqrt(chroma_product) * np.sin(np.radians(dhp) / 2.0)
+
+    # Means used by the weighting functions
+    Lp_mean = (L1 + L2) / 2.0
+    Cp_mean = (C1p + C2p) / 2.0
+    hp_sum = h1p + h2p
+    hp_mean = np.where(np.abs(h1p - h2p) > 180.0,
+        np.where(hp_sum < 360.0, hp_sum + 360.0, hp_sum - 360.0), hp_sum) / 2.0
+    hp_mean = np.where(chroma_product == 0, hp_sum, hp_mean)
+
+    T = 1.0 - 0.17 * np.cos(np.radians(hp_mean - 30.0)) \
+        + 0.24 * np.cos(np.radians(2.0 * hp_mean)) \
+        + 0.32 * np.cos(np.radians(3.0 * hp_mean + 6.0)) \
+        - 0.20 * np.cos(np.radians(4.0 * hp_mean - 63.0))
+    d_theta = 30.0 * np.exp(-(((hp_mean - 275.0) / 25.0) ** 2))
+    Cp_mean7 = Cp_mean ** 7
+    R_C = 2.0 * np.sqrt(Cp_mean7 / (Cp_mean7 + 25.0 ** 7))
+    L_term = (Lp_mean - 50.0) ** 2
+    S_L = 1.0 + 0.015 * L_term / np.sqrt(20.0 + L_term)
+    S_C = 1.0 + 0.045 * Cp_mean
+    S_H = 1.0 + 0.015 * Cp_mean * T
+    R_T = -np.sin(np.radians(2.0 * d_theta)) * R_C
+
+    dL = dLp / S_L
+    dC = dCp / S_C
+    dH = dHp / S_H
+    return np.sqrt(dL ** 2 + dC ** 2 + dH ** 2 + R_T * dC * dH)
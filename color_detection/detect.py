@@ -1,10 +1,130 @@
+import collections
 import cv2
-import os
 import numpy as np
-import pandas as pd
 
+from color_detection.palette import DEFAULT_MAX_BYTES, get_palette
 
-def top_k_colors(img, k):
+
+# Clustering of the previous frame: its cluster centers, and the mean squared
+# distance between each pixel and its center
+KMeansState = collections.namedtuple("KMeansState", ["centers", "error"])
+
+
+def sample_pixels(img, max_pixels=None, method="random", resize=False, seed=0):
+    """
+    Reduces an image to at most `max_pixels` pixels before clustering.
+
+    Args:
+        img : np array containing raw image data in RGB format
+        max_pixels : pixel budget. All pixels are kept if None or if the image
+            is already small enough.
+        method : "random" picks pixels uniformly at random, "stratified" keeps
+            one pixel per cell of a regular grid laid over the image
+        resize : if True, shrink the image with INTER_AREA (averaging
+            neighbouring pixels) instead of picking pixels
+        seed : seed for the random generator, so results are reproducible
+
+    Returns:
+        float32 array of N x 3, where each row is a pixel (R, G, B)
+    """
+    height, width = img.shape[:2]
+    num_pixels = height * width
+    if max_pixels is None or num_pixels <= max_pixels:
+        return np.float32(img.reshape(-1, 3))
+
+    rng = np.random.default_rng(seed)
+    if resize:
+        scale = np.sqrt(max_pixels / num_pixels)
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        small = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+        return np.float32(small.reshape(-1, 3))
+    elif method == "stratified":
+        step = int(np.ceil(np.sqrt(num_pixels / max_pixels)))
+        dy, dx = rng.integers(0, step, size=2)
+        return np.float32(img[dy::step, dx::step].reshape(-1, 3))
+    elif method == "random":
+        idx = rng.integers(0, num_pixels, size=max_pixels)
+        return np.float32(img.reshape(-1, 3)[idx])
+    else:
+        raise ValueError("Unknown sampling method '{}'".format(method))
+
+
+def assign_labels(pixels, centers, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Index of the closest center for each pixel, computed in chunks.
+
+    Args:
+        pixels : array of N x 3 pixels
+        centers : array of num_centers x 3 cluster centers
+        max_bytes : memory ceiling for the temporary distance arrays
+
+    Returns:
+        int array of shape (N,) with center indices
+    """
+    pixels = pixels.reshape(-1, 3)
+    centers = np.float32(centers)
+    chunk = max(1, int(max_bytes // ((len(centers) + 3) * 4)))
+
+    labels = np.empty(len(pixels), dtype=np.intp)
+    for start in range(0, len(pixels), chunk):
+        block = np.float32(pixels[start:start + chunk])
+        dist = np.zeros((len(block), len(centers)), dtype=np.float32)
+        for c in range(3):
+            diff = block[:, c, np.newaxis] - centers[:, c]
+            dist += diff * diff
+        labels[start:start + chunk] = np.argmin(dist, axis=1)
+
+    return labels
+
+
+def cluster_pixels(pixels, num_clusters, previous=None, restart_ratio=2.0):
+    """
+    K-means clustering of pixels, optionally continuing from the clustering of
+    a previous, similar frame.
+
+    Starting from random centers needs several attempts to find a good
+    clustering. Consecutive frames of a video are almost identical though,
+    so the previous centers are already close to the answer: pixels are
+    labelled with their closest previous center and k-means runs a single
+    attempt from there. If the previous centers fit the new pixels much worse
+    than they fit their own frame, the scene changed and clustering restarts
+    from random centers.
+
+    Args:
+        pixels : float32 array of N x 3 pixels
+        num_clusters : number of clusters
+        previous : KMeansState of the previous frame, or None
+        restart_ratio : restart from random centers when the previous centers
+            fit these pixels more than this many times worse than they fit
+            the previous frame
+
+    Returns:
+        [labels, centers, state]: Cluster index of each pixel, the cluster
+            centers, and the KMeansState to pass on to the next frame
+    """
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+
+    labels = None
+    if previous is not None and len(previous.centers) == num_clusters:
+        labels = assign_labels(pixels, previous.centers)
+        error = np.mean(np.sum((pixels - previous.centers[labels]) ** 2, axis=1))
+        # Small errors are noise, don't restart over them
+        if error > restart_ratio * max(previous.error, 1.0):
+            labels = None
+
+    if labels is None:
+        compactness, labels, centers = cv2.kmeans(pixels, num_clusters, None,
+            criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    else:
+        compactness, labels, centers = cv2.kmeans(pixels, num_clusters,
+            labels.astype(np.int32).reshape(-1, 1), criteria, 1,
+            cv2.KMEANS_USE_INITIAL_LABELS)
+
+    return labels, centers, KMeansState(centers, compactness / len(pixels))
+
+
+def top_k_colors(img, k, max_pixels=None, method="random", resize=False,
+        exact_counts=False, previous=None, restart_ratio=2.0, return_state=False):
     """
     Finds the most dominant k colors in an image using k means clustering.
     Idea was inspired by https://rb.gy/ik31uk
@@ -12,30 +132,39 @@ def top_k_colors(img, k):
     Args:
         img : np array containing raw image data in RGB format
         k : how many colors to return
+        max_pixels : cluster a sample of at most this many pixels instead of
+            the whole image. See `sample_pixels`.
+        method : sampling method, "random" or "stratified"
+        resize : downscale with INTER_AREA instead of picking pixels
+        exact_counts : rank colors by assigning every pixel of the full image
+            to its closest cluster, rather than by counts within the sample
+        previous : KMeansState of the previous frame from the same camera,
+            to continue its clustering. See `cluster_pixels`.
+        restart_ratio : scene change threshold, see `cluster_pixels`
+        return_state : also return the KMeansState of this frame
 
     Returns:
         List containing numpy arrays [R, G, B] of the most dominant colors in
-        sorted order from most dominant to least dominant
+        sorted order from most dominant to least dominant, and the KMeansState
+        if return_state is True
     """
     # Convert to float32 array of N x 3, where each row is a pixel (R, G, B)
-    pixels = np.float32(img.reshape(-1, 3))
+    pixels = sample_pixels(img, max_pixels, method, resize)
 
     # Perform K Means clustering with 2*k means
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
-    flags = cv2.KMEANS_RANDOM_CENTERS
-    _, labels, palette = cv2.kmeans(pixels, 2*k, None, criteria, 10, flags)
-    _, counts = np.unique(labels, return_counts=True)
+    labels, palette, state = cluster_pixels(pixels, 2*k, previous, restart_ratio)
 
-    # Sort color counts
-    count_to_color = {}
-    for i in range(len(counts)):
-        count_to_color[counts[i]] = palette[i]
+    if exact_counts and len(pixels) < img.shape[0] * img.shape[1]:
+        labels = assign_labels(img, palette)
+    counts = np.bincount(labels.ravel(), minlength=len(palette))
 
-    colors_sorted = []
-    for key in sorted(count_to_color, reverse=True):
-        colors_sorted.append(np.array(count_to_color[key]))
+    # Sort colors by pixel count, most dominant first
+    order = np.argsort(-counts, kind="stable")
+    colors_sorted = [np.array(palette[i]) for i in order]
 
-    # Return top 3 colors only
+    # Return top k colors only
+    if return_state:
+        return colors_sorted[0:k], state
     return colors_sorted[0:k]
 
 
@@ -66,7 +195,7 @@ def most_dominant_color(img):
     return np.array(dominant)
 
 
-def detect_color(img, k):
+def detect_color(img, k, palette=None, return_state=False, **sampling):
     """
     Finds the most dominant k colors in an image and matches it to
     a human readable string. (Eg. Red, Green, Blue, Yellow, etc.)
@@ -75,73 +204,137 @@ def detect_color(img, k):
     Args:
         img : np array containing raw image data in RGB format
         k : how many colors to return
+        palette : Palette used to name colors. Defaults to the medium palette.
+        return_state : also return the KMeansState of this frame
+        sampling : Keyword arguments passed on to `top_k_colors`
+            (max_pixels, method, resize, exact_counts, previous, restart_ratio).
 
     Returns:
         [color_names, rgb_array]: Array of strings with the color's names, and
             a list containing the [R, G, B] pixels of those colors. Sorted
-            from most dominant to least dominant.
+            from most dominant to least dominant. Followed by the KMeansState
+            if return_state is True.
     """
-    # Load color database into numpy arrays
-    colors = pd.read_csv("{}/colors_medium.csv".format(
-        os.path.dirname(os.path.realpath(__file__))))
-    color_array = colors[['R','G','B']].to_numpy()
-    color_names = colors.Name.to_numpy()
+    palette = get_palette() if palette is None else palette
 
     # Get top k colors from image. Each color is in [R, G, B] format
-    top_k = top_k_colors(img, k)
+    top_k, state = top_k_colors(img, k, return_state=True, **sampling)
 
     # Match each [R, G, B] to a color name, eg. "Red"
-    top_k_names = []
-    top_k_list = []
-    for color in top_k:
-        top_k_list.append(color.tolist())
-        dist = np.linalg.norm(color - color_array, axis=1)
-        color_idx = np.argmin(dist)
-        top_k_names.append(color_names[color_idx])
+    top_k_list = [color.tolist() for color in top_k]
+    top_k_names = palette.names[palette.lookup(top_k_list)].tolist()
 
+    if return_state:
+        return top_k_names, top_k_list, state
     return top_k_names, top_k_list
 
 
-def detect_color_2(img, k):
+def detect_color_2(img, k, palette=None, max_bytes=DEFAULT_MAX_BYTES):
     """
     Finds the most dominant k colors in an image and matches it to
     a human readable string. (Eg. Red, Green, Blue, Yellow, etc.)
     Uses euclidean distance from each pixel to a color dataset to find
-    top colors.
+    top colors. Pixels are matched exactly with the "rgb" metric, and
+    through the palette's lookup table with the perceptual metrics, whose
+    exact matching is too slow per request.
 
     Args:
         img : np array containing raw image data in RGB format
         k : how many colors to return
+        palette : Palette used to name colors. Defaults to the medium palette.
+        max_bytes : Memory ceiling for the temporary distance arrays. Pixels
+            are matched in chunks small enough to stay under it.
 
     Returns:
         color_names : Array of strings with the color's names
     """
-    # Load color database into numpy arrays
-    colors = pd.read_csv("{}/colors_medium.csv".format(
-        os.path.dirname(os.path.realpath(__file__))))
-    color_array = colors[['R','G','B']].to_numpy()
-    color_names = colors.Name.to_numpy()
+    palette = get_palette() if palette is None else palette
 
     # Flatten image into (N, 3) array
     pixels = img.reshape((-1, 3))
 
-    # Copy pixels into shape (N, num_colors, 3)
-    pixels_copy = np.repeat(pixels[:, np.newaxis, :], color_array.shape[0], axis=1)
-
-    # Get euclidean distance between each pixel and each color
-    dist = np.linalg.norm(pixels_copy - color_array, axis=2)
-
-    # Get index of color with smallest distance for each pixel
-    color_idx = np.argmin(dist, axis=1)
-
-    # Get pixel counts for each color
-    unique, counts = np.unique(color_idx, return_counts=True)
+    # Match pixels chunk by chunk and accumulate pixel counts for each color.
+    # Photos repeat the same [R, G, B] values many times, so only the
+    # distinct values in each chunk are matched against the palette.
+    counts = np.zeros(len(palette), dtype=np.int64)
+    chunk = max(1, int(max_bytes // ((len(palette) + 3) * 8)))
+    for start in range(0, len(pixels), chunk):
+        block = pixels[start:start + chunk].astype(np.int32)
+        packed = (block[:, 0] << 16) | (block[:, 1] << 8) | block[:, 2]
+        values, value_counts = np.unique(packed, return_counts=True)
+
+        distinct = np.stack([values >> 16, (values >> 8) & 0xFF, values & 0xFF], axis=1)
+        if palette.metric == "rgb":
+            color_idx = palette.nearest(distinct, max_bytes)
+        else:
+            color_idx = palette.lookup(distinct)
+        counts += np.bincount(color_idx, weights=value_counts,
+            minlength=len(palette)).astype(np.int64)
+
+    # Only keep colors that matched at least one pixel
+    unique = np.flatnonzero(counts)
+    counts = counts[unique]
 
     # Get k colors with highest counts
     max_idx = np.argpartition(counts, -k)[-k:]
 
     # Result is not sorted, sort to get order of 1st, 2nd, 3rd
     max_idx = np.sort(max_idx)
-    top_colors = color_names[unique[max_idx]]
+    top_colors = palette.names[unique[max_idx]]
 
     return top_colors
+
+
+def detect_color_3(img, k, palette=None, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Finds the most dominant k colors in an image and matches it to
+    a human readable string. (Eg. Red, Green, Blue, Yellow, etc.)
+    Builds a histogram of the image over the bins of the palette's lookup
+    table, then merges bins that map to the same color name. Linear in the
+    number of pixels with no search or iteration.
+
+    Args:
+        img : np array containing raw image data in RGB format
+        k : how many colors to return
+        palette : Palette used to name colors. Defaults to the medium palette.
+        max_bytes : Memory ceiling for temporary arrays. Pixels are binned in
+            chunks small enough to stay under it.
+
+    Returns:
+        [color_names, rgb_array]: Array of strings with the color's names, and
+            a list containing the mean [R, G, B] of the pixels matched to each
+            color, to within half a bin. Sorted from most dominant to least
+            dominant.
+
+    Raises:
+        ValueError : if k is less than 1
+    """
+    if k < 1:
+        raise ValueError("k must be at least 1, got {}".format(k))
+    palette = get_palette() if palette is None else palette
+
+    # Flatten image into (N, 3) array
+    pixels = img.reshape((-1, 3))
+
+    # Pixel count of every lookup table bin. Each pixel of a chunk needs its
+    # int32 bin index.
+    counts = np.zeros(len(palette.lut), dtype=np.int64)
+    chunk = max(1, int(max_bytes // 4))
+    for start in range(0, len(pixels), chunk):
+        bins = palette.pack(pixels[start:start + chunk])
+        counts += np.bincount(bins, minlength=len(counts))
+
+    # Merge bins into colors using the lookup table, locating each color at
+    # the mean of its bins' centers weighted by their pixel counts
+    color_counts = np.bincount(palette.lut, weights=counts, minlength=len(palette))
+    centers = palette.bin_centers()
+    color_sums = np.stack([np.bincount(palette.lut, weights=counts * centers[:, c],
+        minlength=len(palette)) for c in range(3)], axis=1)
+
+    # Sort colors by pixel count, most dominant first, skipping colors that
+    # matched no pixel
+    order = np.argsort(-color_counts, kind="stable")[:k]
+    order = order[color_counts[order] > 0]
+    rgb = color_sums[order] / color_counts[order, np.newaxis]
+
+    return palette.names[order].tolist(), rgb.tolist()
@@ -0,0 +1,247 @@
+import csv
+import hashlib
+import os
+import tempfile
+import numpy as np
+from functools import lru_cache
+
+from color_detection.colorspace import DELTA_E_2000_TEMPORARIES, delta_e_2000, rgb_to_lab
+
+
+PALETTE_FILES = {
+    "small": "colors_small.csv",
+    "medium": "colors_medium.csv",
+    "large": "colors_large.csv",
+}
+
+# Upper bound on the size of temporary distance arrays built while matching
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Color difference used to find the closest named color: euclidean distance
+# in RGB, CIE76 (euclidean distance in CIELAB) or CIEDE2000
+METRICS = ["rgb", "cie76", "ciede2000"]
+
+
+class Palette:
+    """
+    A set of named colors with a precomputed RGB -> color index lookup table.
+    The table quantizes each channel to `bits` bits, so naming a pixel or a
+    cluster center is a single table read instead of a search over every
+    color in the palette.
+
+    Colors are matched with the given metric. For the perceptual metrics, the
+    palette is converted to CIELAB once, and the cost of the metric is only
+    paid while building the table.
+    """
+
+    def __init__(self, names, rgb, bits=6, metric="rgb", lut=None):
+        """
+        Args:
+            names : list of human readable color names
+            rgb : array of shape (num_colors, 3) with the [R, G, B] values of
+                each named color
+            bits : number of bits per channel used by the lookup table
+            metric : color difference, one of METRICS
+            lut : previously built lookup table for these arguments, or None
+                to build it
+        """
+        if not 1 <= bits <= 8:
+            raise ValueError("bits must be between 1 and 8, got {}".format(bits))
+        if metric not in METRICS:
+            raise ValueError("Unknown color metric '{}', expected one of {}".format(
+                metric, METRICS))
+
+        self.names = np.array(names, dtype=object)
+        self.rgb = np.asarray(rgb, dtype=np.int32).reshape(-1, 3)
+        self.lab = rgb_to_lab(self.rgb)
+        self.bits = bits
+        self.metric = metric
+        self._bin_centers = None
+        self.lut = self._build_lut() if lut is None else np.asarray(lut, dtype=np.uint16)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _build_lut(self):
+        """
+        Matches the center of every quantized RGB bin to its closest color.
+        Returns a flat uint16 array indexed by packed (R, G, B) bin numbers.
+        """
+        return self.nearest(self.bin_centers()).astype(np.uint16)
+
+    def bin_centers(self):
+        """
+        [R, G, B] center of every quantized bin, in lookup table order.
+        Returns a read-only float32 array of shape (2 ** (3 * bits), 3),
+        computed once per palette like the lookup table.
+        """
+        if self._bin_centers is None:
+            levels = 1 << self.bits
+            step = 256 // levels
+            centers = (np.arange(levels) * step + (step - 1) / 2.0).astype(np.float32)
+
+            r, g, b = np.meshgrid(centers, centers, centers, indexing="ij")
+            bin_centers = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+            bin_centers.flags.writeable = False
+            self._bin_centers = bin_centers
+        return self._bin_centers
+
+    def nearest(self, colors, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Exact nearest palette color (by the palette's metric) for each row of
+        `colors`. Work is done in chunks so that the temporary distance
+        arrays never exceed `max_bytes`.
+
+        Args:
+            colors : array of shape (N, 3) with [R, G, B] values
+            max_bytes : memory ceiling for temporary arrays
+
+        Returns:
+            int array of shape (N,) with palette indices
+        """
+        colors = np.asarray(colors).reshape(-1, 3)
+        if self.metric == "ciede2000":
+            return self._nearest_ciede2000(colors, max_bytes)
+
+        # |c - p|^2 = |c|^2 - 2 c.p + |p|^2, and |c|^2 does not change which
+        # palette color is closest. Exact for integer inputs in float64.
+        palette = self.rgb.astype(np.float64) if self.metric == "rgb" else self.lab
+        palette_sq = np.einsum("ij,ij->i", palette, palette)
+
+        # Each row of a chunk needs its float64 [R, G, B] values plus a float64
+        # distance for every palette color
+        chunk = max(1, int(max_bytes // ((len(palette) + 3) * 8)))
+
+        result = np.empty(len(colors), dtype=np.intp)
+        for start in range(0, len(colors), chunk):
+            block = colors[start:start + chunk].astype(np.float64)
+            if self.metric == "cie76":
+                block = rgb_to_lab(block)
+            dist = block @ (-2.0 * palette.T)
+            dist += palette_sq
+            result[start:start + chunk] = np.argmin(dist, axis=1)
+
+        return result
+
+    def _nearest_ciede2000(self, colors, max_bytes):
+        """
+        `nearest` using CIEDE2000, which has no shortcut: the full formula is
+        evaluated between every color of a chunk and every palette color.
+        """
+        chunk = max(1, int(max_bytes // (len(self) * 8 * DELTA_E_2000_TEMPORARIES)))
+        palette = self.lab[np.newaxis, :, :]
+
+        result = np.empty(len(colors), dtype=np.intp)
+        for start in range(0, len(colors), chunk):
+            block = rgb_to_lab(colors[start:start + chunk])
+            dist = delta_e_2000(block[:, np.newaxis, :], palette)
+            result[start:start + chunk] = np.argmin(dist, axis=1)
+
+        return result
+
+    def pack(self, colors):
+        """
+        Converts [R, G, B] values into flat lookup table indices.
+        """
+        colors = np.asarray(colors)
+        if colors.dtype != np.uint8:
+            colors = np.clip(np.rint(colors), 0, 255).astype(np.uint8)
+        colors = colors.reshape(-1, 3)
+
+        # Shift channels while they are still uint8, and pack in place
+        shift = 8 - self.bits
+        packed = (colors[:, 0] >> shift).astype(np.int32)
+        packed <<= self.bits
+        packed |= colors[:, 1] >> shift
+        packed <<= self.bits
+        packed |= colors[:, 2] >> shift
+        return packed
+
+    def lookup(self, colors):
+        """
+        Palette indices for an array of [R, G, B] values using the lookup table.
+        """
+        return self.lut[self.pack(colors)]
+
+    def name(self, color):
+        """
+        Human readable name of a single [R, G, B] color.
+        """
+        return self.names[self.lookup(color)[0]]
+
+
+def owned_privately(stat):
+    """
+    Whether a file, from its os.stat result, belongs to the current user and
+    can't be written by anyone else. Cached lookup tables that fail this are
+    rebuilt, since another user could have planted them to rename colors.
+    """
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+def load_palette(path, bits=6, metric="rgb", cache_dir=None):
+    """
+    Reads a color CSV file (Name, Hex, R, G, B, ...) into a Palette.
+
+    Args:
+        path : CSV file
+        bits : number of bits per channel used by the lookup table
+        metric : color difference, one of METRICS
+        cache_dir : if given, the lookup table is saved in this directory and
+            loaded from there next time, as long as the CSV file is unchanged
+            and the saved table is owned by the current user, see
+            owned_privately
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+
+    names = []
+    rgb = []
+    for row in csv.DictReader(content.decode("utf-8").splitlines()):
+        names.append(row["Name"])
+        rgb.append([int(row["R"]), int(row["G"]), int(row["B"])])
+
+    if cache_dir is None:
+        return Palette(names, rgb, bits=bits, metric=metric)
+
+    # Tables are keyed by the CSV contents and the table parameters
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    lut_path = os.path.join(cache_dir, "{}-{}-{}-{}.npy".format(
+        os.path.splitext(os.path.basename(path))[0], bits, metric, digest))
+    try:
+        with open(lut_path, "rb") as f:
+            if owned_privately(os.fstat(f.fileno())):
+                lut = np.load(f)
+                if lut.shape == (1 << (3 * bits),):
+                    return Palette(names, rgb, bits=bits, metric=metric, lut=lut)
+    except (OSError, ValueError):
+        pass
+
+    palette = Palette(names, rgb, bits=bits, metric=metric)
+    try:
+        # Write to a temporary file first, so other processes never load a
+        # partially written table
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, palette.lut)
+        os.replace(tmp_path, lut_path)
+    except OSError:
+        pass
+    return palette
+
+
+@lru_cache(maxsize=None)
+def get_palette(name="medium", bits=6, metric="rgb", cache_dir=None):
+    """
+    Returns the palette with the given name ("small", "medium" or "large").
+    Palettes are only built once per process, and once per `cache_dir` if
+    one is given (see `load_palette`).
+    """
+    if name not in PALETTE_FILES:
+        raise ValueError("Unknown color palette '{}', expected one of {}".format(
+            name, sorted(PALETTE_FILES)))
+
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+        PALETTE_FILES[name])
+    return load_palette(path, bits=bits, metric=metric, cache_dir=cache_dir)
@@ -0,0 +1,226 @@
+"""
+Server configuration, read from environment variables at startup.
+"""
+import os
+
+
+def env_str(name, default):
+    return os.environ.get(name, default)
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return default if value is None or value == "" else float(value)
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return default if value is None or value == "" else int(value)
+
+
+# Color palette used to name colors: "small", "medium" or "large"
+COLOR_PALETTE = env_str("COLOR_PALETTE", "medium")
+
+# Bits per channel of the RGB -> color name lookup table (1 to 8)
+COLOR_LUT_BITS = env_int("COLOR_LUT_BITS", 6)
+
+# How colors are matched to names: "rgb" (euclidean distance in RGB), "cie76"
+# (euclidean distance in CIELAB) or "ciede2000"
+COLOR_METRIC = env_str("COLOR_METRIC", "rgb")
+
+# Built lookup tables are saved here, so startup only builds them once.
+# Tables not owned by the user running the server, or writable by others,
+# are ignored. Empty disables the cache.
+COLOR_LUT_CACHE_DIR = env_str("COLOR_LUT_CACHE_DIR", os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "vizia", "palettes"))
+
+# Memory ceiling (bytes) for temporary arrays when matching pixels to colors
+COLOR_MATCH_MAX_BYTES = env_int("COLOR_MATCH_MAX_BYTES", 64 * 1024 * 1024)
+
+# Color endpoints decode JPEGs at 1/2, 1/4 or 1/8 resolution as long as the
+# image keeps at least this many pixels. 0 always decodes at full resolution.
+COLOR_DECODE_MIN_PIXELS = env_int("COLOR_DECODE_MIN_PIXELS", 262144)
+
+# Pixel budget for k-means in /detect_color. 0 clusters every pixel.
+COLOR_SAMPLE_PIXELS = env_int("COLOR_SAMPLE_PIXELS", 65536)
+
+# How pixels are sampled: "random" or "stratified"
+COLOR_SAMPLE_METHOD = env_str("COLOR_SAMPLE_METHOD", "stratified")
+
+# Downscale with INTER_AREA instead of picking pixels
+COLOR_SAMPLE_RESIZE = env_bool("COLOR_SAMPLE_RESIZE", False)
+
+# Rank colors by assigning every pixel of the full image to a cluster
+COLOR_EXACT_COUNTS = env_bool("COLOR_EXACT_COUNTS", False)
+
+# Continue k-means from the previous frame's colors of the same client (stream
+# or socket_emit_path) instead of restarting from random centers. Restarts
+# anyway when the previous colors fit the frame COLOR_KMEANS_RESTART_RATIO
+# times worse than they fit the previous frame, ie. the scene changed.
+COLOR_KMEANS_REUSE = env_bool("COLOR_KMEANS_REUSE", False)
+COLOR_KMEANS_RESTART_RATIO = env_float("COLOR_KMEANS_RESTART_RATIO", 2.0)
+
+# Number of clients whose previous k-means colors are kept
+COLOR_KMEANS_MAX_CLIENTS = env_int("COLOR_KMEANS_MAX_CLIENTS", 256)
+
+# ONNX model used by /classify_money
+MONEY_MODEL_PATH = env_str("MONEY_MODEL_PATH",
+    "money_classification/lucky-sweep-6_best_model.onnx")
+
+# Model precision: "fp32", "int8" or "fp16". Reduced precision variants are
+# built with money_classification/quantize.py next to MONEY_MODEL_PATH.
+MONEY_MODEL_VARIANT = env_str("MONEY_MODEL_VARIANT", "fp32")
+
+# onnxruntime session options. 0 threads lets onnxruntime decide.
+ORT_INTRA_OP_THREADS = env_int("ORT_INTRA_OP_THREADS", 0)
+ORT_INTER_OP_THREADS = env_int("ORT_INTER_OP_THREADS", 0)
+# "disable", "basic", "extended" or "all"
+ORT_GRAPH_OPTIMIZATION_LEVEL = env_str("ORT_GRAPH_OPTIMIZATION_LEVEL", "all")
+# "sequential" or "parallel"
+ORT_EXECUTION_MODE = env_str("ORT_EXECUTION_MODE", "sequential")
+ORT_ENABLE_CPU_MEM_ARENA = env_bool("ORT_ENABLE_CPU_MEM_ARENA", True)
+ORT_ENABLE_MEM_PATTERN = env_bool("ORT_ENABLE_MEM_PATTERN", True)
+
+# If set, the optimized model graph is cached next to this path for faster
+# startup, under a name fingerprinting the model file and optimization settings
+ORT_OPTIMIZED_MODEL_PATH = env_str("ORT_OPTIMIZED_MODEL_PATH", "")
+
+# Use weights as stored instead of repacking them for faster kernels. Weights
+# saved as external data are then memory-mapped and shared by all processes.
+ORT_DISABLE_PREPACKING = env_bool("ORT_DISABLE_PREPACKING", False)
+
+# Number of inferences run on startup before serving requests
+ORT_WARMUP_RUNS = env_int("ORT_WARMUP_RUNS", 1)
+
+# Where CPU-bound work (decoding, color detection, model inference) runs:
+# "thread" pool, "process" pool, or "none" to run it on the request itself
+WORKER_POOL = env_str("WORKER_POOL", "thread")
+
+# Number of workers, 0 uses one per CPU
+WORKER_POOL_SIZE = env_int("WORKER_POOL_SIZE", 0)
+
+# Load the color palette, ONNX model and Vision API client at startup (and in
+# every process worker) instead of on the first request that needs them.
+# Defaults to on when serving with "python app.py" or serve.py, and to off
+# when the app is imported, eg. by tests and benchmarks.
+PRELOAD = env_bool("PRELOAD", False)
+
+# Largest number of /classify_money images run through the model at once
+MONEY_MAX_BATCH_SIZE = env_int("MONEY_MAX_BATCH_SIZE", 8)
+
+# Longest time (milliseconds) an image waits for others to fill its batch
+MONEY_MAX_WAIT_MS = env_int("MONEY_MAX_WAIT_MS", 5)
+
+# Skip the money model for images without a bill, found from a downscaled
+# edge map, and classify images with one cropped to it. Images with fewer
+# than MONEY_PREFILTER_MIN_EDGES edge pixels (a fraction), or whose largest
+# textured region covers less than MONEY_PREFILTER_MIN_AREA of the image,
+# are classified as no bill.
+MONEY_PREFILTER = env_bool("MONEY_PREFILTER", False)
+MONEY_PREFILTER_MIN_EDGES = env_float("MONEY_PREFILTER_MIN_EDGES", 0.01)
+MONEY_PREFILTER_MIN_AREA = env_float("MONEY_PREFILTER_MIN_AREA", 0.03)
+
+# Google Cloud Vision images:annotate URL, eg. pointed at ocr/fake_vision.py
+VISION_ENDPOINT = env_str("VISION_ENDPOINT",
+    "https://vision.googleapis.com/v1/images:annotate")
+
+# Connections to the Vision API kept open for reuse
+VISION_POOL_SIZE = env_int("VISION_POOL_SIZE", 10)
+
+# Seconds to wait for a connection to open and for the API to respond
+VISION_CONNECT_TIMEOUT = env_float("VISION_CONNECT_TIMEOUT", 3.05)
+VISION_READ_TIMEOUT = env_float("VISION_READ_TIMEOUT", 30.0)
+
+# Retries on connection errors, timeouts, 429 and 5xx, with exponential
+# backoff starting at VISION_BACKOFF seconds
+VISION_MAX_RETRIES = env_int("VISION_MAX_RETRIES", 3)
+VISION_BACKOFF = env_float("VISION_BACKOFF", 0.5)
+
+# OCR backend used by the OCR routes when a request does not pick one with
+# its "backend" parameter: "google" (Vision API) or "local" (ONNX models)
+OCR_BACKEND = env_str("OCR_BACKEND", "google")
+
+# Backend answering instead when the selected one times out, is unreachable,
+# fails on its side or is not configured, or empty for none. The Vision API
+# gets OCR_FALLBACK_TIMEOUT seconds in total, retries included, before the
+# fallback takes over.
+OCR_FALLBACK = env_str("OCR_FALLBACK", "")
+OCR_FALLBACK_TIMEOUT = env_float("OCR_FALLBACK_TIMEOUT", 5.0)
+
+# Local OCR models: a PP-OCR style text detection model, a text recognition
+# model, its character dictionary (one character per line) and its language.
+# The local backend is available when all three paths are set.
+OCR_LOCAL_DET_MODEL_PATH = env_str("OCR_LOCAL_DET_MODEL_PATH", "")
+OCR_LOCAL_REC_MODEL_PATH = env_str("OCR_LOCAL_REC_MODEL_PATH", "")
+OCR_LOCAL_CHARSET_PATH = env_str("OCR_LOCAL_CHARSET_PATH", "")
+OCR_LOCAL_LANGUAGE = env_str("OCR_LOCAL_LANGUAGE", "en")
+
+# Shrink OCR images before they are read by an OCR backend: decode them
+# upright, downscale their longest side to OCR_TEXT_MAX_SIZE pixels for
+# TEXT_DETECTION or OCR_DOCUMENT_MAX_SIZE for DOCUMENT_TEXT_DETECTION (the
+# Vision API's recommended sizes, 0 keeps the size), optionally convert them
+# to grayscale, and re-encode them at OCR_JPEG_QUALITY. Images that would
+# not get smaller are sent as received.
+OCR_PREPARE = env_bool("OCR_PREPARE", True)
+OCR_TEXT_MAX_SIZE = env_int("OCR_TEXT_MAX_SIZE", 1024)
+OCR_DOCUMENT_MAX_SIZE = env_int("OCR_DOCUMENT_MAX_SIZE", 1600)
+OCR_GRAYSCALE = env_bool("OCR_GRAYSCALE", False)
+OCR_JPEG_QUALITY = env_int("OCR_JPEG_QUALITY", 85)
+
+# Result cache for repeated frames: "memory", "disk" or "none"
+CACHE_BACKEND = env_str("CACHE_BACKEND", "memory")
+
+# Seconds a cached result stays valid
+CACHE_TTL = env_float("CACHE_TTL", 300.0)
+
+# Bounds on the number of cached results and their total size in bytes
+CACHE_MAX_ENTRIES = env_int("CACHE_MAX_ENTRIES", 1024)
+CACHE_MAX_BYTES = env_int("CACHE_MAX_BYTES", 16 * 1024 * 1024)
+
+# SQLite file of the "disk" backend, shared by every worker using it
+CACHE_PATH = env_str("CACHE_PATH", "/tmp/vizia_cache.sqlite3")
+
+# Key images by perceptual hash, so visually identical re-captures also hit.
+# Hashes have CACHE_HASH_SIZE * CACHE_HASH_SIZE bits.
+CACHE_PERCEPTUAL = env_bool("CACHE_PERCEPTUAL", False)
+CACHE_HASH_SIZE = env_int("CACHE_HASH_SIZE", 16)
+
+# Largest number of images accepted by one request to a batch endpoint
+BATCH_MAX_IMAGES = env_int("BATCH_MAX_IMAGES", 32)
+
+# Largest request body, in bytes, accepted by the single image routes and by
+# the batch routes. Larger requests get a 413 before their body is read.
+MAX_IMAGE_BYTES = env_int("MAX_IMAGE_BYTES", 16 * 1024 * 1024)
+MAX_BATCH_BYTES = env_int("MAX_BATCH_BYTES", 64 * 1024 * 1024)
+
+# Largest number of images sent to the Vision API in one call (API limit: 16)
+VISION_MAX_BATCH_SIZE = env_int("VISION_MAX_BATCH_SIZE", 16)
+
+# Frames a Socket.IO stream keeps waiting while the previous one is processed.
+# Older frames are dropped when more arrive, 1 only keeps the latest frame.
+STREAM_MAX_PENDING = env_int("STREAM_MAX_PENDING", 1)
+
+# Message queue sharing Socket.IO events between server processes:
+# "local://<socket path>" for the broker started by serve.py, a redis://,
+# kafka:// or amqp:// URL, or empty for a single process
+SOCKETIO_MESSAGE_QUEUE = env_str("SOCKETIO_MESSAGE_QUEUE", "")
+
+# Opt-in cProfile profiling of requests. When enabled, requests with a
+# "profile=1" query parameter or an "X-Profile: 1" header are profiled, as
+# well as a random PROFILING_SAMPLE_RATE fraction (0 to 1) of all requests.
+PROFILING_ENABLED = env_bool("PROFILING_ENABLED", False)
+PROFILING_SAMPLE_RATE = env_float("PROFILING_SAMPLE_RATE", 0.0)
+
+# Number of most recent profiles kept in memory
+PROFILING_MAX_PROFILES = env_int("PROFILING_MAX_PROFILES", 100)
+
+# Value /admin/profiles requires in an "X-Admin-Token" header. The profiles
+# can't be read while it is empty.
+PROFILING_ADMIN_TOKEN = env_str("PROFILING_ADMIN_TOKEN", "")
@@ -0,0 +1,254 @@
+import struct
+import threading
+import cv2
+import numpy as np
+
+
+# OpenCV flags that decode a JPEG directly at 1/2, 1/4 or 1/8 of its size by
+# skipping DCT coefficients, largest reduction first
+REDUCED_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+REDUCED_GRAYSCALE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+]
+
+# JPEG start of frame markers, which hold the image dimensions
+# (0xC4, 0xC8 and 0xCC are other segments sharing the same range)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Leading bytes of the image files accepted as is where base64 encoded images
+# are also accepted. Base64 text can never start with them.
+IMAGE_SIGNATURES = {
+    "jpeg": b"\xff\xd8\xff",
+    "png": b"\x89PNG\r\n\x1a\n",
+}
+
+
+def image_format(data):
+    """
+    "jpeg" or "png" if data is a JPEG or PNG file, judging from its first
+    bytes, otherwise None.
+    """
+    for name, signature in IMAGE_SIGNATURES.items():
+        if bytes(data[:len(signature)]) == signature:
+            return name
+    return None
+
+
+def jpeg_size(data):
+    """
+    Reads the (width, height) of a JPEG image from its header without
+    decoding it. Returns None if data is not a JPEG or the header is invalid.
+    """
+    data = memoryview(data)
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+
+        # Padding bytes and standalone markers have no length field
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+
+        length = (data[pos + 2] << 8) | data[pos + 3]
+        if marker in SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height = (data[pos + 5] << 8) | data[pos + 6]
+            width = (data[pos + 7] << 8) | data[pos + 8]
+            return width, height
+
+        # Start of scan, image data follows and no frame header was found
+        if marker == 0xDA:
+            return None
+        pos += 2 + length
+
+    return None
+
+
+def reduction_factor(size, min_size=None, min_pixels=None):
+    """
+    Largest JPEG decode reduction (1, 2, 4 or 8) that keeps the image at least
+    `min_size` (width, height) and at least `min_pixels` pixels.
+    """
+    width, height = size
+    for factor, _ in REDUCED_FLAGS:
+        # libjpeg rounds scaled dimensions up
+        w = -(-width // factor)
+        h = -(-height // factor)
+        if min_size is not None and (w < min_size[0] or h < min_size[1]):
+            continue
+        if min_pixels is not None and w * h < min_pixels:
+            continue
+        return factor
+    return 1
+
+
+def decode_image(data, min_size=None, min_pixels=None):
+    """
+    Decodes jpg/png encoded image data into an RGB numpy array.
+
+    JPEG images are decoded at a reduced resolution when they are larger than
+    needed, so the full resolution image is never materialized.
+
+    Args:
+        data : bytes-like object containing encoded image data
+        min_size : (width, height) the decoded image must at least have
+        min_pixels : number of pixels the decoded image must at least have
+
+    Returns:
+        np array containing raw image data in RGB format, or None if the data
+        could not be decoded
+    """
+    # imdecode raises on empty buffers
+    if len(data) == 0:
+        return None
+
+    # Convert string of image data to uint8
+    np_arr = np.frombuffer(data, np.uint8)
+
+    flag = cv2.IMREAD_COLOR
+    size = jpeg_size(data) if min_size is not None or min_pixels is not None else None
+    if size is not None:
+        factor = reduction_factor(size, min_size, min_pixels)
+        flag = dict(REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+
+    # Decode image
+    try:
+        img = cv2.imdecode(np_arr, flag)
+    except cv2.error:
+        return None
+    if img is None:
+        return None
+
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def prepare_ocr_image(data, max_size=None, grayscale=False, quality=85):
+    """
+    Shrinks an image before it is sent for OCR: decodes it upright (OpenCV
+    applies the EXIF orientation), downscales it so that its longest side is
+    at most max_size, optionally drops its color, and encodes it as a JPEG.
+    Large JPEG images are decoded directly at a reduced resolution.
+
+    Args:
+        data : bytes-like object containing encoded image data
+        max_size : longest side of the result in pixels, None keeps the size
+        grayscale : encode a grayscale image
+        quality : JPEG quality, from 0 to 100
+
+    Returns:
+        JPEG encoded bytes, or None if the data could not be decoded
+    """
+    # imdecode raises on empty buffers
+    if len(data) == 0:
+        return None
+
+    flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    size = jpeg_size(data) if max_size else None
+    if size is not None:
+        for factor, reduced in (REDUCED_GRAYSCALE_FLAGS if grayscale else REDUCED_FLAGS):
+            # libjpeg rounds scaled dimensions up
+            if -(-max(size) // factor) >= max_size:
+                flag = reduced
+                break
+
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if img is None:
+        return None
+
+    height, width = img.shape[:2]
+    if max_size and max(height, width) > max_size:
+        scale = max_size / max(height, width)
+        img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA)
+
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes() if ok else None
+
+
+def pack_images(images):
+    """
+    Packs several encoded images into one length-prefixed body: each image is
+    preceded by its size as a 4 byte big-endian unsigned integer.
+    """
+    return b"".join(struct.pack(">I", len(data)) + bytes(data) for data in images)
+
+
+def unpack_images(body):
+    """
+    Splits a body created by `pack_images` back into a list of images, as
+    memoryviews of body rather than copies.
+
+    Raises:
+        ValueError : if the body is truncated
+    """
+    body = memoryview(body)
+    images = []
+    pos = 0
+    while pos < len(body):
+        if pos + 4 > len(body):
+            raise ValueError("Truncated image length at byte {}".format(pos))
+        (length,) = struct.unpack_from(">I", body, pos)
+        pos += 4
+        if pos + length > len(body):
+            raise ValueError("Truncated image at byte {}".format(pos))
+        images.append(body[pos:pos + length])
+        pos += length
+    return images
+
+
+class BufferPool:
+    """
+    Reusable buffers to read request bodies into, so that every upload does
+    not allocate (and page fault) a new multi-megabyte buffer.
+
+    Args:
+        max_buffers : number of idle buffers kept
+        max_buffer_bytes : larger buffers are not kept once released
+    """
+
+    def __init__(self, max_buffers=8, max_buffer_bytes=None):
+        self.max_buffers = max_buffers
+        self.max_buffer_bytes = max_buffer_bytes
+        self._buffers = []
+        self._lock = threading.Lock()
+
+    def acquire(self, size):
+        """
+        Takes an idle buffer of at least size bytes from the pool, or
+        allocates one. It must not be used after being released.
+        """
+        with self._lock:
+            for i, buffer in enumerate(self._buffers):
+                if len(buffer) >= size:
+                    return self._buffers.pop(i)
+        return bytearray(size)
+
+    def release(self, buffer):
+        """
+        Returns a buffer from `acquire` to the pool.
+        """
+        if self.max_buffer_bytes is not None and len(buffer) > self.max_buffer_bytes:
+            return
+        with self._lock:
+            if len(self._buffers) < self.max_buffers:
+                self._buffers.append(buffer)
+            else:
+                # Keep the largest buffers, they fit the most requests
+                smallest = min(range(len(self._buffers)), key=lambda i: len(self._buffers[i]))
+                if len(buffer) > len(self._buffers[smallest]):
+                    self._buffers[smallest] = buffer
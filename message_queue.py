@@ -0,0 +1,259 @@
+"""
+Local message queue carrying Socket.IO events between server processes, so
+that an event emitted by one process reaches clients connected to another.
+
+`Broker` runs in its own process and relays every message it receives to
+every subscribed server process over a Unix domain socket.
+`BrokerManager` is the Socket.IO client manager that publishes to and
+listens on it, selected with SOCKETIO_MESSAGE_QUEUE=local://<socket path>.
+"""
+import os
+import pickle
+import selectors
+import socket
+import struct
+import threading
+
+import socketio
+
+
+# Role a process announces with the first byte it sends to the broker
+PUBLISH = b"P"
+SUBSCRIBE = b"S"
+
+# Bytes queued for a subscriber that does not read its messages before the
+# broker drops it
+MAX_OUTBOX_BYTES = 16 * 1024 * 1024
+
+_LENGTH = struct.Struct(">I")
+
+
+def frame(payload):
+    """
+    Length-prefixes a message.
+    """
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def split_frames(buffer):
+    """
+    Removes the complete messages from the start of a bytearray and returns
+    them, leaving any partial message in the buffer.
+    """
+    payloads = []
+    start = 0
+    while len(buffer) - start >= _LENGTH.size:
+        (length,) = _LENGTH.unpack_from(buffer, start)
+        end = start + _LENGTH.size + length
+        if len(buffer) < end:
+            break
+        payloads.append(bytes(buffer[start + _LENGTH.size:end]))
+        start = end
+    del buffer[:start]
+    return payloads
+
+
+class _Connection:
+    """
+    State the broker keeps for a connected process.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.role = None
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+        self.closed = False
+
+
+class Broker:
+    """
+    Relays messages from publishers to every subscriber. The socket is only
+    accessible to the user running the server, since messages are pickled.
+    Sockets are non-blocking and each subscriber has its own outbox, so a
+    subscriber that reads slowly never holds up the others.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._selector = selectors.DefaultSelector()
+        self._subscribers = set()
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        listener.listen()
+        self._selector.register(listener, selectors.EVENT_READ)
+
+        while True:
+            for key, events in self._selector.select():
+                if key.fileobj is listener:
+                    sock, _ = listener.accept()
+                    sock.setblocking(False)
+                    self._selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+                    continue
+                conn = key.data
+                if events & selectors.EVENT_WRITE:
+                    self._write(conn)
+                if events & selectors.EVENT_READ and not conn.closed:
+                    self._read(conn)
+
+    def _read(self, conn):
+        try:
+            chunk = conn.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self._drop(conn)
+            return
+
+        conn.inbox += chunk
+        if conn.role is None:
+            conn.role = bytes(conn.inbox[:1])
+            del conn.inbox[:1]
+            if conn.role == SUBSCRIBE:
+                self._subscribers.add(conn)
+        if conn.role != PUBLISH:
+            # Subscribers only send their role
+            conn.inbox.clear()
+            return
+
+        for payload in split_frames(conn.inbox):
+            message = frame(payload)
+            for subscriber in list(self._subscribers):
+                self._send(subscriber, message)
+
+    def _send(self, conn, message):
+        """
+        Queues a message for a subscriber, dropping subscribers that fall too
+        far behind.
+        """
+        if len(conn.outbox) + len(message) > MAX_OUTBOX_BYTES:
+            self._drop(conn)
+            return
+        waiting = bool(conn.outbox)
+        conn.outbox += message
+        if not waiting:
+            self._write(conn)
+
+    def _write(self, conn):
+        """
+        Sends as much of a subscriber's outbox as its socket takes, and
+        waits for the socket to be writable again if some is left.
+        """
+        try:
+            sent = conn.sock.send(conn.outbox)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._drop(conn)
+            return
+        del conn.outbox[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbox else 0)
+        if self._selector.get_key(conn.sock).events != events:
+            self._selector.modify(conn.sock, events, conn)
+
+    def _drop(self, conn):
+        if conn.closed:
+            return
+        conn.closed = True
+        self._subscribers.discard(conn)
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+
+
+class BrokerManager(socketio.PubSubManager):
+    """
+    Socket.IO client manager sharing events through a `Broker`.
+
+    Args:
+        url : "local://" followed by the path of the broker's socket
+        channel : messages on other channels of the same broker are ignored
+    """
+    name = "local"
+
+    def __init__(self, url, channel="flask-socketio", write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = url[len("local://"):]
+        self._outbox = None
+        self._outbox_lock = threading.Lock()
+
+    def _connect(self, role):
+        # Sockets have to cooperate with the server's async mode
+        if self.server is not None and self.server.async_mode == "eventlet":
+            from eventlet.green import socket as socket_module
+        else:
+            socket_module = socket
+        sock = socket_module.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(role)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _publish(self, data):
+        # Messages are sent by a background task, so emitting never waits on
+        # the broker
+        if self._outbox is None:
+            with self._outbox_lock:
+                if self._outbox is None:
+                    self._outbox = self.server.eio.create_queue()
+                    self.server.start_background_task(self._send_forever)
+        self._outbox.put(frame(pickle.dumps((self.channel, data))))
+
+    def _send_forever(self):
+        sock = None
+        while True:
+            message = self._outbox.get()
+            for attempt in range(2):
+                try:
+                    if sock is None:
+                        sock = self._connect(PUBLISH)
+                    sock.sendall(message)
+                    break
+                except OSError:
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+                    if attempt == 1:
+                        self._get_logger().exception(
+                            "Could not publish to the message broker at %s", self.path)
+
+    def _listen(self):
+        retry = 1
+        while True:
+            try:
+                sock = self._connect(SUBSCRIBE)
+            except OSError:
+                self._get_logger().error(
+                    "Cannot reach the message broker at %s, retrying in %d s",
+                    self.path, retry)
+                self.server.sleep(retry)
+                retry = min(retry * 2, 60)
+                continue
+
+            retry = 1
+            buffer = bytearray()
+            try:
+                while True:
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    buffer += chunk
+                    for payload in split_frames(buffer):
+                        channel, message = pickle.loads(payload)
+                        if channel == self.channel:
+                            yield message
+            except OSError:
+                pass
+            finally:
+                sock.close()
+            self._get_logger().error("Lost the connection to the message broker at %s",
+                self.path)
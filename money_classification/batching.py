@@ -0,0 +1,170 @@
+import collections
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future
+
+from money_classification.model_inference import IMG_SIZE, preprocess_img
+
+
+def batch_size_limit(batch_dim, max_batch_size):
+    """
+    Caps max_batch_size to the model's batch dimension if the model has a
+    fixed one (batch_dim is an int rather than a symbolic name).
+    """
+    if isinstance(batch_dim, int) and batch_dim > 0:
+        return min(max_batch_size, batch_dim)
+    return max_batch_size
+
+
+class BatchScheduler:
+    """
+    Groups concurrent money classification requests into batches so the ONNX
+    session runs one (B, 3, H, W) forward pass instead of B passes of one image.
+
+    A background thread waits for the first queued image, then keeps
+    collecting images until either `max_batch_size` images are queued or
+    `max_wait_ms` milliseconds have passed, preprocesses them into one
+    tensor and runs them as one batch. Requests only queue their image, so
+    the resize and normalization never run on an event loop. The thread
+    starts with the first image, so a scheduler created before the process
+    forks runs in the child.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0, history=1000):
+        """
+        Args:
+            run_batch : function taking a preprocessed (B, 3, H, W) batch and
+                returning B class names, eg. functools.partial(predict, session)
+            max_batch_size : largest number of images run in one batch
+            max_wait_ms : longest time the first image of a batch waits for
+                more images to arrive
+            history : number of recent requests kept for latency percentiles
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+
+        # Batches are assembled in one preallocated tensor
+        self._batch = np.empty((self.max_batch_size, 3, IMG_SIZE[1], IMG_SIZE[0]),
+            dtype=np.float32)
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._latencies = collections.deque(maxlen=history)
+        self._requests = 0
+        self._queue_seconds = 0.0
+        self._preprocess_seconds = 0.0
+        self._inference_seconds = 0.0
+        self._started = time.monotonic()
+        self._thread = None
+
+    def submit(self, img):
+        """
+        Queues an RGB image for classification. The image must not change
+        until the future is done.
+
+        Returns:
+            concurrent.futures.Future resolving to the predicted class name
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._start_thread()
+        future = Future()
+        self._queue.put((img, future, time.monotonic()))
+        return future
+
+    def _start_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="money-batcher",
+                    daemon=True)
+                self._thread.start()
+
+    def classify(self, img):
+        """
+        Classifies an RGB image, blocking until its batch has run.
+        """
+        return self.submit(img).result()
+
+    def _collect(self):
+        """
+        Blocks for the first queued item, then gathers more until the batch is
+        full or the wait time is up.
+        """
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.monotonic()
+
+            # An image that fails to preprocess only fails its own request
+            ready = []
+            for img, future, queued in batch:
+                try:
+                    preprocess_img(img, out=self._batch[len(ready)])
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                ready.append((future, queued))
+            if not ready:
+                continue
+
+            preprocessed = time.monotonic()
+            try:
+                predictions = self.run_batch(self._batch[:len(ready)])
+            except Exception as e:
+                for future, _ in ready:
+                    future.set_exception(e)
+                continue
+            end = time.monotonic()
+
+            for (future, _), prediction in zip(ready, predictions):
+                future.set_result(prediction)
+
+            with self._lock:
+                self._requests += len(ready)
+                self._batch_sizes[len(ready)] += 1
+                self._preprocess_seconds += preprocessed - start
+                self._inference_seconds += end - preprocessed
+                for _, queued in ready:
+                    self._queue_seconds += start - queued
+                    self._latencies.append(end - queued)
+
+    def stats(self):
+        """
+        Throughput and latency metrics since the scheduler started.
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            batches = sum(self._batch_sizes.values())
+            elapsed = time.monotonic() - self._started
+            return {
+                "requests": self._requests,
+                "batches": batches,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "mean_batch_size": self._requests / batches if batches else 0.0,
+                "throughput_per_second": self._requests / elapsed if elapsed else 0.0,
+                "mean_queue_ms": 1000 * self._queue_seconds / self._requests
+                    if self._requests else 0.0,
+                "mean_preprocess_ms": 1000 * self._preprocess_seconds / batches
+                    if batches else 0.0,
+                "mean_inference_ms": 1000 * self._inference_seconds / batches
+                    if batches else 0.0,
+                "latency_p50_ms": 1000 * float(np.percentile(latencies, 50))
+                    if len(latencies) else 0.0,
+                "latency_p95_ms": 1000 * float(np.percentile(latencies, 95))
+                    if len(latencies) else 0.0,
+            }
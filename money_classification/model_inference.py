@@ -1,3 +1,4 @@
+import threading
 import numpy as np
 import cv2
 
@@ -8,34 +9,68 @@ MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
 STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
 
 
-def preprocess_img(img):
+# (x / 255 - MEAN) / STD folded into a single multiply-add per channel
+SCALE = (1.0 / (255.0 * STD)).astype(np.float32)
+OFFSET = (-MEAN / STD).astype(np.float32)
+
+# Per-thread scratch buffers reused across calls
+_buffers = threading.local()
+
+
+def _thread_buffer(name, shape, dtype):
+    """
+    Returns a buffer owned by the calling thread, allocated on first use.
+    """
+    buf = getattr(_buffers, name, None)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = np.empty(shape, dtype=dtype)
+        setattr(_buffers, name, buf)
+    return buf
+
+
+def preprocess_img(img, out=None):
     """
     Prepares numpy image for model inference. Needs to transform the tensor to
     the required dimensions (1, 3, H, W), normalize, and convert to float32.
+
+    The result is written into `out` if given, which must be a C-contiguous
+    float32 array of shape (1, 3, H, W) or (3, H, W), eg. one slot of a larger
+    batch tensor. Otherwise a new array is allocated.
     """
-    # Downsize to required model size
-    img = cv2.resize(img, IMG_SIZE, interpolation=cv2.INTER_AREA)
+    shape = (1, 3, IMG_SIZE[1], IMG_SIZE[0])
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    planes = out.reshape(shape[1:])
 
-    # Need to normalize using given MEAN and STD and move channel dim to match torch convention
-    img = img.astype(np.float32) / 255.0
-    img = np.transpose(img, (2, 0, 1))
-    img = (img - MEAN[:, np.newaxis, np.newaxis]) / STD[:, np.newaxis, np.newaxis]
+    # Downsize to required model size, reusing this thread's resize buffer
+    resized = _thread_buffer("resized", (IMG_SIZE[1], IMG_SIZE[0], 3), np.uint8)
+    cv2.resize(img, IMG_SIZE, dst=resized, interpolation=cv2.INTER_AREA)
 
-    # Add batch dim
-    img = img[np.newaxis, :]
+    # Normalize using given MEAN and STD while moving channel dim to match
+    # torch convention, writing each channel straight into its output plane
+    for c in range(3):
+        np.multiply(resized[:, :, c], SCALE[c], out=planes[c], dtype=np.float32)
+        planes[c] += OFFSET[c]
 
-    return img
+    return out
 
-def run_inference(session, img):
+
+def predict(session, batch):
     """
-    Runs inference using given onnx session then converts result to class name using class map.
+    Runs inference on a preprocessed (B, 3, H, W) batch using given onnx session
+    and converts each result to a class name using class map.
     """
-    # Prep image and then run inference using onnx session
-    img = preprocess_img(img)
-    output = session.run(None, {'input': img})[0]
+    output = session.run(None, {'input': batch})[0]
+
+    # Get actual class predictions using class map
+    return [CLASS_MAP[pred] for pred in output.argmax(1)]
 
-    # Get actual class prediction using clas map
-    pred = output.argmax(1)[0]
-    class_pred = CLASS_MAP[pred]
 
-    return class_pred
+def run_inference(session, img):
+    """
+    Runs inference using given onnx session then converts result to class name using class map.
+    """
+    # Prep image into this thread's reusable input buffer and then run inference using onnx session
+    buf = _thread_buffer("input", (1, 3, IMG_SIZE[1], IMG_SIZE[0]), np.float32)
+    img = preprocess_img(img, out=buf)
+    return predict(session, img)[0]
@@ -0,0 +1,125 @@
+import threading
+import cv2
+import numpy as np
+
+
+# Longest side of the grayscale thumbnail the pre-filter looks at
+THUMBNAIL_SIZE = 256
+
+# Canny thresholds, high enough that walls, floors and skin give few edges
+# while the fine print of a bill gives many
+CANNY_LOW = 100
+CANNY_HIGH = 200
+
+# Closing merges the print of a bill into one region, opening drops specks
+CLOSE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
+OPEN_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+
+# Long to short side ratios of a bill-shaped region. Bills are 2.35:1, the
+# hand holding one and perspective make the region squarer.
+MIN_ASPECT = 1.2
+MAX_ASPECT = 4.0
+
+# Regions covering more of the frame than this are classified uncropped
+MAX_CROP_AREA = 0.6
+
+# Margin kept around a region when cropping, relative to its size
+CROP_MARGIN = 0.1
+
+
+def find_bill(img, min_edges=0.01, min_area=0.03):
+    """
+    Looks for a bill in an RGB image using a downscaled edge map: the print
+    of a bill is dense in edges, plain backgrounds are not.
+
+    Args:
+        img : RGB image
+        min_edges : fraction of edge pixels below which the image is taken
+            to hold no bill
+        min_area : fraction of the image the largest textured region must
+            cover to be taken as a bill
+
+    Returns:
+        None if the image holds no bill, otherwise the (x, y, w, h) region
+        of img to classify: the bill with a margin, or the whole image if
+        the bill fills most of it or is not bill-shaped
+    """
+    height, width = img.shape[:2]
+    scale = THUMBNAIL_SIZE / max(height, width)
+    thumbnail = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+        interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(thumbnail, cv2.COLOR_RGB2GRAY)
+
+    edges = cv2.Canny(gray, CANNY_LOW, CANNY_HIGH)
+    if np.count_nonzero(edges) < min_edges * edges.size:
+        return None
+
+    mask = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, CLOSE_KERNEL)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, OPEN_KERNEL)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    region = max(contours, key=cv2.contourArea)
+    _, (w, h), _ = cv2.minAreaRect(region)
+    if w * h < min_area * edges.size:
+        return None
+
+    whole = (0, 0, width, height)
+    aspect = max(w, h) / max(1.0, min(w, h))
+    if w * h > MAX_CROP_AREA * edges.size or not MIN_ASPECT <= aspect <= MAX_ASPECT:
+        return whole
+
+    # Bounding box in the full image, with a margin
+    x, y, w, h = cv2.boundingRect(region)
+    margin_x = CROP_MARGIN * w
+    margin_y = CROP_MARGIN * h
+    x0 = max(0, int((x - margin_x) / scale))
+    y0 = max(0, int((y - margin_y) / scale))
+    x1 = min(width, int(np.ceil((x + w + margin_x) / scale)))
+    y1 = min(height, int(np.ceil((y + h + margin_y) / scale)))
+    return x0, y0, x1 - x0, y1 - y0
+
+
+class MoneyPrefilter:
+    """
+    Runs `find_bill` ahead of money classification, so that images without
+    a bill skip the model and images with one are classified cropped to it.
+    Counts the images it saw, skipped and cropped.
+    """
+
+    def __init__(self, min_edges=0.01, min_area=0.03):
+        """
+        Args:
+            min_edges, min_area : thresholds of `find_bill`
+        """
+        self.min_edges = min_edges
+        self.min_area = min_area
+        self._lock = threading.Lock()
+        self._images = 0
+        self._skipped = 0
+        self._cropped = 0
+
+    def crop(self, img, region):
+        """
+        Counts img and returns None if region is None, otherwise the part of
+        img to classify, a view of it. Region comes from `find_bill` with the
+        pre-filter's thresholds, run on a worker so that the edge map is not
+        computed on the event loop.
+        """
+        cropped = region is not None and region != (0, 0, img.shape[1], img.shape[0])
+        with self._lock:
+            self._images += 1
+            self._skipped += region is None
+            self._cropped += cropped
+        if region is None:
+            return None
+        x, y, w, h = region
+        return img[y:y + h, x:x + w]
+
+    def stats(self):
+        """
+        Images seen, skipped as holding no bill, and cropped to a bill.
+        """
+        with self._lock:
+            return {"images": self._images, "skipped": self._skipped,
+                "cropped": self._cropped}
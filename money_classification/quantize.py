@@ -0,0 +1,152 @@
+"""
+Builds reduced precision variants of the money classification model.
+
+    python -m money_classification.quantize --variant int8 \
+        --calibration-dir calibration_images/money
+
+Calibration images should be bill photos kept apart from
+test_images/money_classification, which benchmarks/money_variants.py
+evaluates the variants on. Calibrating on the evaluation images would make
+the int8 accuracy look better than it is.
+
+int8 variants are written next to the model as <model>.int8.onnx and fp16
+variants as <model>.fp16.onnx, which is where the server looks for them when
+MONEY_MODEL_VARIANT is set.
+
+Building variants requires the onnx package (and onnxconverter-common for
+fp16), which are not in requirements.txt since the server only loads the
+built models.
+"""
+import argparse
+import glob
+import os
+import tempfile
+
+from image_utils import decode_image
+from money_classification.model_inference import IMG_SIZE, preprocess_img
+
+
+VARIANTS = ["fp32", "int8", "fp16"]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def variant_path(model_path, variant):
+    """
+    Path of a model variant, eg. model.onnx -> model.int8.onnx
+    """
+    if variant not in VARIANTS:
+        raise ValueError("Unknown model variant '{}', expected one of {}".format(
+            variant, VARIANTS))
+    if variant == "fp32":
+        return model_path
+
+    root, ext = os.path.splitext(model_path)
+    return "{}.{}{}".format(root, variant, ext)
+
+
+def list_images(folder):
+    """
+    All images in a folder and its subfolders, in sorted order.
+    """
+    files = glob.glob(os.path.join(folder, "**", "*"), recursive=True)
+    return sorted(f for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def load_image(filename):
+    """
+    Decodes an image the same way /classify_money does.
+    """
+    with open(filename, "rb") as f:
+        return decode_image(f.read(), min_size=IMG_SIZE)
+
+
+def quantize_int8(model_path, output_path, calibration_dir=None, per_channel=True):
+    """
+    INT8 quantization. With calibration images, activations are quantized
+    statically in QDQ format using ranges observed on those images. Without,
+    weights are quantized ahead of time and activations dynamically at runtime.
+    """
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat,
+        QuantType, quantize_dynamic, quantize_static)
+
+    if calibration_dir is None:
+        quantize_dynamic(model_path, output_path, weight_type=QuantType.QInt8,
+            per_channel=per_channel)
+        return
+
+    images = list_images(calibration_dir)
+    if not images:
+        raise ValueError("No calibration images found in {}".format(calibration_dir))
+
+    class ImageReader(CalibrationDataReader):
+        def __init__(self):
+            self._images = iter(images)
+
+        def get_next(self):
+            filename = next(self._images, None)
+            if filename is None:
+                return None
+            return {"input": preprocess_img(load_image(filename))}
+
+    # Shape inference and graph cleanup give better static quantization,
+    # when the installed onnxruntime provides it
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError:
+        quant_pre_process = None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if quant_pre_process is not None:
+            prepared = os.path.join(tmp, "prepared.onnx")
+            quant_pre_process(model_path, prepared, skip_symbolic_shape=True)
+            model_path = prepared
+
+        quantize_static(model_path, output_path, ImageReader(),
+            quant_format=QuantFormat.QDQ, activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8, per_channel=per_channel)
+
+
+def convert_fp16(model_path, output_path):
+    """
+    Converts weights and activations to float16, keeping float32 inputs and
+    outputs so callers are unchanged. Requires onnxconverter-common.
+    """
+    import onnx
+    try:
+        from onnxconverter_common import float16
+    except ImportError:
+        raise ImportError("fp16 conversion requires onnxconverter-common, "
+            "install it with: pip install onnxconverter-common")
+
+    model = onnx.load(model_path)
+    model = float16.convert_float_to_float16(model, keep_io_types=True)
+    onnx.save(model, output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="money_classification/lucky-sweep-6_best_model.onnx")
+    parser.add_argument("--variant", choices=["int8", "fp16"], required=True)
+    parser.add_argument("--output", help="defaults to the path the server loads")
+    parser.add_argument("--calibration-dir",
+        help="images used to calibrate static int8 quantization, apart from "
+            "the images the variants are evaluated on. Without it, int8 uses "
+            "dynamic quantization.")
+    parser.add_argument("--per-tensor", action="store_true",
+        help="quantize weights per tensor instead of per channel")
+    args = parser.parse_args()
+
+    output = args.output or variant_path(args.model, args.variant)
+    if args.variant == "int8":
+        quantize_int8(args.model, output, args.calibration_dir,
+            per_channel=not args.per_tensor)
+    else:
+        convert_fp16(args.model, output)
+
+    print("Wrote {} ({:.1f} MB -> {:.1f} MB)".format(output,
+        os.path.getsize(args.model) / 1e6, os.path.getsize(output) / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+
+# Names of the onnxruntime GraphOptimizationLevel and ExecutionMode values.
+# onnxruntime itself is imported when the first session is created, so that
+# processes which never run the model don't pay for loading it.
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+EXECUTION_MODES = {
+    "sequential": "ORT_SEQUENTIAL",
+    "parallel": "ORT_PARALLEL",
+}
+
+
+def optimized_model_file(optimized_model_path, model_path, graph_optimization_level,
+        execution_mode, ort_version):
+    """
+    Path the optimized graph of a model is cached at: optimized_model_path
+    with a fingerprint of the source model file and of the settings the
+    graph was optimized with inserted before its extension, so that a graph
+    optimized from another model, variant or level is never reused.
+    """
+    stat = os.stat(model_path)
+    fingerprint = json.dumps([os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns,
+        graph_optimization_level, execution_mode, ort_version])
+    root, ext = os.path.splitext(optimized_model_path)
+    return "{}.{}{}".format(root, hashlib.sha1(fingerprint.encode()).hexdigest()[:12],
+        ext or ".onnx")
+
+
+def create_session(model_path, intra_op_threads=0, inter_op_threads=0,
+        graph_optimization_level="all", execution_mode="sequential",
+        enable_cpu_mem_arena=True, enable_mem_pattern=True,
+        optimized_model_path=None, disable_prepacking=False):
+    """
+    Creates an onnxruntime InferenceSession on the CPU.
+
+    Args:
+        model_path : path to the .onnx model
+        intra_op_threads : threads used within an operator, 0 lets
+            onnxruntime pick
+        inter_op_threads : threads used across operators when
+            execution_mode is "parallel", 0 lets onnxruntime pick
+        graph_optimization_level : "disable", "basic", "extended" or "all"
+        execution_mode : "sequential" or "parallel"
+        enable_cpu_mem_arena : reuse memory across runs through an arena
+        enable_mem_pattern : preallocate memory based on the shapes seen in
+            earlier runs
+        optimized_model_path : if set, the optimized graph is saved next to
+            this path the first time the model is loaded, see
+            `optimized_model_file`. Later sessions of the same model and
+            settings load it directly and skip graph optimization.
+        disable_prepacking : use weights as they are stored instead of
+            repacking them for faster kernels. Weights stored as external data
+            are then memory-mapped from their file, so every process using the
+            model shares one copy, at the cost of slower inference.
+    """
+    if graph_optimization_level not in GRAPH_OPTIMIZATION_LEVELS:
+        raise ValueError("Unknown graph optimization level '{}', expected one of {}".format(
+            graph_optimization_level, sorted(GRAPH_OPTIMIZATION_LEVELS)))
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError("Unknown execution mode '{}', expected one of {}".format(
+            execution_mode, sorted(EXECUTION_MODES)))
+
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.graph_optimization_level = getattr(ort.GraphOptimizationLevel,
+        GRAPH_OPTIMIZATION_LEVELS[graph_optimization_level])
+    options.execution_mode = getattr(ort.ExecutionMode, EXECUTION_MODES[execution_mode])
+    options.enable_cpu_mem_arena = enable_cpu_mem_arena
+    options.enable_mem_pattern = enable_mem_pattern
+    if disable_prepacking:
+        options.add_session_config_entry("session.disable_prepacking", "1")
+
+    if optimized_model_path:
+        optimized_model_path = optimized_model_file(optimized_model_path, model_path,
+            graph_optimization_level, execution_mode, ort.__version__)
+        if os.path.exists(optimized_model_path):
+            # Graph was already optimized on a previous startup
+            model_path = optimized_model_path
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        else:
+            options.optimized_model_filepath = optimized_model_path
+
+    return ort.InferenceSession(model_path, sess_options=options,
+        providers=["CPUExecutionProvider"])
+
+
+def warm_up(session, runs=1):
+    """
+    Runs inference on zeros so that the first real request does not pay for
+    memory allocation and kernel setup. Symbolic dimensions are set to 1.
+
+    Returns:
+        Seconds taken by each warm-up run
+    """
+    feeds = {}
+    for model_input in session.get_inputs():
+        shape = [d if isinstance(d, int) and d > 0 else 1 for d in model_input.shape]
+        dtype = np.float16 if model_input.type == "tensor(float16)" else np.float32
+        feeds[model_input.name] = np.zeros(shape, dtype=dtype)
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        session.run(None, feeds)
+        times.append(time.perf_counter() - start)
+
+    return times
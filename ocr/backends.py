@@ -0,0 +1,191 @@
+"""
+OCR backends behind the /ocr routes. Each turns a list of encoded images
+into one {"text", "language"} result per image, so clients get the same
+response whichever backend read their images.
+
+`GoogleBackend` calls the Google Cloud Vision API, `LocalBackend` runs the
+ONNX models of ocr/local_engine.py on the CPU.
+"""
+import abc
+import base64
+import json
+import time
+
+import requests
+
+from ocr.vision_client import RETRY_STATUSES
+
+
+class OCRError(Exception):
+    """
+    Raised by a backend that could not read the images.
+
+    Args:
+        message : description of the error
+        status : HTTP status the routes answer with
+        body : JSON response body, eg. the Vision API's own error, or None
+        results : results of the first images, read before the error
+    """
+
+    def __init__(self, message, status=502, body=None, results=None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+        self.results = results or []
+
+
+class OCRUnavailable(OCRError):
+    """
+    The backend timed out, could not be reached, or failed on its side.
+    Another backend may still answer.
+    """
+
+
+class OCRNotConfigured(OCRUnavailable):
+    """
+    The backend is missing its API key or models.
+    """
+
+    def __init__(self, message):
+        super().__init__(message, status=503)
+
+
+def annotation_result(annotation):
+    """
+    Extracts text and language from one Vision API AnnotateImageResponse.
+
+    Returns:
+        dict with the detected "text" as a single string and its "language",
+        or with the "error" message if the Vision API could not read the
+        image
+    """
+    if "error" in annotation:
+        return {"error": annotation["error"].get("message", "Vision API error")}
+    txt = "No text detected"
+    language = "en"
+    if "fullTextAnnotation" in annotation:
+        txt = annotation["fullTextAnnotation"]["text"].replace("\n", " ")
+        language = annotation["textAnnotations"][0]["locale"]
+    return {"text" : txt, "language": language}
+
+
+class OCRBackend(abc.ABC):
+    """
+    Interface of OCR backends.
+    """
+    # Name selecting the backend, and processing stage its time is recorded
+    # under in vizia_stage_seconds
+    name = None
+    stage = None
+
+    @abc.abstractmethod
+    def available(self):
+        """
+        True if the backend is configured.
+        """
+
+    @abc.abstractmethod
+    def recognize(self, images, detection_type, timeout=None):
+        """
+        Reads the text of encoded images.
+
+        Args:
+            images : list of JPEG or PNG encoded images
+            detection_type : "TEXT_DETECTION" or "DOCUMENT_TEXT_DETECTION"
+            timeout : seconds after which to give up, None for the
+                backend's own limits
+
+        Returns:
+            List with a {"text", "language"} dict per image, in order, or an
+            {"error"} dict for images that could not be read
+
+        Raises:
+            OCRError : with the results of the images read before the error
+        """
+
+
+class GoogleBackend(OCRBackend):
+    """
+    Google Cloud Vision API, up to `max_batch_size` images per call.
+
+    Args:
+        get_client : function returning the VisionClient, or None if there
+            is no API key
+        max_batch_size : images per images:annotate call (API limit: 16)
+    """
+    name = "google"
+    stage = "vision"
+
+    def __init__(self, get_client, max_batch_size=16):
+        self.get_client = get_client
+        self.max_batch_size = max_batch_size
+
+    def available(self):
+        return self.get_client() is not None
+
+    def recognize(self, images, detection_type, timeout=None):
+        client = self.get_client()
+        if client is None:
+            raise OCRNotConfigured("No Vision API key")
+
+        # The timeout applies to all calls together
+        end = time.perf_counter() + timeout if timeout is not None else None
+        results = []
+        for start in range(0, len(images), self.max_batch_size):
+            # One AnnotateImageRequest per image
+            vision_requests = [{
+                "image": {"content": base64.b64encode(data).decode("ascii")},
+                "features": [{"type": detection_type}]
+            } for data in images[start:start + self.max_batch_size]]
+
+            try:
+                google_response = client.annotate(vision_requests,
+                    deadline=end - time.perf_counter() if end is not None else None)
+            except requests.Timeout:
+                raise OCRUnavailable("Vision API timed out", status=504, results=results)
+            except requests.RequestException:
+                raise OCRUnavailable("Vision API unreachable", status=502, results=results)
+
+            if google_response.status_code != 200:
+                # Pass the API's error on. Rate limits and server errors let
+                # another backend answer.
+                error = OCRUnavailable if google_response.status_code in RETRY_STATUSES else OCRError
+                raise error("Vision API returned {}".format(google_response.status_code),
+                    status=google_response.status_code, body=google_response.content,
+                    results=results)
+
+            r = json.loads(google_response.text)
+            results += [annotation_result(annotation) for annotation in r["responses"]]
+        return results
+
+
+class LocalBackend(OCRBackend):
+    """
+    ONNX text detection and recognition models run on this machine.
+
+    Args:
+        read : function taking a list of encoded images and returning the
+            text of each, or None for images that could not be decoded, eg.
+            running tasks.local_ocr_task on the worker pool
+        configured : True if the models are set
+        language : ISO 639-1 code of the recognition model's language
+    """
+    name = "local"
+    stage = "local_ocr"
+
+    def __init__(self, read, configured, language="en"):
+        self.read = read
+        self.configured = configured
+        self.language = language
+
+    def available(self):
+        return self.configured
+
+    def recognize(self, images, detection_type, timeout=None):
+        if not self.configured:
+            raise OCRNotConfigured("No local OCR models")
+        texts = self.read(images)
+        if any(text is None for text in texts):
+            raise OCRError("Could not decode image", status=400)
+        return [{"text": text or "No text detected", "language": self.language}
+            for text in texts]
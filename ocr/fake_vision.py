@@ -0,0 +1,119 @@
+"""
+Local stand-in for the Google Cloud Vision images:annotate API, for testing
+and benchmarking the /ocr route without network access or an API key.
+
+    python -m ocr.fake_vision --port 8081 [--latency 0.2] [--fail-first 2]
+
+then start the server with VISION_ENDPOINT=http://127.0.0.1:8081/v1/images:annotate
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeVisionServer(ThreadingHTTPServer):
+    """
+    Answers every image with the same text.
+
+    Args:
+        address : (host, port) to listen on, port 0 picks a free port
+        text : text "detected" in every image
+        locale : language code returned with the text
+        latency : seconds to wait before answering
+        fail_first : number of requests answered with `fail_status` before
+            answering normally, to exercise retries
+        fail_status : HTTP status of failed requests
+    """
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), text="Hello world", locale="en",
+            latency=0.0, fail_first=0, fail_status=503):
+        super().__init__(address, _Handler)
+        self.text = text
+        self.locale = locale
+        self.latency = latency
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return "http://{}:{}/v1/images:annotate".format(host, port)
+
+    def start(self):
+        """
+        Serves requests on a background thread and returns self.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        with server._lock:
+            server.requests += 1
+            fail = server.requests <= server.fail_first
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if not self.path.startswith("/v1/images:annotate"):
+            self._send(404, {"error": {"code": 404, "message": "Not found"}})
+            return
+        if fail:
+            self._send(server.fail_status, {"error": {"code": server.fail_status,
+                "message": "Simulated failure"}})
+            return
+
+        responses = []
+        for _ in body.get("requests", []):
+            responses.append({
+                "textAnnotations": [{"locale": server.locale, "description": server.text}],
+                "fullTextAnnotation": {"text": server.text},
+            })
+        self._send(200, {"responses": responses})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--text", default="Hello world")
+    parser.add_argument("--locale", default="en")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--fail-status", type=int, default=503)
+    args = parser.parse_args()
+
+    server = FakeVisionServer((args.host, args.port), text=args.text,
+        locale=args.locale, latency=args.latency, fail_first=args.fail_first,
+        fail_status=args.fail_status)
+    print("Fake Vision API running on {}".format(server.endpoint))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Offline OCR on the CPU with ONNX text detection and recognition models, an
+alternative to the Vision API. Made for PaddleOCR's PP-OCR models exported
+to ONNX: a DB (differentiable binarization) detector predicting a text
+probability map, and a CRNN recognizer predicting character probabilities
+along each text line, decoded with CTC.
+"""
+import cv2
+import numpy as np
+
+
+# Detector input normalization, applied to BGR images like PaddleOCR does
+DET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+DET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# Longest side images are resized to for detection. Both sides are rounded
+# to a multiple of 32.
+DET_MAX_SIDE = 960
+
+# Probability above which a pixel is text, and mean probability a text
+# region needs to be kept
+DET_THRESHOLD = 0.3
+DET_BOX_THRESHOLD = 0.6
+
+# The detector predicts shrunk text regions, they are grown back by their
+# area times this ratio divided by their perimeter
+DET_UNCLIP_RATIO = 1.5
+
+# Regions with a side shorter than this, in probability map pixels, are noise
+DET_MIN_SIZE = 3
+DET_MAX_REGIONS = 1000
+
+# Recognizer input height when the model does not fix it, widest input, and
+# number of text lines recognized per run
+REC_HEIGHT = 48
+REC_MAX_WIDTH = 2048
+REC_BATCH_SIZE = 8
+
+# Lines recognized with a lower mean character probability are dropped
+REC_MIN_SCORE = 0.5
+
+
+def load_charset(path):
+    """
+    Characters of a recognition model from its dictionary file, one per
+    line, in the order of the model's output. The CTC blank comes first in
+    the output, a space last.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\r\n") for line in f] + [" "]
+
+
+def order_points(box):
+    """
+    Orders the 4 corners of a box as top-left, top-right, bottom-right and
+    bottom-left.
+    """
+    s = box.sum(1)
+    diff = box[:, 1] - box[:, 0]
+    return np.array([box[s.argmin()], box[diff.argmin()], box[s.argmax()], box[diff.argmax()]],
+        dtype=np.float32)
+
+
+def region_score(prob, contour):
+    """
+    Mean text probability inside a contour.
+    """
+    x, y, w, h = cv2.boundingRect(contour)
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.fillPoly(mask, [contour.reshape(-1, 2) - (x, y)], 1)
+    return cv2.mean(prob[y:y + h, x:x + w], mask)[0]
+
+
+def unclip(rect):
+    """
+    Grows a rotated rectangle ((cx, cy), (w, h), angle) predicted by the
+    detector back to the size of its text.
+    """
+    center, (w, h), angle = rect
+    distance = w * h * DET_UNCLIP_RATIO / (2 * (w + h))
+    return center, (w + 2 * distance, h + 2 * distance), angle
+
+
+def reading_order(boxes):
+    """
+    Sorts boxes top to bottom, and left to right within a line.
+    """
+    boxes = sorted(boxes, key=lambda b: (b[0][1], b[0][0]))
+    for i in range(len(boxes) - 1):
+        for j in range(i, -1, -1):
+            if abs(boxes[j + 1][0][1] - boxes[j][0][1]) < 10 and \
+                    boxes[j + 1][0][0] < boxes[j][0][0]:
+                boxes[j], boxes[j + 1] = boxes[j + 1], boxes[j]
+            else:
+                break
+    return boxes
+
+
+def detect_text(session, img):
+    """
+    Finds text lines in a BGR image.
+
+    Returns:
+        List of boxes in reading order, each a (4, 2) float32 array of
+        corners in image coordinates, clockwise from the top-left
+    """
+    height, width = img.shape[:2]
+    scale = min(1.0, DET_MAX_SIDE / max(height, width))
+    det_height = max(32, int(round(height * scale / 32)) * 32)
+    det_width = max(32, int(round(width * scale / 32)) * 32)
+    resized = cv2.resize(img, (det_width, det_height))
+
+    tensor = ((resized.astype(np.float32) / 255 - DET_MEAN) / DET_STD).transpose(2, 0, 1)
+    feeds = {session.get_inputs()[0].name: np.ascontiguousarray(tensor[None])}
+    prob = session.run(None, feeds)[0].reshape(det_height, det_width)
+
+    mask = (prob > DET_THRESHOLD).astype(np.uint8)
+    contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for contour in contours[:DET_MAX_REGIONS]:
+        rect = cv2.minAreaRect(contour)
+        if min(rect[1]) < DET_MIN_SIZE or region_score(prob, contour) < DET_BOX_THRESHOLD:
+            continue
+        rect = unclip(rect)
+        if min(rect[1]) < DET_MIN_SIZE + 2:
+            continue
+        box = cv2.boxPoints(rect)
+        box[:, 0] = np.clip(box[:, 0] * width / det_width, 0, width - 1)
+        box[:, 1] = np.clip(box[:, 1] * height / det_height, 0, height - 1)
+        boxes.append(order_points(box))
+    return reading_order(boxes)
+
+
+def crop_box(img, box):
+    """
+    Straightens the text inside a box into its own image. Vertical lines
+    are rotated to be horizontal.
+    """
+    width = int(max(np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[3] - box[2])))
+    height = int(max(np.linalg.norm(box[0] - box[3]), np.linalg.norm(box[1] - box[2])))
+    width, height = max(1, width), max(1, height)
+    target = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype=np.float32)
+    crop = cv2.warpPerspective(img, cv2.getPerspectiveTransform(box, target), (width, height),
+        borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if height >= 1.5 * width:
+        crop = np.ascontiguousarray(np.rot90(crop))
+    return crop
+
+
+def ctc_decode(probs, charset):
+    """
+    Greedy CTC decoding of (N, T, C) character probabilities: the most
+    likely character at each step, with repeats merged and blanks dropped.
+
+    Returns:
+        List of (text, mean probability of its characters)
+    """
+    indices = probs.argmax(2)
+    scores = probs.max(2)
+    results = []
+    for line, line_scores in zip(indices, scores):
+        keep = np.ones(len(line), dtype=bool)
+        keep[1:] = line[1:] != line[:-1]
+        keep &= (line > 0) & (line <= len(charset))
+        text = "".join(charset[i - 1] for i in line[keep])
+        results.append((text, float(line_scores[keep].mean()) if keep.any() else 0.0))
+    return results
+
+
+def recognize_text(session, crops, charset):
+    """
+    Reads the text of each straightened text line image (BGR).
+
+    Returns:
+        List with the text of each crop, empty when not confidently read
+    """
+    model_input = session.get_inputs()[0]
+    height = model_input.shape[2] if isinstance(model_input.shape[2], int) else REC_HEIGHT
+    fixed_width = model_input.shape[3] if isinstance(model_input.shape[3], int) else None
+
+    # Lines of similar widths are batched together to limit padding
+    order = sorted(range(len(crops)), key=lambda i: crops[i].shape[1] / crops[i].shape[0])
+    texts = [""] * len(crops)
+    for start in range(0, len(order), REC_BATCH_SIZE):
+        batch = order[start:start + REC_BATCH_SIZE]
+        width = fixed_width or min(REC_MAX_WIDTH,
+            int(np.ceil(height * max(crops[i].shape[1] / crops[i].shape[0] for i in batch))))
+
+        # Padding stays 0, the middle of the normalized range
+        tensor = np.zeros((len(batch), 3, height, width), dtype=np.float32)
+        for slot, i in enumerate(batch):
+            crop = crops[i]
+            crop_width = min(width, max(1, int(np.ceil(height * crop.shape[1] / crop.shape[0]))))
+            resized = cv2.resize(crop, (crop_width, height)).astype(np.float32)
+            tensor[slot, :, :, :crop_width] = ((resized / 255 - 0.5) / 0.5).transpose(2, 0, 1)
+
+        probs = session.run(None, {model_input.name: tensor})[0]
+        for i, (text, score) in zip(batch, ctc_decode(probs, charset)):
+            if score >= REC_MIN_SCORE:
+                texts[i] = text.strip()
+    return texts
+
+
+def read_text(det_session, rec_session, charset, img):
+    """
+    Detects and recognizes the text of a BGR image.
+
+    Returns:
+        The text lines found, in reading order, joined by spaces
+    """
+    boxes = detect_text(det_session, img)
+    if not boxes:
+        return ""
+    texts = recognize_text(rec_session, [crop_box(img, box) for box in boxes], charset)
+    return " ".join(text for text in texts if text)
@@ -0,0 +1,212 @@
+import collections
+import random
+import threading
+import time
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+DEFAULT_ENDPOINT = "https://vision.googleapis.com/v1/images:annotate"
+
+# Responses worth retrying: rate limited or a server side error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ClientStats:
+    """
+    Request counts and timings of a VisionClient. Time spent opening
+    connections (TCP and TLS handshakes) is tracked separately from the time
+    spent waiting on the Vision API itself.
+    """
+
+    def __init__(self, history=1000):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._upstream = collections.deque(maxlen=history)
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.connections = 0
+        self.connect_seconds = 0.0
+        self.upstream_seconds = 0.0
+
+    def record_connect(self, seconds):
+        self._local.connect = getattr(self._local, "connect", 0.0) + seconds
+        with self._lock:
+            self.connections += 1
+            self.connect_seconds += seconds
+
+    def begin_attempt(self):
+        self._local.connect = 0.0
+
+    def end_attempt(self, seconds, retry=False, error=False):
+        """
+        Records one HTTP attempt that took `seconds` in total, and returns the
+        part of it spent opening a connection.
+        """
+        connect = getattr(self._local, "connect", 0.0)
+        with self._lock:
+            self.requests += 1
+            self.retries += int(retry)
+            self.errors += int(error)
+            self.upstream_seconds += seconds - connect
+            self._upstream.append(seconds - connect)
+        return connect
+
+    def snapshot(self):
+        with self._lock:
+            upstream = np.array(self._upstream)
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "connections_opened": self.connections,
+                "connect_seconds": self.connect_seconds,
+                "upstream_seconds": self.upstream_seconds,
+                "upstream_p50_ms": 1000 * float(np.percentile(upstream, 50))
+                    if len(upstream) else 0.0,
+                "upstream_p95_ms": 1000 * float(np.percentile(upstream, 95))
+                    if len(upstream) else 0.0,
+            }
+
+
+class _TimedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections report how long they took to open.
+    """
+
+    def __init__(self, stats, **kwargs):
+        self._stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self._stats
+
+        class TimedHTTPConnection(HTTPConnection):
+            def connect(self):
+                start = time.perf_counter()
+                super().connect()
+                stats.record_connect(time.perf_counter() - start)
+
+        class TimedHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                start = time.perf_counter()
+                super().connect()
+                stats.record_connect(time.perf_counter() - start)
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = TimedHTTPConnection
+
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = TimedHTTPSConnection
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+class VisionClient:
+    """
+    Client for the Google Cloud Vision images:annotate API
+    (https://cloud.google.com/vision/docs/reference/rest/v1/images/annotate).
+
+    Connections are kept alive and shared between requests through a pool.
+    Every call has connect and read timeouts, and calls that fail with a
+    connection error, a timeout, 429 or 5xx are retried with exponential
+    backoff and jitter.
+    """
+
+    def __init__(self, api_key, endpoint=DEFAULT_ENDPOINT, pool_size=10,
+            connect_timeout=3.05, read_timeout=30.0, max_retries=3,
+            backoff=0.5, max_backoff=8.0):
+        """
+        Args:
+            api_key : Google Cloud Vision API key
+            endpoint : URL of the images:annotate method
+            pool_size : number of connections kept open for reuse
+            connect_timeout : seconds to wait for a connection to open
+            read_timeout : seconds to wait for the API to respond
+            max_retries : retries after the first attempt
+            backoff : base delay in seconds, doubled after every retry
+            max_backoff : longest delay between two attempts
+        """
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = ClientStats()
+
+        adapter = _TimedAdapter(self.stats, pool_connections=1,
+            pool_maxsize=pool_size, pool_block=False, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _delay(self, attempt, response=None):
+        """
+        Seconds to wait before the next attempt. Full jitter: a random delay
+        up to the exponential backoff, or the server's Retry-After if longer.
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is not None:
+            try:
+                delay = max(delay, min(self.max_backoff,
+                    float(response.headers.get("Retry-After", 0))))
+            except ValueError:
+                pass
+        return delay
+
+    def annotate(self, requests_list, deadline=None):
+        """
+        Sends a list of AnnotateImageRequest dicts in one call.
+
+        Args:
+            requests_list : AnnotateImageRequest dicts
+            deadline : if set, seconds after which to stop waiting and
+                retrying, on top of the per attempt timeouts
+
+        Returns:
+            requests.Response of the last attempt
+
+        Raises:
+            requests.Timeout, requests.ConnectionError : if every attempt failed
+                to get a response
+        """
+        payload = {"requests": requests_list}
+        params = {"key": self.api_key}
+        end = time.perf_counter() + deadline if deadline is not None else None
+
+        for attempt in range(self.max_retries + 1):
+            timeout = self.timeout
+            if end is not None:
+                remaining = end - time.perf_counter()
+                if remaining <= 0:
+                    raise requests.Timeout("Vision API deadline exceeded")
+                timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+            last_attempt = attempt == self.max_retries
+            self.stats.begin_attempt()
+            start = time.perf_counter()
+            try:
+                response = self.session.post(self.endpoint, params=params,
+                    json=payload, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                self.stats.end_attempt(time.perf_counter() - start,
+                    retry=not last_attempt, error=True)
+                if last_attempt:
+                    raise
+                time.sleep(self._delay(attempt))
+                continue
+
+            retry = response.status_code in RETRY_STATUSES and not last_attempt
+            self.stats.end_attempt(time.perf_counter() - start, retry=retry,
+                error=response.status_code != 200)
+            if not retry:
+                return response
+            time.sleep(self._delay(attempt, response))
@@ -0,0 +1,178 @@
+"""
+Opt-in cProfile profiling of individual requests.
+
+A profiled request records the handler itself, and work it hands to the
+worker pool is profiled on the worker and merged into the same profile.
+Profiles are kept in memory, keyed by request id.
+
+A cProfile profiler records everything its thread runs, and all request
+handlers share one thread under eventlet, so one request at a time is
+profiled per process. Requests arriving meanwhile are not profiled, but
+they still run: while the profiled request waits on the worker pool or the
+network, the profile records the eventlet hub (eg. eventlet/hubs/hub.py:run)
+and whatever other requests, streams and socket events run meanwhile (eg.
+greenio/base.py:recv). Only work done on the worker pool is profiled on its
+own. Profile an otherwise idle server, or read the handler's own entries
+and ignore the rest.
+"""
+import collections
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+
+
+# Held while a request is profiled in this process
+_active = threading.Lock()
+
+
+class _RawStats:
+    """
+    Wraps a stats dict from another thread or process so that pstats can
+    load it like a profiler.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def call_profiled(fn, args, kwargs):
+    """
+    Runs fn(*args, **kwargs) under cProfile.
+
+    Returns:
+        [result, stats]: The result of fn, and the profile as a picklable
+            pstats dict that can be merged with RequestProfile.add, or None
+            if another profiler already records this thread
+    """
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+ allows one profiler per process, the request's
+        return fn(*args, **kwargs), None
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        profile.disable()
+    profile.create_stats()
+    return result, profile.stats
+
+
+class RequestProfile:
+    """
+    Profile of a single request.
+    """
+
+    def __init__(self, request_id, route):
+        self.request_id = request_id
+        self.route = route
+        self.started = time.time()
+        self.seconds = None
+        self._profile = cProfile.Profile()
+        self._worker_stats = []
+        self._lock = threading.Lock()
+        self._start = None
+
+    def start(self):
+        """
+        Starts profiling the calling thread. Returns False, profiling
+        nothing, if another request is being profiled in this process.
+        """
+        if not _active.acquire(blocking=False):
+            return False
+        try:
+            self._profile.enable()
+        except ValueError:
+            # Another profiler is enabled, eg. by a debugger
+            _active.release()
+            return False
+        self._start = time.perf_counter()
+        return True
+
+    def stop(self):
+        """
+        Stops a profile that started.
+        """
+        self._profile.disable()
+        self.seconds = time.perf_counter() - self._start
+        _active.release()
+
+    def add(self, stats):
+        """
+        Merges the stats of work done for this request elsewhere, see
+        `call_profiled`.
+        """
+        if stats is None:
+            return
+        with self._lock:
+            self._worker_stats.append(stats)
+
+    def stats(self):
+        """
+        Returns the merged profile as a pstats.Stats.
+        """
+        stats = pstats.Stats(self._profile, stream=io.StringIO())
+        with self._lock:
+            for worker_stats in self._worker_stats:
+                stats.add(_RawStats(worker_stats))
+        return stats
+
+    def report(self, sort="cumulative", limit=50):
+        """
+        Human readable table of the most expensive functions.
+        """
+        stream = io.StringIO()
+        stats = self.stats()
+        stats.stream = stream
+        stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def dump(self):
+        """
+        Profile in the binary format of pstats.Stats.dump_stats, readable by
+        pstats, snakeviz, etc.
+        """
+        return marshal.dumps(self.stats().stats)
+
+    def summary(self):
+        return {
+            "request_id": self.request_id,
+            "route": self.route,
+            "started": self.started,
+            "seconds": self.seconds,
+        }
+
+
+class ProfileStore:
+    """
+    The most recent `max_profiles` request profiles.
+    """
+
+    def __init__(self, max_profiles=100):
+        self.max_profiles = max_profiles
+        self._profiles = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles[profile.request_id] = profile
+            self._profiles.move_to_end(profile.request_id)
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, request_id):
+        with self._lock:
+            return self._profiles.get(request_id)
+
+    def list(self):
+        """
+        Summaries of the stored profiles, most recent first.
+        """
+        with self._lock:
+            return [profile.summary() for profile in reversed(self._profiles.values())]
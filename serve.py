@@ -0,0 +1,167 @@
+"""
+Production launcher running the server on every core. The app is imported
+and the color palette built once, then worker processes are forked and
+serve the app on a shared port, sharing those pages copy-on-write. Each
+worker creates its own onnxruntime session after the fork, since
+onnxruntime's threads do not survive it. To share the model weights as well,
+store them as external data and set ORT_DISABLE_PREPACKING, so that every
+session memory-maps the same file.
+
+    python serve.py [--host 0.0.0.0] [--port 5000] [--workers 4]
+
+Socket.IO events emitted by one worker, eg. results sent to a
+socket_emit_path, reach clients connected to another through a message
+queue: a local broker process (see message_queue.py), or
+SOCKETIO_MESSAGE_QUEUE if it is set. Socket.IO clients have to use the
+websocket transport, since long-polling needs every request of a session to
+reach the same worker.
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import traceback
+
+
+def start_broker(path):
+    """
+    Forks the message broker. Returns its pid.
+    """
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            from message_queue import Broker
+            Broker(path).serve_forever()
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os._exit(1)
+    return pid
+
+
+def start_worker(listener, preload):
+    """
+    Forks a worker serving the app on the listening socket. Returns its pid.
+    """
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        status = 1
+        try:
+            import eventlet.hubs
+            import eventlet.wsgi
+            from eventlet.greenio import GreenSocket
+
+            import app
+
+            # Start from a fresh event hub rather than one created before forking
+            eventlet.hubs.use_hub()
+            if preload:
+                app.tasks.init_worker()
+            eventlet.wsgi.server(GreenSocket(listener), app.app, log_output=False)
+            status = 0
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000,
+        help="0 picks an available port")
+    parser.add_argument("--workers", type=int, default=0,
+        help="worker processes, 0 uses one per CPU")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    # Split the cores between workers, unless configured otherwise
+    threads = str(max(1, (os.cpu_count() or 1) // workers))
+    os.environ.setdefault("WORKER_POOL_SIZE", threads)
+    os.environ.setdefault("ORT_INTRA_OP_THREADS", threads)
+
+    # Serving preloads unless told otherwise, so that no request pays for it
+    os.environ.setdefault("PRELOAD", "1")
+
+    # The broker is forked before the app is loaded, so it stays small
+    broker = broker_dir = None
+    if not os.environ.get("SOCKETIO_MESSAGE_QUEUE"):
+        broker_dir = tempfile.mkdtemp(prefix="vizia-")
+        broker_path = os.path.join(broker_dir, "socketio.sock")
+        broker = start_broker(broker_path)
+        os.environ["SOCKETIO_MESSAGE_QUEUE"] = "local://" + broker_path
+
+    # onnxruntime sessions are created by the workers, with PRELOAD as soon
+    # as they start
+    import config
+    preload = config.PRELOAD
+    config.PRELOAD = False
+
+    # Everything loaded here is shared by the workers, onnxruntime included
+    # although its sessions are not
+    import onnxruntime
+    import app
+    app.tasks.color_palette()
+    app.get_vision_client()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(1024)
+    listener.setblocking(False)
+
+    children = {start_worker(listener, preload) for _ in range(workers)}
+    print("Server running on http://{}:{} with {} workers".format(
+        args.host, listener.getsockname()[1], workers), flush=True)
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Replace workers (and the broker) that exit until asked to stop
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid == broker:
+            broker = None
+            if not stopping:
+                print("Message broker exited, restarting it", file=sys.stderr)
+                broker = start_broker(broker_path)
+            continue
+        children.discard(pid)
+        if not stopping:
+            print("Worker {} exited with status {}, restarting it".format(
+                pid, os.waitstatus_to_exitcode(status)), file=sys.stderr)
+            time.sleep(1)
+            children.add(start_worker(listener, preload))
+
+    if broker is not None:
+        os.kill(broker, signal.SIGTERM)
+        os.waitpid(broker, 0)
+    if broker_dir is not None:
+        shutil.rmtree(broker_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import collections
+import threading
+
+
+OPERATIONS = ["color", "color_2", "color_3", "money", "ocr"]
+
+
+class FrameStream:
+    """
+    Frames streamed by one Socket.IO client, waiting to be processed.
+
+    At most `max_pending` frames are kept. When frames arrive faster than
+    they are processed, the oldest pending frame is dropped, so results
+    always describe a recent frame and latency stays bounded.
+    """
+
+    def __init__(self, operation, params, create_event, max_pending=1):
+        """
+        Args:
+            operation : one of OPERATIONS
+            params : operation parameters, eg. {"k": 3}
+            create_event : function creating an event object suited to the
+                server's async mode, eg. socketio.server.eio.create_event
+            max_pending : largest number of frames waiting to be processed
+        """
+        if operation not in OPERATIONS:
+            raise ValueError("Unknown operation '{}', expected one of {}".format(
+                operation, OPERATIONS))
+
+        self.operation = operation
+        self.params = params
+        self.max_pending = max(1, max_pending)
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.closed = False
+        self._frames = collections.deque()
+        self._lock = threading.Lock()
+        self._ready = create_event()
+
+    def put(self, frame):
+        """
+        Queues a frame, dropping the oldest pending one if the queue is full.
+
+        Returns:
+            True if a frame was dropped
+        """
+        with self._lock:
+            self.received += 1
+            dropped = len(self._frames) >= self.max_pending
+            if dropped:
+                self._frames.popleft()
+                self.dropped += 1
+            self._frames.append((self.received, frame))
+            self._ready.set()
+        return dropped
+
+    def get(self):
+        """
+        Waits for the next frame.
+
+        Returns:
+            (sequence number, frame), or None once the stream is closed
+        """
+        while True:
+            with self._lock:
+                if self.closed:
+                    return None
+                if self._frames:
+                    self.processed += 1
+                    return self._frames.popleft()
+                self._ready.clear()
+            self._ready.wait()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._frames.clear()
+            self._ready.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "received": self.received,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "pending": len(self._frames),
+            }
@@ -0,0 +1,197 @@
+"""
+CPU-bound work run by the worker pool.
+
+The color palette and the ONNX sessions are loaded once per process, the
+first time a task needs them, or up front by `init_worker` when the server
+preloads them. That is once in the server process when work runs on
+threads, and once in every worker when work runs on processes. Functions
+here are module level so they can be sent to process workers.
+"""
+import threading
+
+import cv2
+import numpy as np
+
+import config
+from color_detection.detect import detect_color, detect_color_2, detect_color_3
+from color_detection.palette import get_palette
+from money_classification.batching import batch_size_limit
+from money_classification.model_inference import IMG_SIZE, predict, preprocess_img
+from money_classification.quantize import variant_path
+from money_classification.session import create_session, warm_up
+from ocr.local_engine import load_charset, read_text
+
+
+# Loaded on first use, see color_palette, money_session and ocr_models
+palette = None
+ort_sess = None
+ocr_engine = None
+_load_lock = threading.Lock()
+
+
+def session_options():
+    """
+    onnxruntime settings shared by every model.
+    """
+    return dict(intra_op_threads=config.ORT_INTRA_OP_THREADS,
+        inter_op_threads=config.ORT_INTER_OP_THREADS,
+        graph_optimization_level=config.ORT_GRAPH_OPTIMIZATION_LEVEL,
+        execution_mode=config.ORT_EXECUTION_MODE,
+        enable_cpu_mem_arena=config.ORT_ENABLE_CPU_MEM_ARENA,
+        enable_mem_pattern=config.ORT_ENABLE_MEM_PATTERN,
+        disable_prepacking=config.ORT_DISABLE_PREPACKING)
+
+
+def load_money_session():
+    """
+    Loads in ONNX model as an inference session and warms it up so the first
+    request does not pay for it.
+    """
+    session = create_session(
+        variant_path(config.MONEY_MODEL_PATH, config.MONEY_MODEL_VARIANT),
+        optimized_model_path=config.ORT_OPTIMIZED_MODEL_PATH or None,
+        **session_options())
+    warm_up(session, config.ORT_WARMUP_RUNS)
+    return session
+
+
+def color_palette():
+    """
+    The color palette of this process, loaded on first use.
+    """
+    global palette
+    if palette is None:
+        with _load_lock:
+            if palette is None:
+                # Build the color name lookup table once
+                palette = get_palette(config.COLOR_PALETTE, config.COLOR_LUT_BITS,
+                    config.COLOR_METRIC, config.COLOR_LUT_CACHE_DIR or None)
+    return palette
+
+
+def money_session():
+    """
+    The ONNX session of this process, loaded on first use.
+    """
+    global ort_sess
+    if ort_sess is None:
+        with _load_lock:
+            if ort_sess is None:
+                ort_sess = load_money_session()
+    return ort_sess
+
+
+def local_ocr_configured():
+    """
+    True if the local OCR models are set.
+    """
+    return bool(config.OCR_LOCAL_DET_MODEL_PATH and config.OCR_LOCAL_REC_MODEL_PATH
+        and config.OCR_LOCAL_CHARSET_PATH)
+
+
+def ocr_models():
+    """
+    The local OCR detection session, recognition session and character set
+    of this process, loaded on first use.
+    """
+    global ocr_engine
+    if ocr_engine is None:
+        with _load_lock:
+            if ocr_engine is None:
+                ocr_engine = (create_session(config.OCR_LOCAL_DET_MODEL_PATH, **session_options()),
+                    create_session(config.OCR_LOCAL_REC_MODEL_PATH, **session_options()),
+                    load_charset(config.OCR_LOCAL_CHARSET_PATH))
+    return ocr_engine
+
+
+def init_worker():
+    """
+    Loads the color palette and the ONNX sessions in this process now rather
+    than on the first request that needs them.
+    """
+    color_palette()
+    money_session()
+    if local_ocr_configured():
+        ocr_models()
+
+
+def color_sampling():
+    """
+    Pixel sampling options of k-means color detection.
+    """
+    return dict(max_pixels=config.COLOR_SAMPLE_PIXELS or None,
+        method=config.COLOR_SAMPLE_METHOD,
+        resize=config.COLOR_SAMPLE_RESIZE,
+        exact_counts=config.COLOR_EXACT_COUNTS)
+
+
+def detect_color_task(img, k):
+    """
+    Color names and [R, G, B] values of the top k colors, using k-means.
+    """
+    return detect_color(img, k, color_palette(), **color_sampling())
+
+
+def track_color_task(img, k, previous):
+    """
+    Like `detect_color_task` for a frame of a video, continuing from the
+    KMeansState of the previous frame (or None). Returns the color names,
+    [R, G, B] values and the KMeansState for the next frame.
+    """
+    return detect_color(img, k, color_palette(), return_state=True, previous=previous,
+        restart_ratio=config.COLOR_KMEANS_RESTART_RATIO, **color_sampling())
+
+
+def detect_color_2_task(img, k):
+    """
+    Color names of the top k colors, using per pixel matching.
+    """
+    return list(detect_color_2(img, k, color_palette(),
+        max_bytes=config.COLOR_MATCH_MAX_BYTES))
+
+
+def detect_color_3_task(img, k):
+    """
+    Color names and mean [R, G, B] values of the top k colors, using a color
+    histogram.
+    """
+    return detect_color_3(img, k, color_palette(), max_bytes=config.COLOR_MATCH_MAX_BYTES)
+
+
+def classify_money_task(batch):
+    """
+    Class names for a preprocessed (B, 3, H, W) batch. Batches larger than a
+    fixed model batch dimension are run in several parts.
+    """
+    session = money_session()
+    batch_dim = session.get_inputs()[0].shape[0]
+    limit = batch_size_limit(batch_dim, len(batch))
+
+    predictions = []
+    for start in range(0, len(batch), limit):
+        predictions += predict(session, batch[start:start + limit])
+    return predictions
+
+
+def classify_money_images_task(imgs):
+    """
+    Class names for a list of RGB images, run through the model as one batch.
+    """
+    batch = np.empty((len(imgs), 3, IMG_SIZE[1], IMG_SIZE[0]), dtype=np.float32)
+    for i, img in enumerate(imgs):
+        preprocess_img(img, out=batch[i])
+    return classify_money_task(batch)
+
+
+def local_ocr_task(images):
+    """
+    Text of each encoded image read by the local OCR models, or None for
+    images that could not be decoded.
+    """
+    det_session, rec_session, charset = ocr_models()
+    texts = []
+    for data in images:
+        # Decoded upright (EXIF orientation applied) and in BGR order
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        texts.append(None if img is None else read_text(det_session, rec_session, charset, img))
+    return texts
@@ -1,10 +1,11 @@
 # https://gist.github.com/kylehounslow/767fb72fde2ebdd010a0bf4242371594
-import base64
 import json
 
 import requests
 import cv2
 
+from image_utils import pack_images
+
 
 # URL = "http://127.0.0.1:5000"
 URL = "https://3e6b-2607-fea8-1ca4-b000-387e-d423-83cc-135f.ngrok.io"
@@ -55,16 +56,15 @@ def ocr_test(filename):
     headers = {"content-type": content_type}
     params = {"type": "TEXT_DETECTION", "socket_emit_path": IOS_RESULTS}
 
-    # Load image and encode as base64 string
+    # Load image as jpg bytes, the server base64 encodes it for the Vision API
     img = cv2.imread(filename)
     _, img_arr = cv2.imencode('.jpg', img)
     img_bytes = img_arr.tobytes()
-    encoded_img = base64.b64encode(img_bytes)
 
     # Send request
     response = requests.post(
         url = "{}/ocr".format(URL),
-        data = encoded_img,
+        data = img_bytes,
         headers = headers,
         params = params
     )
@@ -98,6 +98,32 @@ def money_classification_test(filename):
     return json.loads(response.text)
 
 
+def color_detection_batch_test(filenames):
+    # prepare headers for http request
+    content_type = "application/octet-stream"
+    headers = {"content-type": content_type}
+    params = {"k": 3, "socket_emit_path": IOS_INFO}
+
+    # encode each image as jpeg and pack them into one length-prefixed body
+    images = []
+    for filename in filenames:
+        _, img_encoded = cv2.imencode(".jpg", cv2.imread(filename))
+        images.append(img_encoded.tobytes())
+
+    # Send request
+    response = requests.post(
+        url = "{}/detect_color_batch".format(URL),
+        data = pack_images(images),
+        headers = headers,
+        params = params
+    )
+
+    if response.status_code != 200:
+        print("detect_color_batch error")
+    else:
+        return json.loads(response.text)
+
+
 def socket_test(path, msg, language):
     params = {"path": path, "language" : language}
     requests.post(
@@ -112,6 +138,10 @@ if __name__ == "__main__":
     response = color_detection_test("test_images/color_detection/flowers.jpg")
     print(response)
 
+    response = color_detection_batch_test(["test_images/color_detection/flowers.jpg",
+        "test_images/color_detection/leaves.jpg"])
+    print(response)
+
     # OCR test
     response = ocr_test("test_images/ocr/eardrops.jpg")
     print(response)
@@ -0,0 +1,158 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from profiling import call_profiled
+
+
+def picklable(value):
+    """
+    Copies memoryviews, eg. of request bodies, in value (or in a tuple or
+    list) to bytes, so they can be sent to a process worker.
+    """
+    if isinstance(value, memoryview):
+        return bytes(value)
+    if isinstance(value, tuple):
+        return tuple(picklable(item) for item in value)
+    if isinstance(value, list):
+        return [picklable(item) for item in value]
+    return value
+
+
+class WorkerPool:
+    """
+    Runs CPU-bound work (decoding, k-means, model inference) outside of the
+    Socket.IO event loop, so that one image being processed does not freeze
+    every other request and socket connection.
+
+    Work goes to a pool of threads, which suits OpenCV and onnxruntime since
+    both release the GIL, or a pool of processes. Callers wait for results
+    in a way that lets the event loop keep serving other clients.
+
+    Workers are started on first use. Process workers are spawned and
+    re-import the main module, so they must not submit work at import time.
+    """
+
+    def __init__(self, kind="thread", size=None, async_mode="threading",
+            initializer=None, initargs=(), profiler=None):
+        """
+        Args:
+            kind : "thread", "process", or "none" to run work inline
+            size : number of workers, defaults to the number of CPUs
+            async_mode : Flask-SocketIO async mode ("eventlet", "gevent" or
+                "threading"), decides how callers wait for results
+            initializer : function run once in every process worker, eg. to
+                load models
+            initargs : arguments of initializer
+            profiler : function returning the profiling.RequestProfile of the
+                calling request, or None when it is not being profiled. Work
+                of profiled requests is profiled on the worker and merged in.
+        """
+        if kind not in ("thread", "process", "none"):
+            raise ValueError("Unknown worker pool '{}', expected thread, process or none".format(kind))
+
+        self.kind = kind
+        self.size = size or os.cpu_count() or 1
+        self.async_mode = async_mode
+        self.initializer = initializer
+        self.initargs = initargs
+        self.profiler = profiler
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self.kind == "none":
+            return None
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "thread":
+                    self._executor = ThreadPoolExecutor(self.size,
+                        thread_name_prefix="worker")
+                else:
+                    # Spawn rather than fork: onnxruntime's thread pools do
+                    # not survive fork
+                    self._executor = ProcessPoolExecutor(self.size,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=self.initializer, initargs=self.initargs)
+            return self._executor
+
+    def start(self):
+        """
+        Starts every process worker now rather than with the first tasks,
+        and waits until they have run the initializer.
+        """
+        if self.kind != "process":
+            return
+        futures = [self.executor.submit(os.getpid) for _ in range(self.size)]
+        for future in futures:
+            future.result()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Starts fn(*args, **kwargs) on a worker and returns its Future.
+        """
+        if self.kind == "process":
+            args = picklable(args)
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def wait(self, future):
+        """
+        Blocks the calling request until future is done, without blocking the
+        event loop, and returns its result.
+        """
+        if self.async_mode == "eventlet":
+            from eventlet import tpool
+            return tpool.execute(future.result)
+        elif self.async_mode == "gevent":
+            import gevent
+            return gevent.get_hub().threadpool.apply(future.result)
+        return future.result()
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) on a worker and returns its result.
+        """
+        if self.executor is None:
+            return fn(*args, **kwargs)
+
+        profile = self._profile()
+        if profile is None:
+            return self.wait(self.submit(fn, *args, **kwargs))
+        result, stats = self.wait(self.submit(call_profiled, fn, args, kwargs))
+        profile.add(stats)
+        return result
+
+    def map(self, fn, items, **kwargs):
+        """
+        Runs fn(item, **kwargs) for every item in parallel on the workers and
+        returns the results in order.
+        """
+        if self.executor is None:
+            return [fn(item, **kwargs) for item in items]
+
+        profile = self._profile()
+        if profile is None:
+            futures = [self.submit(fn, item, **kwargs) for item in items]
+            return [self.wait(future) for future in futures]
+
+        futures = [self.submit(call_profiled, fn, (item,), kwargs) for item in items]
+        results = []
+        for future in futures:
+            result, stats = self.wait(future)
+            profile.add(stats)
+            results.append(result)
+        return results
+
+    def _profile(self):
+        """
+        Profile of the calling request, or None.
+        """
+        return self.profiler() if self.profiler is not None else None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None